@@ -1,6 +1,8 @@
 import pytest
 from app import database
 import app.antispam as antispam
+import app.near_duplicates as near_duplicates
+import app.local_classifier as local_classifier
 
 # Lightweight async test support fallback (if pytest-asyncio not active)
 import asyncio, inspect, logging
@@ -39,6 +41,15 @@ def global_env(monkeypatch):
         database.not_spammers_cache.clear()
     if hasattr(database, 'not_seen_cache'):
         database.not_seen_cache.clear()
+    if hasattr(database, 'user_entry_cache'):
+        database.user_entry_cache.clear()
+    if hasattr(database, 'group_redirects'):
+        database.group_redirects.clear()
+    if hasattr(database, 'spam_groups_index'):
+        database.spam_groups_index.clear()
+    if hasattr(antispam, 'verdict_cache'):
+        antispam.verdict_cache.clear()
+    near_duplicates.near_duplicate_index.clear()
     if hasattr(database, 'debug_counter_spammer_queries'):
         database.debug_counter_spammer_queries = 0
     if hasattr(database, 'debug_counter_seen_queries'):
@@ -57,6 +68,9 @@ def global_env(monkeypatch):
         upper = msg.upper()
         return "SPAM" in upper or "FORWARDED" in upper
     monkeypatch.setattr(antispam, "check_openai_spam", default_check_openai_spam)
+    # История классификаций не пишется в БД, локальная модель не загружена
+    monkeypatch.setattr(local_classifier, "CLASSIFIER_HISTORY_ENABLED", False)
+    monkeypatch.setattr(local_classifier, "_model", None)
     # Важно: не переопределяем CAS здесь, чтобы специализированный тест мог подменить ClientSession сам.
 
     # Репозиторий: по умолчанию глобальный спамер определяется кэшем; seen — просто по seen_users_cache
@@ -1,15 +1,21 @@
+import asyncio
 import json
 from types import SimpleNamespace
 import pytest
 import app.antispam as antispam
 from app.config import INSTRUCTIONS_DEFAULT_TEXT
 
+# Настоящая функция: conftest подменяет antispam.check_openai_spam заглушкой
+check_openai_spam = antispam.check_openai_spam
+
 
 @pytest.fixture(autouse=True)
 def mock_external(monkeypatch):
-    # Mock OpenAI chat completion
+    # Вердикты не пишем в БД
+    monkeypatch.setattr(antispam, "VERDICT_CACHE_PERSIST", False)
+    # Mock OpenAI chat completion (AsyncOpenAI-клиент)
     class FakeChatCompletions:
-        def create(self, model, messages, response_format):  # type: ignore[override]
+        async def create(self, model, messages, response_format, timeout=None):  # type: ignore[override]
             user_msg = next(m for m in messages if m["role"] == "user") if isinstance(messages, list) else messages[-1]
             # support both dict-like and object params
             content = getattr(user_msg, "content", "") if not isinstance(user_msg, dict) else user_msg.get("content", "")
@@ -18,7 +24,8 @@ def mock_external(monkeypatch):
             return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=result))])
 
     # Attach fake completions object
-    monkeypatch.setattr(antispam.openai, "chat", SimpleNamespace(completions=FakeChatCompletions()))
+    monkeypatch.setattr(antispam, "get_openai_client",
+                        lambda: SimpleNamespace(chat=SimpleNamespace(completions=FakeChatCompletions())))
 
     # Mock aiohttp ClientSession for CAS
     class FakeResponse:
@@ -51,12 +58,12 @@ def mock_external(monkeypatch):
 
 @pytest.mark.asyncio
 async def test_openai_ham():
-    assert await antispam.check_openai_spam("This is a normal message", INSTRUCTIONS_DEFAULT_TEXT) is False
+    assert await check_openai_spam("This is a normal message", INSTRUCTIONS_DEFAULT_TEXT) is False
 
 
 @pytest.mark.asyncio
 async def test_openai_spam():
-    assert await antispam.check_openai_spam("This is a spam OFFER", INSTRUCTIONS_DEFAULT_TEXT) is True
+    assert await check_openai_spam("This is a spam OFFER", INSTRUCTIONS_DEFAULT_TEXT) is True
 
 
 @pytest.mark.asyncio
@@ -67,3 +74,55 @@ async def test_cas_ban_ham():
 @pytest.mark.asyncio
 async def test_cas_ban_spam():
     assert await antispam.check_cas_ban(7609784265) is True
+
+
+class SlowCompletions:
+    def __init__(self, delay):
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+
+    async def create(self, **kwargs):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='{"result": true}'))])
+
+
+@pytest.mark.asyncio
+async def test_openai_calls_run_concurrently_up_to_limit(monkeypatch):
+    fake = SlowCompletions(0.05)
+    monkeypatch.setattr(antispam, "get_openai_client", lambda: SimpleNamespace(chat=SimpleNamespace(completions=fake)))
+    monkeypatch.setattr(antispam, "OPENAI_MAX_CONCURRENCY", 3)
+    monkeypatch.setattr(antispam, "_openai_slots", None)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    results = await asyncio.gather(*(check_openai_spam(f"m{i}", "x") for i in range(6)))
+    assert results == [True] * 6
+    assert fake.peak == 3
+    # Две «волны» по 3 запроса, а не 6 последовательных
+    assert loop.time() - started < 0.25
+    assert antispam.openai_stats["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_openai_timeout_and_cancellation_free_the_slot(monkeypatch):
+    fake = SlowCompletions(10)
+    monkeypatch.setattr(antispam, "get_openai_client", lambda: SimpleNamespace(chat=SimpleNamespace(completions=fake)))
+    monkeypatch.setattr(antispam, "OPENAI_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(antispam, "OPENAI_TIMEOUT_SECONDS", 0.05)
+    monkeypatch.setattr(antispam, "_openai_slots", None)
+    timeouts = antispam.openai_stats["timeouts"]
+    assert await check_openai_spam("slow", "x") is False
+    assert antispam.openai_stats["timeouts"] == timeouts + 1 and fake.active == 0
+
+    monkeypatch.setattr(antispam, "OPENAI_TIMEOUT_SECONDS", 10)
+    task = asyncio.ensure_future(check_openai_spam("cancelled", "x"))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert fake.active == 0 and antispam._openai_semaphore()._value == 1
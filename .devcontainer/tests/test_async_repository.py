@@ -0,0 +1,57 @@
+import asyncio
+import time
+import pytest
+
+from app import database
+from app.logging_filters import current_update_id
+
+
+@pytest.mark.asyncio
+async def test_slow_query_does_not_block_event_loop(monkeypatch):
+    repo = database.get_user_state_repo()
+    arepo = database.get_async_user_state_repo()
+
+    def slow_entry(uid, gid):
+        time.sleep(0.2)
+        return (True, False)
+    monkeypatch.setattr(repo, 'entry', slow_entry)
+
+    ticks = []
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    started = time.monotonic()
+    entry, _ = await asyncio.gather(arepo.entry(1, 2), ticker())
+    assert entry == (True, False)
+    # Тикер успел отработать, пока запрос выполнялся в executor'е
+    assert len(ticks) == 5 and ticks[-1] - started < 0.15
+
+
+@pytest.mark.asyncio
+async def test_cached_answers_skip_executor(monkeypatch):
+    repo = database.get_user_state_repo()
+    arepo = database.get_async_user_state_repo()
+    def fail(*a):
+        raise AssertionError("executor path must not be used for cached answers")
+    monkeypatch.setattr(repo, 'is_spammer', fail)
+    monkeypatch.setattr(repo, 'is_seen', fail)
+    database.spammers_cache.add(10)
+    database.seen_users_cache.add(11)
+    assert await arepo.is_spammer(10) is True
+    assert await arepo.is_seen(11) is True
+
+
+@pytest.mark.asyncio
+async def test_update_id_propagates_to_db_thread(monkeypatch):
+    repo = database.get_user_state_repo()
+    arepo = database.get_async_user_state_repo()
+    seen = []
+    monkeypatch.setattr(repo, 'mark_seen', lambda uid, gid: seen.append(current_update_id.get()) or True)
+    token = current_update_id.set(4242)
+    try:
+        assert await arepo.mark_seen(1, 2) is True
+    finally:
+        current_update_id.reset(token)
+    assert seen == [4242]
@@ -0,0 +1,191 @@
+import pytest
+
+from app import database
+from app.caches import MISSING
+from app.cache_bus import CacheEvent, LocalStreamClient, MySQLCacheBus, RedisCacheBus
+# Ссылки берём при импорте: другие тесты подменяют атрибуты модуля database без восстановления
+from app.database import clear_spammer_flag_in_group, mark_unseen_in_group
+
+
+@pytest.fixture
+def reloads(monkeypatch):
+    calls = []
+    monkeypatch.setattr(database, 'reload_configured_groups', lambda: calls.append(1))
+    return calls
+
+
+def workers():
+    client = LocalStreamClient()
+    return RedisCacheBus(client, origin="a"), RedisCacheBus(client, origin="b")
+
+
+def test_events_reach_other_workers_only(reloads):
+    a, b = workers()
+    a.prepare(); b.prepare()
+    database.user_entry_cache.put((1, 10), (False, False))
+    a.publish("spammer", 1, 10)
+    a.publish("seen", 2, 10)
+    a.publish("unseen", 3, 10)
+    assert a.run_once() == 0  # свои события не применяются повторно
+    assert 1 not in database.spammers_cache
+
+    assert b.run_once() == 3
+    assert 1 in database.spammers_cache and 2 in database.seen_users_cache
+    assert 3 in database.suspicious_users_cache
+    assert database.user_entry_cache.peek((1, 10)) is MISSING
+    assert b.run_once() == 0  # позиция в журнале сдвинута
+    assert not reloads
+
+
+def test_clear_spammer_keeps_flag_if_spammer_elsewhere(reloads):
+    a, b = workers()
+    database.spammers_cache.update([1, 2])
+    a.publish("clear_spammer", 1, 10, value=0)
+    a.publish("clear_spammer", 2, 10, value=1)
+    a.run_once(); b.run_once()
+    assert 1 not in database.spammers_cache and 1 in database.not_spammers_cache
+    assert 2 in database.spammers_cache
+
+
+def test_group_events_reload_config_once_and_drop_entries(reloads):
+    a, b = workers()
+    database.user_entry_cache.put((1, -5), (True, False))
+    database.user_entry_cache.put((1, -1005), (True, False))
+    database.user_entry_cache.put((1, 7), (True, False))
+    a.publish("group", group_id=7)
+    a.publish("group_migrated", group_id=-5, value=-1005)
+    a.run_once(); b.run_once()
+    assert reloads == [1]
+    assert len(database.user_entry_cache) == 0
+
+
+def test_unsent_events_stay_queued_on_failure():
+    class Broken(LocalStreamClient):
+        fail = True
+        def xadd(self, *args, **kwargs):
+            if self.fail:
+                raise ConnectionError("down")
+            return super().xadd(*args, **kwargs)
+    client = Broken()
+    a, b = RedisCacheBus(client, origin="a"), RedisCacheBus(client, origin="b")
+    a.publish("spammer", 1, 10)
+    with pytest.raises(ConnectionError):
+        a.run_once()
+    assert a.snapshot_stats()["outbox"] == 1
+    client.fail = False
+    a.run_once()
+    assert b.run_once() == 1 and 1 in database.spammers_cache
+
+
+class EventsCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+    def execute(self, q, params=None):
+        q = " ".join(q.split())
+        if q.startswith("SELECT COALESCE(MAX(id)"):
+            self.result = [(len(self.db.rows),)]
+        elif q.startswith("SELECT id, origin"):
+            last_id, limit = params
+            self.result = [r for r in self.db.visible() if r[0] > last_id][:limit]
+        elif q.startswith("SELECT id FROM"):
+            self.result = [(r[0],) for r in self.db.visible() if r[0] > params[0]]
+        elif q.startswith("DELETE"):
+            self.db.purges += 1
+    def executemany(self, q, rows):
+        for row in rows:
+            self.db.rows.append((len(self.db.rows) + 1,) + tuple(row))
+    def fetchone(self):
+        return self.result[0]
+    def fetchall(self):
+        return self.result
+    def close(self):
+        pass
+
+
+class EventsDB:
+    def __init__(self):
+        self.rows = []
+        self.hidden = set()  # id ещё не закоммиченных строк
+        self.purges = 0
+    def visible(self):
+        return [r for r in self.rows if r[0] not in self.hidden]
+    def cursor(self):
+        return EventsCursor(self)
+    def commit(self):
+        pass
+    def close(self):
+        pass
+
+
+def test_mysql_change_log_bus(monkeypatch, reloads):
+    db = EventsDB()
+    monkeypatch.setattr(database, 'get_db_connection', lambda: db)
+    old = MySQLCacheBus(origin="old")
+    old.publish("seen", 9, 10)
+    old.flush_outbox()
+    a, b = MySQLCacheBus(origin="a", batch_size=2), MySQLCacheBus(origin="b", batch_size=2)
+    a.prepare(); b.prepare()
+    assert b.last_id == 1  # события до старта не применяются
+    for uid in (1, 2, 3):
+        a.publish("spammer", uid, 10)
+    a.run_once()
+    assert b.run_once() == 3 and b.last_id == 4
+    assert {1, 2, 3} <= set(database.spammers_cache) and 9 not in database.seen_users_cache
+    assert db.purges == 2  # по разу на воркер, не чаще раза в минуту
+    b.run_once()
+    assert db.purges == 2
+
+
+def test_mysql_bus_picks_up_late_committed_rows(monkeypatch, reloads):
+    db = EventsDB()
+    monkeypatch.setattr(database, 'get_db_connection', lambda: db)
+    a, b = MySQLCacheBus(origin="a"), MySQLCacheBus(origin="b", replay_window=10)
+    b.prepare()
+    for uid in (1, 2, 3):
+        a.publish("spammer", uid, 10)
+    a.flush_outbox()
+    a.publish("group", group_id=-5)
+    a.flush_outbox()
+    db.hidden = {1, 4}  # id выданы, но транзакции ещё не закоммичены
+    assert b.run_once() == 2 and b.last_id == 3
+    db.hidden = set()
+    assert b.run_once() == 2 and b.stats["late"] == 1
+    assert {1, 2, 3} <= set(database.spammers_cache) and reloads == [1]
+    assert b.run_once() == 0  # применённые строки окна не повторяются
+
+
+class AnyCursor:
+    def execute(self, q, params=None):
+        pass
+    def fetchone(self):
+        return None
+    def fetchall(self):
+        return []
+    def close(self):
+        pass
+
+
+class AnyDB:
+    def cursor(self):
+        return AnyCursor()
+    def commit(self):
+        pass
+    def close(self):
+        pass
+
+
+def test_repository_mutations_publish(monkeypatch):
+    monkeypatch.setattr(database, 'get_db_connection', lambda: AnyDB())
+    published = []
+    database.set_cache_event_publisher(lambda kind, **kw: published.append(CacheEvent(kind, **kw)))
+    try:
+        database.spammers_cache.add(5)
+        mark_unseen_in_group(4, 10)
+        clear_spammer_flag_in_group(5, 10)
+    finally:
+        database.set_cache_event_publisher(None)
+    assert published == [
+        CacheEvent("unseen", user_id=4, group_id=10),
+        CacheEvent("clear_spammer", user_id=5, group_id=10, value=0),
+    ]
@@ -0,0 +1,62 @@
+from app import database
+# Ссылка берётся при импорте: другие тесты подменяют атрибуты модуля database без восстановления
+from app.database import load_user_caches
+
+
+class StreamingCursor:
+    def __init__(self, db, kwargs):
+        self.db = db
+        db.cursor_kwargs.append(kwargs)
+    def execute(self, q, params=None):
+        self.db.queries.append(" ".join(q.split()))
+        self.pos = 0
+    def fetchmany(self, size):
+        chunk = self.db.rows[self.pos:self.pos + size]
+        self.pos += size
+        self.db.fetch_sizes.append(len(chunk))
+        return chunk
+    def fetchall(self):
+        raise AssertionError("cold load must stream, not fetchall()")
+    def close(self):
+        pass
+
+
+class StreamingDB:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+        self.cursor_kwargs = []
+        self.fetch_sizes = []
+    def cursor(self, **kwargs):
+        return StreamingCursor(self, kwargs)
+    def close(self):
+        pass
+
+
+def test_single_streaming_pass_fills_caches_in_place(monkeypatch):
+    rows = [
+        (1, True, False, -1),   # seen
+        (1, False, False, -2),  # и unseen в другой группе -> suspicious
+        (2, False, True, -1),   # spammer
+        (3, False, False, -1),  # suspicious
+        (4, True, True, -2),
+    ]
+    db = StreamingDB(rows)
+    monkeypatch.setattr(database, 'get_db_connection', lambda: db)
+    monkeypatch.setattr(database, 'USER_CACHE_LOAD_CHUNK_SIZE', 2)
+    spammers_ref = database.spammers_cache
+    database.spammers_cache.add(99)  # устаревшее значение должно исчезнуть
+    database.not_seen_cache.add(1)
+
+    stats = load_user_caches()
+
+    assert len(db.queries) == 1 and db.cursor_kwargs == [{"buffered": False}]
+    assert db.fetch_sizes == [2, 2, 1, 0]
+    assert database.spammers_cache is spammers_ref
+    assert set(database.spammers_cache) == {2, 4}
+    assert set(database.seen_users_cache) == {1, 4}
+    assert set(database.suspicious_users_cache) == {1, 3}
+    assert len(database.not_seen_cache) == 0
+    assert stats["rows"] == 5
+    assert database.spam_groups_index.ready
+    assert sorted(database.spam_groups_index.pairs()) == [(2, -1), (4, -2)]
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import database
+from app.caches import MISSING
+from app.cache_refresh import CacheRefresher
+
+T0 = datetime(2025, 1, 1, 12, 0, 0)
+
+
+class ChangeFeed:
+    """In-memory user_entries: {(user_id, group_id): [id, seen, spammer, updated_at]}"""
+    def __init__(self):
+        self.rows = {}
+        self.next_id = 1
+        self.now = T0
+        self.fetches = []
+
+    def upsert(self, uid, gid, seen=False, spammer=False):
+        self.now += timedelta(seconds=1)
+        row = self.rows.get((uid, gid))
+        if row is None:
+            self.rows[(uid, gid)] = [self.next_id, seen, spammer, self.now]
+            self.next_id += 1
+        else:
+            row[1:] = [seen, spammer, self.now]
+
+    def fetch(self, after, limit):
+        self.fetches.append(after)
+        ts, last_id = after
+        out = sorted(
+            (r[0], uid, gid, r[1], r[2], r[3]) for (uid, gid), r in self.rows.items()
+            if r[3] > ts or (r[3] == ts and r[0] > last_id)
+        )
+        out.sort(key=lambda r: (r[5], r[0]))
+        return out[:limit]
+
+    def aggregate(self, user_ids):
+        result = {}
+        for (uid, _gid), (_id, seen, spammer, _ts) in self.rows.items():
+            if uid in user_ids:
+                sp, se, su = result.get(uid, (False, False, False))
+                result[uid] = (sp or spammer, se or seen, su or (not seen and not spammer))
+        return result
+
+
+@pytest.fixture
+def feed(monkeypatch):
+    f = ChangeFeed()
+    monkeypatch.setattr(database, 'fetch_user_entry_changes', f.fetch)
+    monkeypatch.setattr(database, 'aggregate_user_flags', f.aggregate)
+    return f
+
+
+def test_pulls_changes_in_batches_and_reconciles_caches(feed):
+    refresher = CacheRefresher(interval=60, batch_size=2, lookback=0)
+    refresher.set_watermark(T0)
+    feed.upsert(1, 10, spammer=True)
+    feed.upsert(2, 10, seen=True)
+    feed.upsert(3, 10)
+    database.not_spammers_cache.add(1)
+    assert refresher.run_once() == 3
+    assert len(feed.fetches) == 2  # порции по 2 строки
+    assert 1 in database.spammers_cache and 1 not in database.not_spammers_cache
+    assert 2 in database.seen_users_cache and 3 in database.suspicious_users_cache
+
+    # Правка «руками» в БД: снят флаг спамера, пользователь 3 стал seen
+    feed.upsert(1, 10, spammer=False)
+    feed.upsert(3, 10, seen=True)
+    database.user_entry_cache.put((1, 10), (False, True))
+    assert refresher.run_once() == 2
+    assert database.user_entry_cache.peek((1, 10)) is MISSING
+    assert 1 not in database.spammers_cache and 1 in database.not_spammers_cache
+    assert 3 in database.seen_users_cache and 3 not in database.suspicious_users_cache
+    assert refresher.watermark == feed.now
+    assert refresher.run_once() == 0
+
+
+def test_local_write_during_refresh_is_not_reverted(feed, monkeypatch):
+    refresher = CacheRefresher(interval=60, batch_size=10, lookback=0)
+    refresher.set_watermark(T0)
+    feed.upsert(5, 10)
+    original = feed.aggregate
+
+    def aggregate_racing_with_bot(user_ids):
+        result = original(user_ids)
+        # Бот пометил спамера, пока шёл запрос (строка ещё не в БД)
+        database._note_local_write(5)
+        database.spammers_cache.add(5)
+        return result
+
+    monkeypatch.setattr(database, 'aggregate_user_flags', aggregate_racing_with_bot)
+    refresher.run_once()
+    assert 5 in database.spammers_cache
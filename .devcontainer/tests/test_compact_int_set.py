@@ -0,0 +1,92 @@
+import random
+from array import array
+
+import pytest
+
+from app.caches import CompactIntSet, new_user_id_set, sort_int64_array, sort_int64_pairs
+
+
+def test_matches_builtin_set_under_random_ops():
+    rng = random.Random(7)
+    compact = CompactIntSet(block_size=16)
+    reference = set()
+    for _ in range(5000):
+        value = rng.randrange(-50, 2000) * 1_000_003
+        if rng.random() < 0.7:
+            compact.add(value)
+            reference.add(value)
+        else:
+            compact.discard(value)
+            reference.discard(value)
+    assert len(compact) == len(reference)
+    assert list(compact) == sorted(reference)
+    for value in range(-50 * 1_000_003, 2000 * 1_000_003, 999_983):
+        assert (value in compact) == (value in reference)
+
+
+def test_bulk_load_dedups_and_keeps_set_api():
+    compact = CompactIntSet([5, 3, 5, 9, 1, 3])
+    assert list(compact) == [1, 3, 5, 9] and len(compact) == 4
+    assert 3 in compact and 4 not in compact and None not in compact
+    compact.remove(3)
+    with pytest.raises(KeyError):
+        compact.remove(3)
+    compact.clear()
+    assert len(compact) == 0 and 1 not in compact
+
+
+def test_backend_factory():
+    assert isinstance(new_user_id_set("set", [1]), set)
+    assert isinstance(new_user_id_set("compact", [1]), CompactIntSet)
+    with pytest.raises(ValueError):
+        new_user_id_set("bitmap")
+
+
+def test_writers_never_mutate_blocks_seen_by_readers():
+    s = CompactIntSet(range(0, 2000, 2), block_size=16)
+    keys, blocks = s._state
+    old_blocks = list(blocks)
+    before = [b.tobytes() for b in old_blocks]
+    s.add(5)      # середина блока
+    s.add(-1)     # новый первый ключ
+    s.discard(8)  # удаление из середины
+    s.discard(32) # первый элемент блока
+    for v in range(1, 200, 2):
+        s.add(v)  # деление блоков
+    assert [b.tobytes() for b in old_blocks] == before and keys[0] == 0
+
+
+def test_lock_free_reads_during_writes():
+    import threading
+    s = CompactIntSet(range(0, 20000, 2), block_size=16)
+    stop = threading.Event()
+    missing = []
+
+    def reader():
+        while not stop.is_set():
+            for v in range(0, 20000, 202):
+                if v not in s:
+                    missing.append(v)
+
+    t = threading.Thread(target=reader)
+    t.start()
+    try:
+        for v in range(1, 20000, 2):
+            s.add(v)
+        for v in range(1, 20000, 4):
+            s.discard(v)
+    finally:
+        stop.set()
+        t.join()
+    assert missing == []
+
+
+def test_int64_sorts_in_place():
+    rng = random.Random(3)
+    values = [rng.randrange(-2**63, 2**63) for _ in range(1000)]
+    arr = array("q", values)
+    assert sort_int64_array(arr) is arr and arr.tolist() == sorted(values)
+    pairs = [(rng.randrange(5), rng.randrange(-5, 5)) for _ in range(300)]
+    flat = array("q", [v for pair in pairs for v in pair])
+    sort_int64_pairs(flat)
+    assert list(zip(flat[::2], flat[1::2])) == sorted(pairs)
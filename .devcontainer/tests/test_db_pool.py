@@ -0,0 +1,96 @@
+import threading
+import pytest
+import mysql.connector
+
+from app.db_pool import ConnectionPool
+
+
+class FakeRawConn:
+    def __init__(self, n):
+        self.n = n
+        self.closed = False
+        self.alive = True
+        self.in_transaction = False
+        self.rolled_back = 0
+    def cursor(self, *a, **kw):
+        return FakeCursor(self)
+    def commit(self):
+        self.in_transaction = False
+    def rollback(self):
+        self.rolled_back += 1
+        self.in_transaction = False
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise mysql.connector.errors.InterfaceError("gone")
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+    def execute(self, q, params=None):
+        if not self.conn.alive:
+            raise mysql.connector.errors.OperationalError("lost connection")
+        self.conn.in_transaction = True
+    def close(self):
+        pass
+
+
+def make_pool(**kw):
+    created = []
+    def connect():
+        c = FakeRawConn(len(created))
+        created.append(c)
+        return c
+    return ConnectionPool(connect, **kw), created
+
+
+def test_pool_reuses_connections():
+    pool, created = make_pool(size=2)
+    for _ in range(5):
+        conn = pool.acquire()
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.close()
+    assert len(created) == 1
+    stats = pool.stats()
+    assert stats["created"] == 1 and stats["reused"] == 4
+    assert stats["in_use"] == 0 and stats["idle"] == 1
+    # Незакоммиченная транзакция откатывается при возврате в пул
+    assert created[0].rolled_back == 5
+
+
+def test_pool_is_bounded_and_times_out():
+    pool, created = make_pool(size=1, acquire_timeout=0.05)
+    held = pool.acquire()
+    with pytest.raises(mysql.connector.Error):
+        pool.acquire()
+    assert pool.stats()["timeouts"] == 1
+    # Освобождение соединения будит ожидающий поток
+    got = []
+    t = threading.Thread(target=lambda: got.append(pool.acquire()))
+    pool.acquire_timeout = 2
+    t.start()
+    held.close()
+    t.join(2)
+    assert got and len(created) == 1
+
+
+def test_pool_discards_broken_and_recycles_idle():
+    pool, created = make_pool(size=2, ping_interval=0, max_idle=3600)
+    conn = pool.acquire()
+    created[0].alive = False
+    with pytest.raises(mysql.connector.Error):
+        conn.cursor().execute("SELECT 1")
+    conn.close()  # помечено битым -> закрыто, не возвращено в idle
+    assert created[0].closed and pool.stats()["idle"] == 0
+    conn = pool.acquire()
+    conn.close()
+    assert len(created) == 2
+    # Простой дольше max_idle -> пересоздание при следующей выдаче
+    pool.max_idle = 0
+    conn = pool.acquire()
+    conn.close()
+    assert len(created) == 3 and pool.stats()["recycled"] == 1
@@ -0,0 +1,101 @@
+import pytest
+
+from app import database
+from app.caches import LRUCache, MISSING
+# Ссылки берём при импорте: другие тесты подменяют атрибуты модуля database без восстановления
+from app.database import get_user_entry, mark_seen_in_group, mark_spammer_in_group, clear_spammer_flag_in_group
+
+
+class EntryCursor:
+    def __init__(self, db):
+        self.db = db
+        self.row = None
+        self.rows = []
+    def execute(self, q, params=None):
+        q = " ".join(q.split())
+        self.db.queries.append(q)
+        if q.startswith("SELECT seen_message, spammer"):
+            self.row = self.db.rows.get(params)
+        elif q.startswith("SELECT group_id FROM user_entries"):
+            self.rows = [(g,) for (u, g), (_, sp) in self.db.rows.items() if u == params[0] and sp]
+    def fetchone(self):
+        return self.row
+    def fetchall(self):
+        return self.rows
+    def close(self):
+        pass
+
+
+class EntryDB:
+    def __init__(self):
+        self.rows = {}
+        self.queries = []
+    def cursor(self):
+        return EntryCursor(self)
+    def commit(self):
+        pass
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    d = EntryDB()
+    monkeypatch.setattr(database, 'get_db_connection', lambda: d)
+    return d
+
+
+def selects(db):
+    return [q for q in db.queries if q.startswith("SELECT seen_message")]
+
+
+def test_lru_eviction_ttl_and_stale_fill():
+    now = [0.0]
+    cache = LRUCache(2, ttl=10, clock=lambda: now[0])
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)  # вытесняет b (a недавно использован)
+    assert cache.get("b") is MISSING and cache.stats["evictions"] == 1
+    now[0] = 11
+    assert cache.get("a") is MISSING and cache.stats["expirations"] >= 1
+    seq = cache.write_seq
+    cache.invalidate("x")  # конкурентная запись во время чтения
+    assert cache.fill("x", 1, seq) is False and cache.get("x") is MISSING
+    stats = cache.snapshot_stats()
+    assert stats["hits"] == 1 and stats["misses"] == 3
+
+
+def test_repeated_reads_hit_cache(db):
+    before = database.get_user_entry_cache_stats()
+    db.rows[(1, 10)] = (True, False)
+    assert get_user_entry(1, 10) == (True, False)
+    assert get_user_entry(1, 10) == (True, False)
+    assert get_user_entry(2, 10) is None
+    assert get_user_entry(2, 10) is None  # «записи нет» тоже кэшируется
+    assert len(selects(db)) == 2
+    stats = database.get_user_entry_cache_stats()
+    assert stats["hits"] - before["hits"] == 2 and stats["misses"] - before["misses"] == 2
+
+
+def test_writers_keep_cache_coherent(db):
+    get_user_entry(3, 10)  # кэш: None
+    mark_seen_in_group(3, 10)
+    assert get_user_entry(3, 10) == (True, False)
+    mark_spammer_in_group(3, 10)
+    assert get_user_entry(3, 10) == (True, True)
+    clear_spammer_flag_in_group(3, 10)
+    assert get_user_entry(3, 10) == (True, False)
+    assert len(selects(db)) == 1
+
+
+def test_group_removal_and_migration_invalidate(db):
+    from app import group_migration
+    db.rows[(4, 10)] = (True, False)
+    db.rows[(4, 20)] = (False, False)
+    get_user_entry(4, 10)
+    get_user_entry(4, 20)
+    database.remove_configured_group(10)
+    group_migration.migrate_group_rows(20, 30)
+    assert database.user_entry_cache.peek((4, 10)) is MISSING
+    assert database.user_entry_cache.peek((4, 20)) is MISSING
@@ -0,0 +1,122 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from app import cache_bus, database
+from app.cache_bus import CacheEvent
+from app.storage import MemoryStorage, set_storage
+from app.telegram_commands import unban_command
+
+
+class UnbanCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, q, params=None):
+        q = " ".join(q.split())
+        self.db.queries.append(q)
+        if q.startswith("SELECT group_id FROM user_entries"):
+            self.rows = [(g,) for g in self.db.spam_groups]
+        elif q.startswith("UPDATE user_entries SET spammer=FALSE, seen_message=TRUE"):
+            self.db.spam_groups = []
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class UnbanDB:
+    def __init__(self, spam_groups):
+        self.spam_groups = list(spam_groups)
+        self.queries = []
+        self.connections = 0
+        self.commits = 0
+
+    def cursor(self):
+        return UnbanCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        pass
+
+
+def test_mysql_unban_is_one_transaction(monkeypatch):
+    groups = list(range(-1, -51, -1))
+    db = UnbanDB(groups)
+
+    def connect():
+        db.connections += 1
+        return db
+
+    monkeypatch.setattr(database, 'get_db_connection', connect)
+    monkeypatch.setattr(database, 'write_behind', database.WriteBehindQueue(batch_size=100, flush_interval=60))
+    database.spammers_cache.add(42)
+    database.user_entry_cache.put((42, -1), (False, True))
+    assert database.clear_spammer_everywhere(42) == groups
+    assert db.connections == 1 and db.commits == 1
+    assert db.queries == [
+        "SELECT group_id FROM user_entries WHERE user_id=%s AND spammer=TRUE FOR UPDATE",
+        "UPDATE user_entries SET spammer=FALSE, seen_message=TRUE WHERE user_id=%s AND spammer=TRUE",
+    ]
+    assert 42 not in database.spammers_cache and 42 in database.not_spammers_cache
+    assert 42 in database.seen_users_cache
+    assert database.user_entry_cache.get((42, -1)) == (True, False)
+
+
+class DummyMessage:
+    def __init__(self, text):
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, txt):
+        self.replies.append(txt)
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    from app import telegram_commands
+    monkeypatch.setattr(telegram_commands, 'ADMIN_TELEGRAM_ID', os.getenv('ADMIN_TELEGRAM_ID') or '999999')
+    monkeypatch.setattr(database, 'write_behind', database.WriteBehindQueue(batch_size=100, flush_interval=60))
+    backend = MemoryStorage()
+    previous = set_storage(backend)
+    yield backend
+    set_storage(previous)
+
+
+async def run_unban(target):
+    admin = SimpleNamespace(id=int(os.getenv('ADMIN_TELEGRAM_ID') or 999999))
+    msg = DummyMessage(f"/unban {target}")
+    update = SimpleNamespace(message=msg, effective_chat=SimpleNamespace(id=5, type='private'),
+                             effective_user=admin, update_id=1)
+    await unban_command(update, SimpleNamespace(bot=None))  # type: ignore
+    return msg.replies
+
+
+@pytest.mark.asyncio
+async def test_unban_command_clears_all_groups(memory):
+    memory.upsert_entries([(7, 1, False, True), (7, 2, None, True), (7, 3, True, False)])
+    database.spammers_cache.add(7)
+    database.suspicious_users_cache.add(7)
+    replies = await run_unban(7)
+    assert replies == ["Очищены флаги спама в группах: 1, 2"]
+    assert memory.get_entry(7, 1) == (True, False) and memory.get_entry(7, 2) == (True, False)
+    assert memory.get_entry(7, 3) == (True, False)
+    assert 7 not in database.spammers_cache and 7 in database.seen_users_cache
+    assert 7 not in database.suspicious_users_cache
+    assert await run_unban(7) == ["Пользователь не помечен как спамер."]
+
+
+def test_unban_event_fixes_other_workers_caches():
+    database.spammers_cache.add(8)
+    database.user_entry_cache.put((8, 1), (False, True))
+    database.user_entry_cache.put((9, 1), (False, True))
+    cache_bus.apply_events([CacheEvent("unban", 8)])
+    assert 8 not in database.spammers_cache and 8 in database.seen_users_cache
+    assert database.user_entry_cache.get((8, 1)) is database.MISSING
+    assert database.user_entry_cache.get((9, 1)) == (False, True)
@@ -0,0 +1,147 @@
+import threading
+import types
+
+import mysql.connector
+import pytest
+from telegram.error import ChatMigrated
+
+from app import database, send_safe
+from app.group_migration import GroupMigrationWorker, migrate_group_rows, pending_group_migrations
+
+OLD, NEW = -555, -100555
+
+
+class MigrationCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+
+    def execute(self, q, params=()):
+        q = " ".join(q.split())
+        db = self.db
+        db.queries.append(q)
+        self.result = []
+        if q.startswith("INSERT INTO group_migrations"):
+            db.jobs.setdefault(params[0], {"new": params[1], "rows_moved": 0, "done": False})["new"] = params[1]
+        elif q.startswith("UPDATE group_migrations SET done"):
+            db.jobs[params[0]]["done"] = "TRUE" in q
+        elif q.startswith("UPDATE group_migrations SET rows_moved"):
+            db.jobs[params[1]]["rows_moved"] += params[0]
+        elif q.startswith("SELECT old_group_id, new_group_id FROM group_migrations"):
+            self.result = [(old, job["new"]) for old, job in db.jobs.items() if not job["done"]]
+        elif q.startswith("SELECT id FROM user_entries"):
+            db.selects += 1
+            if db.fail_on_select == db.selects:
+                raise mysql.connector.Error("connection lost")
+            ids = sorted(i for i, r in db.rows.items() if r[1] == params[0])
+            self.result = [(i,) for i in ids[:params[1]]]
+        elif q.startswith("UPDATE user_entries n JOIN"):
+            new_id, ids = params[0], params[1:]
+            for i in ids:
+                for row in db.rows.values():
+                    if row[0] == db.rows[i][0] and row[1] == new_id:
+                        row[2] = row[2] or db.rows[i][2]
+                        row[3] = row[3] or db.rows[i][3]
+        elif q.startswith("DELETE o FROM user_entries"):
+            new_id, ids = params[0], params[1:]
+            for i in ids:
+                if any(r[0] == db.rows[i][0] and r[1] == new_id for r in db.rows.values()):
+                    del db.rows[i]
+        elif q.startswith("UPDATE user_entries SET group_id"):
+            new_id, ids, old_id = params[0], params[1:-1], params[-1]
+            for i in ids:
+                if i in db.rows and db.rows[i][1] == old_id:
+                    db.rows[i][1] = new_id
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class MigrationDB:
+    def __init__(self, rows):
+        self.rows = {i: list(r) for i, r in enumerate(rows, start=1)}  # id -> [user, group, seen, spammer]
+        self.jobs = {}
+        self.queries = []
+        self.selects = 0
+        self.fail_on_select = 0
+        self.commits = 0
+
+    def cursor(self):
+        return MigrationCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    def groups_of(self, group_id):
+        return sorted((r[0], r[2], r[3]) for r in self.rows.values() if r[1] == group_id)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    rows = [(u, OLD, True, False) for u in range(1, 8)] + [(1, NEW, False, True)]
+    d = MigrationDB(rows)
+    monkeypatch.setattr(database, 'get_db_connection', lambda: d)
+    return d
+
+
+def test_rows_move_in_chunks_and_conflicts_merge(db):
+    assert migrate_group_rows(OLD, NEW, chunk_size=3, pause=0) == 7
+    assert db.groups_of(OLD) == []
+    # Пользователь 1 уже был в новой группе: одна строка, флаги объединены
+    assert db.groups_of(NEW) == [(1, True, True)] + [(u, True, False) for u in range(2, 8)]
+    assert db.selects == 3  # 3 + 3 + 1; каждая порция — отдельный коммит
+    assert db.jobs[OLD] == {"new": NEW, "rows_moved": 7, "done": True}
+    assert not any("WHERE group_id = %s" in q and q.startswith("UPDATE user_entries") for q in db.queries)
+
+
+def test_interrupted_job_resumes_from_remaining_rows(db):
+    stop = threading.Event()
+    stop.set()
+    assert migrate_group_rows(OLD, NEW, chunk_size=3, pause=0, stop=stop) is None
+    db.fail_on_select = 2  # падение на второй порции
+    worker = GroupMigrationWorker(chunk_size=3, pause=0, retry_delay=0)
+    worker.submit(OLD, NEW)
+    with pytest.raises(mysql.connector.Error):
+        worker.run_once()
+    assert len(db.groups_of(OLD)) == 4 and worker.pending() == 1
+    assert pending_group_migrations() == [(OLD, NEW)]
+    assert worker.run_once() is True
+    assert db.groups_of(OLD) == [] and db.jobs[OLD]["done"] and db.jobs[OLD]["rows_moved"] == 7
+    assert worker.pending() == 0 and worker.stats["completed"] == 1
+
+
+class MigratingBot:
+    def __init__(self):
+        self.sent = []
+        self.migrated_errors = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == OLD:
+            self.migrated_errors += 1
+            raise ChatMigrated(NEW)
+        self.sent.append(chat_id)
+        return types.SimpleNamespace(chat_id=chat_id, text=text)
+
+
+@pytest.mark.asyncio
+async def test_redirect_applies_before_rows_are_moved(db, monkeypatch):
+    worker = GroupMigrationWorker(chunk_size=3, pause=0, retry_delay=0)
+    monkeypatch.setattr(send_safe, 'group_migrator', worker)
+    database.configured_groups_cache.append({"group_id": OLD, "settings": {}})
+    bot = MigratingBot()
+    await send_safe.send_message_with_migration(bot, OLD, text="a")
+    await send_safe.send_message_with_migration(bot, OLD, text="b")
+    assert bot.sent == [NEW, NEW] and bot.migrated_errors == 1
+    assert database.resolve_group_id(OLD) == NEW and database.is_group_configured(OLD)
+    # Задание записано и стоит в очереди; строки ещё не переносились
+    assert db.jobs[OLD]["new"] == NEW and not db.jobs[OLD]["done"]
+    assert worker.pending() == 1 and len(db.groups_of(OLD)) == 7
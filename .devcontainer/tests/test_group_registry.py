@@ -0,0 +1,80 @@
+import threading
+
+from app import database
+from app.group_registry import GroupRegistry
+
+
+def test_lookup_by_id_and_defaults():
+    reg = GroupRegistry("default instr")
+    reg.append({"group_id": 1, "settings": {"instructions": "custom"}})
+    reg.upsert(2)
+    assert reg.instructions(1) == "custom" and reg.instructions(2) == "default instr"
+    assert reg.instructions(3) == "default instr" and reg.settings(3) == {}
+    assert 1 in reg and {"group_id": 2} in reg and 3 not in reg
+    reg.set_setting(2, "instructions", "x")
+    assert reg.info(2).instructions == "x"
+
+
+def test_list_compatible_api():
+    reg = GroupRegistry()
+    reg[:] = [{"group_id": 5, "settings": {}}, {"group_id": 6, "settings": {"a": "b"}}]
+    assert reg == [{"group_id": 5, "settings": {}}, {"group_id": 6, "settings": {"a": "b"}}]
+    assert len(reg) == 2 and reg[0]["group_id"] == 5
+    reg.append({"group_id": 5, "settings": {"a": "c"}})  # повтор — замена, а не дубликат
+    assert len(reg) == 2 and reg.settings(5) == {"a": "c"}
+    reg.remove({"group_id": 5})
+    assert [g["group_id"] for g in reg] == [6]
+    reg.clear()
+    assert len(reg) == 0
+
+
+def test_bot_rights_survive_reload_and_follow_migration():
+    reg = GroupRegistry()
+    reg.upsert(-1)
+    reg.set_bot_rights(-1, "administrator", can_restrict_members=True)
+    reg.replace([{"group_id": -1, "settings": {"instructions": "new"}}])
+    info = reg.info(-1)
+    assert info.bot_status == "administrator" and info.bot_rights == {"can_restrict_members": True}
+    assert info.instructions == "new"
+    assert reg.rekey(-1, -1001) and reg.info(-1001).bot_status == "administrator"
+    assert -1 not in reg and reg.get(-1001)["group_id"] == -1001
+
+
+def test_concurrent_mutation_keeps_readers_consistent():
+    reg = GroupRegistry()
+    errors = []
+    stop = threading.Event()
+
+    def writer(base):
+        for i in range(2000):
+            reg.upsert(base + i % 50, {"n": str(i)})
+            if i % 7 == 0:
+                reg.discard(base + (i * 3) % 50)
+
+    def reader():
+        while not stop.is_set():
+            try:
+                for entry in reg:
+                    assert reg.get(entry["group_id"]) is None or "settings" in entry
+                len(reg)
+            except Exception as e:  # pragma: no cover - сигнал об ошибке
+                errors.append(e)
+                return
+
+    readers = [threading.Thread(target=reader) for _ in range(2)]
+    writers = [threading.Thread(target=writer, args=(b,)) for b in (0, 1000)]
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    stop.set()
+    for t in readers:
+        t.join()
+    assert not errors
+    assert all(reg.info(gid).group_id == gid for gid in reg.ids())
+
+
+def test_module_level_name_is_registry():
+    database.configured_groups_cache.append({"group_id": 777, "settings": {"instructions": "i"}})
+    assert database.is_group_configured(777)
+    assert database.configured_groups_cache.instructions(777) == "i"
@@ -0,0 +1,153 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from app import bench, local_classifier, telegram_messages
+from app.antispam import instructions_digest
+from app.local_classifier import (
+    LocalClassifier, build_training_set, classify_locally, evaluate, record_correction, train,
+)
+from app.storage import MemoryStorage, SQLiteStorage, set_storage
+
+SCOPE = instructions_digest("rules")
+_SPAM = ["Заработок от {n} рублей в день, пиши в лс @bot{n} 💰", "Удалённая работа, доход {n}$ в неделю! Подробности https://t.me/job{n}",
+         "🔥 Крипта x{n}, вход от 100$, пиши @invest{n}", "Интим знакомства рядом, переходи www.date{n}.xyz 💋"]
+_HAM = ["Кто-нибудь знает, во сколько завтра встреча?", "Спасибо за ссылку на документацию, помогло",
+        "Подскажите, как настроить роутер, интернет пропадает", "Вчера ходили в кино, фильм так себе",
+        "Можно ли парковаться у третьего подъезда?", "Ребята, кто забыл зонт в переговорке?"]
+
+
+def make_samples(n=200, seed=3):
+    rng = random.Random(seed)
+    samples = []
+    for i in range(n):
+        if i % 2:
+            samples.append((rng.choice(_SPAM).format(n=rng.randrange(10, 99999)), True, SCOPE))
+        else:
+            samples.append((rng.choice(_HAM) + " " + str(rng.randrange(1000)), False, SCOPE))
+    return samples
+
+
+@pytest.fixture(scope="module")
+def model():
+    return train(make_samples(), feature_bits=14, epochs=6)
+
+
+def test_training_set_applies_admin_corrections():
+    rows = [
+        (1, 10, SCOPE, "hello there", False, "llm", 1.0),
+        (1, 10, SCOPE, "HELLO   there", False, "llm", 2.0),  # тот же нормализованный текст
+        (2, 10, SCOPE, "buy now", True, "llm", 1.0),
+        (2, 0, None, None, False, "unban", 5.0),
+        (1, 20, None, None, True, "ban", 6.0),  # другая группа — не применяется
+        (3, 10, SCOPE, "late", True, "llm", 9.0),
+        (3, 0, None, None, False, "unban", 8.0),  # раньше сообщения — не применяется
+    ]
+    samples = build_training_set([rows[:3], rows[3:]])
+    assert sorted((text, label) for text, label, _ in samples) == [("HELLO   there", False), ("buy now", False),
+                                                                   ("late", True)]
+
+
+def test_model_separates_and_round_trips(model, tmp_path):
+    metrics = evaluate(model, make_samples(100, seed=11), spam_threshold=0.9, ham_threshold=0.1)
+    assert metrics["accuracy_at_0.5"] >= 0.95 and metrics["agreement"] >= 0.95 and metrics["coverage"] > 0.5
+    path = str(tmp_path / "model.npz")
+    model.save(path)
+    loaded = LocalClassifier.load(path)
+    text = "Заработок от 7 рублей в день, пиши в лс @x"
+    assert loaded.score(text) == pytest.approx(model.score(text), abs=1e-6)
+    assert loaded.applies_to(SCOPE) and not loaded.applies_to(instructions_digest("other"))
+    with pytest.raises(ValueError):
+        train([("only ham", False, SCOPE)])
+
+
+def test_bands_decide_or_escalate(model, monkeypatch):
+    local_classifier.set_local_classifier(model)
+    monkeypatch.setattr(local_classifier, "CLASSIFIER_SPAM_THRESHOLD", 0.9)
+    monkeypatch.setattr(local_classifier, "CLASSIFIER_HAM_THRESHOLD", 0.1)
+    assert classify_locally("Крипта x5, вход от 100$, пиши @invest1", SCOPE) is True
+    assert classify_locally("Кто-нибудь знает, во сколько завтра встреча? 12", SCOPE) is False
+    assert classify_locally("Крипта x5", instructions_digest("other")) is None
+    monkeypatch.setattr(local_classifier, "CLASSIFIER_SPAM_THRESHOLD", 1.01)
+    monkeypatch.setattr(local_classifier, "CLASSIFIER_HAM_THRESHOLD", -0.01)
+    before = local_classifier.classifier_stats["escalated"]
+    assert classify_locally("Крипта x5, вход от 100$", SCOPE) is None
+    assert local_classifier.classifier_stats["escalated"] == before + 1
+
+
+@pytest.fixture
+def history(monkeypatch):
+    monkeypatch.setattr(local_classifier, "CLASSIFIER_HISTORY_ENABLED", True)
+    backend = MemoryStorage()
+    previous = set_storage(backend)
+    yield backend
+    set_storage(previous)
+
+
+@pytest.mark.asyncio
+async def test_process_spam_uses_local_verdict_and_records_llm(model, history, monkeypatch):
+    local_classifier.set_local_classifier(model)
+    monkeypatch.setattr(local_classifier, "CLASSIFIER_SPAM_THRESHOLD", 0.9)
+    monkeypatch.setattr(local_classifier, "CLASSIFIER_HAM_THRESHOLD", 0.1)
+    calls = []
+
+    async def fake_check(text, instructions):
+        calls.append(text)
+        return None if "мост" in text else False  # None — OpenAI не дал вердикта (таймаут)
+    monkeypatch.setattr(telegram_messages, "classify_with_openai", fake_check)
+    monkeypatch.setattr(telegram_messages.configured_groups_cache, "instructions", lambda chat_id: "rules")
+    user, chat = SimpleNamespace(id=5, username="u", full_name="U"), SimpleNamespace(id=123, title="g", type="supergroup")
+
+    async def classify(text):
+        msg = SimpleNamespace(text=text, caption=None, forward_origin=None, is_automatic_forward=False)
+        return await telegram_messages.process_spam(SimpleNamespace(message=msg), None, user, chat)
+
+    assert await classify("Удалённая работа, доход 500$ в неделю! Подробности https://t.me/job") is True
+    assert await classify("Как вам новый парк у реки?") is False
+    assert await classify("Как вам новый мост у реки?") is False
+    assert calls == ["Как вам новый парк у реки?", "Как вам новый мост у реки?"]
+    record_correction(5, 0, is_spam=True)
+    await asyncio.gather(*local_classifier._record_tasks)
+    rows = [row for chunk in history.scan_classifications(10) for row in chunk]
+    assert [(r[3], r[4], r[5]) for r in rows] == [("Как вам новый парк у реки?", False, "llm"), (None, True, "ban")]
+    assert rows[0][2] == SCOPE
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_storage_history_contract_and_benchmark(backend, model, tmp_path):
+    store = MemoryStorage() if backend == "memory" else SQLiteStorage(str(tmp_path / "h.db"))
+    store.setup()
+    store.record_classifications([(1, 10, SCOPE, text, label, "llm") for text, label, _ in make_samples(20, seed=5)])
+    store.record_classifications([(1, 0, None, None, False, "unban")])
+    rows = [row for chunk in store.scan_classifications(7) for row in chunk]
+    assert len(rows) == 21 and rows[-1][:6] == (1, 0, None, None, False, "unban")
+    assert rows[0][2] == SCOPE and isinstance(rows[0][6], float)
+    store.prune_classifications(3600)
+    assert len([row for chunk in store.scan_classifications(50) for row in chunk]) == 21
+    path = str(tmp_path / "model.npz")
+    model.save(path)
+    [row] = bench.bench_classifier(path, storage=store)
+    # Одинаковые нормализованные тексты схлопнуты; строка unban — не вердикт OpenAI
+    assert row["op"] == "score" and row["samples"] == len(build_training_set([rows[:-1]])) and row["p99_us"] > 0
+    store.prune_classifications(-1)
+    assert list(store.scan_classifications(50)) == []
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_history_is_pruned_to_retention(history, monkeypatch):
+    monkeypatch.setattr(local_classifier, "_last_prune", None)
+    history.record_classifications([(1, 10, SCOPE, "old", False, "llm")])
+    history._classifications[0] = history._classifications[0][:6] + (0.0,)  # запись из 1970 года
+    local_classifier.record_classification(2, 10, SCOPE, "fresh", True)
+    await asyncio.gather(*local_classifier._record_tasks)
+    assert [row[3] for chunk in history.scan_classifications(10) for row in chunk] == ["fresh"]
+    # Следующая запись в пределах интервала новую чистку не запускает
+    before = local_classifier.classifier_stats["prunes"]
+    local_classifier.record_classification(3, 10, SCOPE, "next", False)
+    await asyncio.gather(*local_classifier._record_tasks)
+    assert local_classifier.classifier_stats["prunes"] == before
+    monkeypatch.setattr(local_classifier, "CLASSIFIER_HISTORY_RETENTION_DAYS", 0)
+    assert local_classifier.prune_classification_history(history) is False
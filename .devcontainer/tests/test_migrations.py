@@ -0,0 +1,171 @@
+import re
+
+import pytest
+
+from app import migrations
+from app.migrations import MIGRATIONS, Migration, MigrationError, run_migrations
+
+LATEST = MIGRATIONS[-1].version
+
+
+class SchemaCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+        self.rowcount = 0
+
+    def execute(self, q, params=None):
+        q = " ".join(q.split())
+        self.db.queries.append(q)
+        self.result = []
+        if q.startswith("SELECT COALESCE(MAX(version), 0)"):
+            self.result = [(max(self.db.versions, default=0),)]
+        elif q.startswith("INSERT INTO schema_version"):
+            self.db.versions.append(params[0])
+        elif q.startswith("SELECT GET_LOCK"):
+            self.result = [(1 if self.db.lock_free else 0,)]
+            self.db.locked = self.db.lock_free
+        elif q.startswith("SELECT RELEASE_LOCK"):
+            self.db.locked = False
+            self.result = [(1,)]
+        elif q.startswith("CREATE TABLE IF NOT EXISTS"):
+            table = q.split()[5].strip("`")
+            if table not in self.db.indexes:
+                self.db.indexes[table] = {"PRIMARY"} | set(re.findall(r"KEY (\w+) \(", q))
+        elif q.startswith("SHOW INDEX FROM"):
+            table = q.split()[3]
+            self.result = [(table, 0, name) for name in self.db.indexes.get(table, set())]
+        elif q.startswith("SHOW COLUMNS FROM"):
+            self.result = [(params[0],)] if params[0] in self.db.columns else []
+        elif q.startswith("SELECT COUNT(*) FROM (SELECT user_id"):
+            self.result = [(self.db.duplicates,)]
+        elif q.startswith("SELECT user_id, group_id, COUNT(*)"):
+            self.result = [(1, 10, 2)] if self.db.duplicates else []
+        elif q.startswith("DELETE ue FROM user_entries"):
+            self.rowcount = self.db.duplicates
+            self.db.duplicates = 0
+        elif q.startswith("ALTER TABLE"):
+            table = q.split()[2]
+            indexes = self.db.indexes.setdefault(table, set())
+            for clause in q.split(" ", 3)[3].split(", "):
+                words = clause.split()
+                if clause.startswith("ADD COLUMN updated_at"):
+                    self.db.columns.add("updated_at")
+                elif words[0] == "ADD" and "KEY" in words:
+                    indexes.add(words[words.index("KEY") + 1])
+                elif words[:2] == ["DROP", "KEY"]:
+                    indexes.discard(words[2])
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class SchemaDB:
+    def __init__(self, versions=(), indexes=None, columns=(), duplicates=0):
+        self.versions = list(versions)
+        self.indexes = indexes or {}
+        self.columns = set(columns)
+        self.duplicates = duplicates
+        self.queries = []
+        self.lock_free = True
+        self.locked = False
+
+    def cursor(self):
+        return SchemaCursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def scans(self):
+        return [q for q in self.queries if "COUNT(*)" in q or q.startswith("SHOW")]
+
+
+def test_current_schema_does_no_work():
+    db = SchemaDB(versions=range(1, LATEST + 1))
+    assert run_migrations(db) == []
+    assert len(db.queries) == 2  # CREATE TABLE IF NOT EXISTS schema_version + MAX(version)
+    assert not db.scans() and not any("GET_LOCK" in q for q in db.queries)
+
+
+def test_legacy_table_is_deduplicated_once_then_upgraded():
+    # Таблица из старой версии: без уникального ключа, без updated_at, с дубликатами
+    db = SchemaDB(indexes={"user_entries": {"PRIMARY", "idx_user"}, "group_settings": {"PRIMARY"}}, duplicates=3)
+    assert run_migrations(db) == [m.version for m in MIGRATIONS]
+    assert db.versions == [m.version for m in MIGRATIONS]
+    assert any(q.startswith("DELETE ue FROM user_entries") for q in db.queries)
+    assert db.indexes["user_entries"] == {"PRIMARY", "uniq_user_group", "idx_group", "idx_updated_at", "idx_user_flags"}
+    assert "unique_group_parameter" in db.indexes["group_settings"]
+    assert "updated_at" in db.columns
+    # Индексы добавляются онлайн
+    assert all("ALGORITHM=INPLACE, LOCK=NONE" in q for q in db.queries if q.startswith("ALTER TABLE"))
+    assert not db.locked
+    # Повторный старт — без сканов
+    db.queries.clear()
+    assert run_migrations(db) == [] and not db.scans()
+
+
+def test_fresh_database_skips_superseded_indexes():
+    db = SchemaDB()
+    assert run_migrations(db) == [m.version for m in MIGRATIONS]
+    assert db.indexes["user_entries"] == {"PRIMARY", "uniq_user_group", "idx_group", "idx_updated_at", "idx_user_flags"}
+    # Ни создания, ни удаления idx_user / idx_spammer / idx_seen
+    assert not any("DROP KEY" in q or "idx_user_flags" in q for q in db.queries if q.startswith("ALTER TABLE"))
+
+
+def test_failed_step_is_not_recorded_and_lock_is_released():
+    db = SchemaDB(versions=[1])
+
+    def boom(conn):
+        raise MigrationError("nope")
+
+    steps = [MIGRATIONS[0], Migration(2, "broken", boom), Migration(3, "never", lambda conn: None)]
+    with pytest.raises(MigrationError):
+        run_migrations(db, steps)
+    assert db.versions == [1] and not db.locked
+
+
+def test_lock_timeout_and_bad_ordering_raise():
+    db = SchemaDB()
+    db.lock_free = False
+    with pytest.raises(MigrationError):
+        run_migrations(db, lock_timeout=0)
+    assert db.versions == []
+    with pytest.raises(MigrationError):
+        run_migrations(SchemaDB(), [MIGRATIONS[1], MIGRATIONS[0]])
+
+
+def test_online_alter_falls_back_when_unsupported(monkeypatch):
+    import mysql.connector
+
+    class Picky(SchemaCursor):
+        def execute(self, q, params=None):
+            if "ALGORITHM=INPLACE" in q:
+                self.db.queries.append(q)
+                raise mysql.connector.Error("ALGORITHM=INPLACE is not supported")
+            super().execute(q, params)
+
+    db = SchemaDB()
+    db.cursor = lambda: Picky(db)
+    migrations._alter_online(db, "user_entries", "ADD KEY idx_x (user_id)")
+    assert "idx_x" in db.indexes["user_entries"]
+
+
+def test_covering_index_replaces_single_column_indexes():
+    db = SchemaDB(versions=range(1, 5), indexes={
+        "user_entries": {"PRIMARY", "uniq_user_group", "idx_user", "idx_group", "idx_spammer", "idx_seen", "idx_updated_at"},
+    })
+    assert run_migrations(db) == list(range(5, LATEST + 1))
+    alters = [q for q in db.queries if q.startswith("ALTER TABLE")]
+    # Сначала новый индекс, затем (одним ALTER) удаление старых
+    assert "ADD KEY idx_user_flags (user_id, spammer, seen_message, group_id)" in alters[0]
+    assert "DROP KEY idx_user, DROP KEY idx_spammer, DROP KEY idx_seen" in alters[1]
+    assert db.indexes["user_entries"] == {"PRIMARY", "uniq_user_group", "idx_group", "idx_updated_at", "idx_user_flags"}
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import telegram_messages
+from app.near_duplicates import NearDuplicateIndex, hamming_distance, near_duplicate_index, simhash
+
+TEMPLATE = "🔥🔥 Заработок от 5000 рублей в день! Пиши в ЛС @earnbot, подробности по ссылке https://t.me/earn_fast 💰"
+VARIANT = "🔥 Заработок от 7000 рублей в день!!! Пиши в лс @moneybot   подробности по ссылке https://bit.ly/xyz 💵💵"
+HAM = "Всем привет, подскажите, где в городе можно недорого починить велосипед? Заранее спасибо"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_variants_share_fingerprint_and_ham_does_not():
+    assert hamming_distance(simhash(TEMPLATE), simhash(VARIANT)) <= 3
+    assert hamming_distance(simhash(TEMPLATE), simhash(HAM)) > 3
+    assert simhash("Привет!") is None  # короткий текст не индексируется
+
+
+def test_index_finds_within_distance_and_scope():
+    index = NearDuplicateIndex(max_size=10, max_distance=3)
+    base = 0xDEADBEEF12345678
+    index.add(b"a", base)
+    assert index.find(b"a", base ^ 0b111) == base  # 3 бита
+    assert index.find(b"a", base ^ 0b1111) is None  # 4 бита
+    assert index.find(b"b", base) is None  # другие инструкции
+    # Отличия в разных полосах: совпадение всё равно находится через оставшуюся полосу
+    assert index.find(b"a", base ^ (1 | 1 << 20 | 1 << 40)) == base
+    stats = index.snapshot_stats()
+    assert stats["hits"] == 2 and stats["misses"] == 2 and stats["size"] == 1
+
+
+def test_index_is_capped_and_expires():
+    clock = FakeClock()
+    index = NearDuplicateIndex(max_size=2, max_distance=0, ttl=10, clock=clock)
+    for fp in (1, 2, 3):
+        index.add(b"s", fp)
+    assert len(index) == 2 and index.find(b"s", 1) is None and index.stats["evictions"] == 1
+    clock.now = 11
+    assert index.find(b"s", 3) is None and len(index) == 0 and not index._buckets
+    assert NearDuplicateIndex(max_size=0, max_distance=3).add(b"s", 1) is False
+
+
+@pytest.mark.asyncio
+async def test_process_spam_flags_variant_without_openai(monkeypatch):
+    calls = []
+
+    async def fake_check(text, instructions):
+        calls.append(text)
+        return "заработок" in text.lower()
+    monkeypatch.setattr(telegram_messages, "classify_with_openai", fake_check)
+    user, chat = SimpleNamespace(id=5, username="u", full_name="U"), SimpleNamespace(id=123, title="g", type="supergroup")
+
+    async def classify(text):
+        msg = SimpleNamespace(text=text, caption=None, forward_origin=None, is_automatic_forward=False)
+        return await telegram_messages.process_spam(SimpleNamespace(message=msg), None, user, chat)
+
+    assert await classify(TEMPLATE) is True
+    assert await classify(VARIANT) is True
+    assert await classify(HAM) is False
+    assert calls == [TEMPLATE, HAM]
+    assert near_duplicate_index.stats["hits"] >= 1 and len(near_duplicate_index) == 1
@@ -0,0 +1,82 @@
+from app import database
+from app.caches import BloomFilter, NegativeCache
+# Ссылки берём при импорте: другие тесты подменяют атрибуты модуля database без восстановления
+from app.database import rebuild_negative_blooms, user_has_spammer_anywhere
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+
+def test_entries_are_bounded_and_expire():
+    clock = Clock()
+    cache = NegativeCache(max_size=2, ttl=10, clock=clock)
+    cache.update([1, 2])
+    assert 1 in cache  # 1 становится самым свежим
+    cache.add(3)
+    assert set(cache) == {1, 3} and cache.stats["evictions"] == 1
+    clock.now = 11
+    assert 1 not in cache and len(cache) == 1
+    assert cache.stats["expirations"] == 1
+
+
+def test_bloom_front_answers_for_everyone_outside_positive_set():
+    cache = NegativeCache(max_size=100, bloom_error_rate=0.01)
+    cache.rebuild_bloom([10, 11], 2)
+    assert 12 in cache and cache.stats["bloom_negatives"] == 1
+    cache.add(12)  # фильтр и так отвечает «нет» — запись не нужна
+    assert len(cache) == 0
+    # Флаг сняли с позитивного пользователя: нужна явная запись
+    assert 10 not in cache
+    cache.add(10)
+    assert 10 in cache and cache.stats["bloom_false_positives"] == 1
+    # Стал позитивным: запись снята, фильтр пополнен
+    cache.discard(13)
+    assert 13 not in cache
+    cache.clear()
+    assert cache.bloom is None and 12 not in cache
+
+
+def test_bloom_filter_false_positive_rate():
+    bloom = BloomFilter(10000, 0.01)
+    bloom.update(range(0, 20000, 2))
+    assert all(v in bloom for v in range(0, 20000, 2))
+    false_positives = sum(1 for v in range(1, 200001, 2) if v in bloom)
+    assert false_positives / 100000 < 0.02
+    assert bloom.memory_bytes() < 10000 * 2
+
+
+class FakeCursor:
+    def execute(self, q, params):
+        pass
+    def fetchone(self):
+        return None
+    def close(self):
+        pass
+
+
+class FakeConn:
+    def cursor(self):
+        return FakeCursor()
+    def close(self):
+        pass
+
+
+def test_lookups_skip_db_behind_bloom_and_count_fallbacks(monkeypatch):
+    monkeypatch.setattr(database, 'get_db_connection', lambda: FakeConn())
+    database.spammers_cache.update([1, 2])
+    assert rebuild_negative_blooms() == 2
+    assert user_has_spammer_anywhere(5) is False
+    assert database.debug_counter_spammer_queries == 0
+    # Флаг сняли в обход кэша: фильтр отвечает «возможно» -> запрос в БД -> явная запись
+    database.spammers_cache.discard(2)
+    assert user_has_spammer_anywhere(2) is False
+    assert user_has_spammer_anywhere(2) is False
+    stats = database.get_negative_cache_stats()["spammer"]
+    assert stats["db_fallbacks"] == 1 and stats["bloom_false_positives"] == 1
+    assert stats["bloom_fp_rate"] == 0.5 and stats["bloom_items"] == 2
+    # Переполненный фильтр перестраивает только сверка (only_saturated)
+    assert rebuild_negative_blooms(only_saturated=True) == 0
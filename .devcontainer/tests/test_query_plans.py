@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from app.query_plans import HOT_QUERIES, check_query_plans, plan_problems
+
+
+def row(**kw):
+    base = {"id": 1, "select_type": "SIMPLE", "table": "user_entries", "type": "ref", "key": "idx_user_flags", "Extra": "Using index"}
+    base.update(kw)
+    return base
+
+
+def test_index_only_and_single_row_plans_pass():
+    assert plan_problems([row()]) == []
+    assert plan_problems([row(Extra="Using where; Using index")]) == []
+    assert plan_problems([row(type="index", Extra="Using index")]) == []  # холодная загрузка: полный проход по индексу
+    assert plan_problems([row(type="const", key="uniq_user_group", Extra=None)]) == []
+    assert plan_problems([row(table="<derived2>", type="ALL", key=None)]) == []
+
+
+def test_table_scans_and_row_lookups_are_reported():
+    assert "no index used" in plan_problems([row(type="ALL", key=None, Extra="Using where")])[0]
+    # Using index condition (ICP) — это чтение строк, а не index-only
+    problems = plan_problems([row(key="idx_user", Extra="Using index condition; Using where")])
+    assert problems and "does not cover" in problems[0]
+
+
+def test_hot_queries_are_the_ones_the_code_runs():
+    from app import database
+    sqls = {name: sql for name, sql, _params in HOT_QUERIES}
+    assert sqls["user_has_spammer_anywhere"] is database.SPAMMER_ANYWHERE_SQL
+    assert sqls["cold_load_scan"] is database.COLD_LOAD_SQL
+    assert all(sql.count("%s") == len(params) for _name, sql, params in HOT_QUERIES)
+
+
+@pytest.mark.skipif(not os.getenv("QUERY_PLAN_CHECK"), reason="set QUERY_PLAN_CHECK=1 and DB_* to run against a local MySQL/MariaDB")
+def test_hot_queries_use_index_only_plans_on_live_db():
+    from app import database
+    from app.query_plans import seed_user_entries
+    database.check_and_create_tables()
+    conn = database.get_db_connection()
+    try:
+        seed_user_entries(conn, 30000)
+        results = check_query_plans(conn)
+    finally:
+        conn.close()
+    assert {name: problems for name, (_rows, problems) in results.items() if problems} == {}
@@ -0,0 +1,125 @@
+import os
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app import database, settings_reload
+from app.settings_reload import GroupSettingsWatcher
+from app.telegram_commands import reload_group_command
+
+T0 = datetime(2026, 1, 1, 12, 0, 0)
+
+
+class SettingsCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+
+    def execute(self, q, params=()):
+        q = " ".join(q.split())
+        self.db.queries.append(q)
+        if q.startswith("SELECT group_id, MAX(updated_at) FROM group_settings"):
+            versions = {}
+            for (gid, _param), (_value, ts) in self.db.settings.items():
+                if not params or ts > params[0]:
+                    versions[gid] = max(ts, versions.get(gid, ts))
+            self.result = list(versions.items())
+        elif q.startswith("SELECT g.group_id, s.parameter, s.value"):
+            gid = params[0]
+            if gid not in self.db.groups:
+                self.result = []
+            else:
+                rows = [(gid, p, v) for (g, p), (v, _ts) in self.db.settings.items() if g == gid]
+                self.result = rows or [(gid, None, None)]
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class SettingsDB:
+    def __init__(self):
+        self.groups = {1, 2}
+        self.settings = {(1, "instructions"): ("old", T0), (2, "instructions"): ("two", T0)}
+        self.queries = []
+
+    def cursor(self, dictionary=False):
+        return SettingsCursor(self)
+
+    def close(self):
+        pass
+
+    def set(self, gid, param, value, ts):
+        self.settings[(gid, param)] = (value, ts)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    d = SettingsDB()
+    monkeypatch.setattr(database, 'get_db_connection', lambda: d)
+    database.configured_groups_cache[:] = [
+        {"group_id": 1, "settings": {"instructions": "old"}},
+        {"group_id": 2, "settings": {"instructions": "two"}},
+    ]
+    return d
+
+
+def reloads(db):
+    return [q for q in db.queries if q.startswith("SELECT g.group_id")]
+
+
+def test_poll_reloads_only_groups_with_new_version(db, monkeypatch):
+    monkeypatch.setattr(database, 'reload_configured_groups', lambda: None)
+    watcher = GroupSettingsWatcher(interval=60, lookback=5)
+    watcher.prime()
+    assert watcher.run_once() == 0 and reloads(db) == []
+    before = database.configured_groups_cache.info(2)
+    db.set(1, "instructions", "new", T0 + timedelta(seconds=30))
+    assert watcher.run_once() == 1
+    assert database.configured_groups_cache.instructions(1) == "new"
+    assert database.configured_groups_cache.info(2) is before  # другие группы не пересобираются
+    # Строка в окне lookback, но версия уже учтена — повторно не перечитывается
+    assert watcher.run_once() == 0 and len(reloads(db)) == 1
+
+
+def test_forced_refresh_and_removed_group(db):
+    watcher = GroupSettingsWatcher(interval=60, lookback=0)
+    events = []
+    database.set_cache_event_publisher(lambda kind, **kw: events.append((kind, kw.get("group_id"))))
+    try:
+        db.set(2, "instructions", "edited", T0)
+        assert watcher.refresh_group(2) is True
+        assert database.configured_groups_cache.instructions(2) == "edited"
+        db.groups.discard(2)
+        assert watcher.refresh_group(2) is False
+        assert 2 not in database.configured_groups_cache
+    finally:
+        database.set_cache_event_publisher(None)
+    assert events == [("group", 2), ("group", 2)]
+
+
+class DummyMessage:
+    def __init__(self, text):
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, txt):
+        self.replies.append(txt)
+
+
+@pytest.mark.asyncio
+async def test_reload_group_command(db, monkeypatch):
+    from app import telegram_commands
+    admin = SimpleNamespace(id=int(os.getenv('ADMIN_TELEGRAM_ID') or 999999))
+    monkeypatch.setattr(telegram_commands, 'ADMIN_TELEGRAM_ID', str(admin.id))
+    monkeypatch.setattr(telegram_commands, 'refresh_group_settings', GroupSettingsWatcher(60, 0).refresh_group)
+    db.set(1, "instructions", "via command", T0)
+    msg = DummyMessage("/reload_group 1")
+    update = SimpleNamespace(message=msg, effective_chat=SimpleNamespace(id=5, type='private'), effective_user=admin, update_id=1)
+    await reload_group_command(update, SimpleNamespace(bot=None))  # type: ignore
+    assert database.configured_groups_cache.instructions(1) == "via command"
+    assert msg.replies and "перечитаны" in msg.replies[0]
+    assert settings_reload.settings_watcher.active is False
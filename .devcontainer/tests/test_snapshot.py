@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+import pytest
+
+from app import database, snapshot
+from app.snapshot import Snapshot, SnapshotError, write_snapshot, save_cache_snapshot, restore_cache_snapshot
+
+
+@pytest.fixture
+def db(monkeypatch):
+    from test_cache_refresh import ChangeFeed
+    feed = ChangeFeed()
+    feed.upsert(10, 123, seen=True)
+    feed.upsert(11, 123, spammer=True)
+    monkeypatch.setattr(database, 'fetch_user_entry_changes', feed.fetch)
+    monkeypatch.setattr(database, 'aggregate_user_flags', feed.aggregate)
+    monkeypatch.setattr(database, 'get_user_entries_high_water_mark',
+                        lambda: max((r[3] for r in feed.rows.values()), default=None))
+    def load_groups():
+        database.configured_groups_cache[:] = [{"group_id": 123, "settings": {"instructions": "db"}}]
+    monkeypatch.setattr(database, 'load_configured_groups', load_groups)
+    monkeypatch.setattr(snapshot.cache_refresher, 'lookback', timedelta(0))
+    return feed
+
+
+def test_roundtrip_and_corruption_detection(tmp_path):
+    path = str(tmp_path / "snap.bin")
+    groups = [{"group_id": -100, "settings": {"instructions": "ё"}}]
+    write_snapshot(path, 42, {3, 1, 2}, [7], set(), groups)
+    with Snapshot(path) as snap:
+        assert snap.high_water_mark == 42
+        assert list(snap.spammers) == [1, 2, 3] and list(snap.seen) == [7] and list(snap.suspicious) == []
+        assert snap.groups == groups
+    data = bytearray(open(path, "rb").read())
+    data[snapshot.HEADER.size] ^= 0xFF
+    open(path, "wb").write(bytes(data))
+    with pytest.raises(SnapshotError):
+        Snapshot(path)
+
+
+def test_restore_loads_snapshot_then_catches_up(tmp_path, db):
+    path = str(tmp_path / "snap.bin")
+    database.seen_users_cache.add(10)
+    database.spammers_cache.add(11)
+    database.configured_groups_cache[:] = [{"group_id": 123, "settings": {}}]
+    assert save_cache_snapshot(path)
+    mark = db.now
+    # Другой процесс добавил строки и снял бан после снимка
+    db.upsert(12, 123)
+    db.upsert(13, 123, spammer=True)
+    db.upsert(11, 123, spammer=False)
+    database.spammers_cache.clear()
+    database.seen_users_cache.clear()
+    database.not_spammers_cache.add(13)
+
+    assert restore_cache_snapshot(path) is True
+    assert set(database.seen_users_cache) == {10}
+    assert set(database.spammers_cache) == {13}
+    assert 12 in database.suspicious_users_cache and 11 in database.not_spammers_cache
+    assert 13 not in database.not_spammers_cache
+    # Догружены только изменения после отметки снимка
+    assert db.fetches[0] == (mark, 0)
+    assert database.configured_groups_cache == [{"group_id": 123, "settings": {"instructions": "db"}}]
+
+
+def test_stale_missing_or_rewound_snapshot_is_rejected(tmp_path, db):
+    path = str(tmp_path / "snap.bin")
+    assert restore_cache_snapshot(path) is False  # нет файла
+    write_snapshot(path, 2, [], [], [], [], created_at=0)
+    assert restore_cache_snapshot(path, max_age=3600) is False  # устарел
+    ahead = database.watermark_to_int(db.now + timedelta(hours=1))
+    write_snapshot(path, ahead, [], [], [], [])
+    assert restore_cache_snapshot(path, max_age=3600) is False  # отметка впереди БД
@@ -0,0 +1,93 @@
+import pytest
+
+from app import cache_bus, database
+from app.cache_bus import CacheEvent
+from app.cache_refresh import CacheRefresher
+from app.caches import SpamGroupIndex
+from app.snapshot import Snapshot, write_snapshot
+from app.storage import MemoryStorage, set_storage
+# Ссылки берём при импорте: другие тесты подменяют атрибуты модуля database без восстановления
+from app.database import (
+    clear_spammer_everywhere, clear_spammer_flag_in_group, groups_where_spammer, load_user_caches,
+    mark_spammer_in_group, spam_group_count, user_has_spammer_anywhere, user_is_spammer_in_group,
+)
+
+
+class NoReadStorage(MemoryStorage):
+    """Backend, которому запрещены точечные чтения флагов спамера."""
+
+    def _forbidden(self, *args):
+        raise AssertionError("spam flags must be answered by spam_groups_index")
+
+    spammer_anywhere = groups_where_spammer = spammer_in_group = _forbidden
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    monkeypatch.setattr(database, 'write_behind', database.WriteBehindQueue(batch_size=100, flush_interval=60))
+    backend = NoReadStorage()
+    previous = set_storage(backend)
+    yield backend
+    set_storage(previous)
+
+
+def test_index_keeps_compact_values():
+    index = SpamGroupIndex()
+    assert index.add(1, -10) == 1 and index.add(1, -10) == 1
+    assert index._data[1] == -10  # одна группа — просто int
+    assert index.add(1, -20) == 2 and index.groups(1) == (-20, -10)
+    assert index.discard(1, -20) == 1 and index._data[1] == -10
+    assert index.rekey_group(-10, -100) == 1 and index.groups(1) == (-100,)
+    assert index.discard(1, -100) == 0 and 1 not in index
+    index.replace([(2, -1), (2, -2), (3, -1)])
+    assert index.ready and sorted(index.pairs()) == [(2, -2), (2, -1), (3, -1)]
+    assert index.discard_user(2) == (-2, -1)
+    assert index.snapshot_stats() == {"ready": True, "users": 1, "pairs": 1, "multi_group_users": 0}
+    index.clear()
+    assert not index.ready and len(index) == 0
+
+
+def test_loaded_index_answers_without_db(storage):
+    storage.upsert_entries([(5, 123, False, True), (5, 100, None, True), (6, 123, True, False)])
+    load_user_caches()
+    assert database.spam_groups_index.ready
+    database.spammers_cache.clear()
+    assert sorted(groups_where_spammer(5)) == [100, 123] and spam_group_count(5) == 2
+    assert user_has_spammer_anywhere(5) and not user_has_spammer_anywhere(6)
+    assert user_is_spammer_in_group(5, 100) and not user_is_spammer_in_group(6, 123)
+    assert database.debug_counter_spammer_queries == 0
+
+    assert clear_spammer_flag_in_group(5, 100)
+    assert groups_where_spammer(5) == [123] and user_has_spammer_anywhere(5)
+    assert mark_spammer_in_group(6, 100) and groups_where_spammer(6) == [100]
+    assert clear_spammer_everywhere(6) == [100]
+    assert spam_group_count(6) == 0 and 6 not in database.spam_groups_index
+
+
+def test_group_redirect_rekeys_index(storage):
+    load_user_caches()
+    database.spam_groups_index.add(7, -8)
+    database.add_group_redirect(-8, -1008)
+    assert database.spam_groups_index.groups(7) == (-1008,)
+    assert groups_where_spammer(7) == [-1008] and user_is_spammer_in_group(7, -8)
+
+
+def test_snapshot_carries_index(tmp_path):
+    path = str(tmp_path / "snap.bin")
+    write_snapshot(path, 1, [4, 5], [], [], [], spam_groups=[(5, -2), (4, -1), (5, -1)])
+    with Snapshot(path) as snap:
+        assert list(snap.spam_groups()) == [(4, -1), (5, -2), (5, -1)]
+
+
+def test_refresh_and_bus_events_update_index(monkeypatch):
+    database.spam_groups_index.replace([(1, -1)])
+    monkeypatch.setattr(database, 'aggregate_user_flags', lambda ids: {2: (True, False, False)})
+    refresher = CacheRefresher(interval=60, batch_size=10, lookback=0)
+    refresher._apply_batch([(1, 1, -1, 0, 0, None), (2, 2, -5, 0, 1, None)], database.local_write_token())
+    assert 1 not in database.spam_groups_index and database.spam_groups_index.groups(2) == (-5,)
+
+    cache_bus.apply_events([CacheEvent("spammer", 3, -1), CacheEvent("spammer", 3, -2),
+                            CacheEvent("clear_spammer", 3, -1, value=1)])
+    assert database.spam_groups_index.groups(3) == (-2,)
+    cache_bus.apply_events([CacheEvent("unban", 3)])
+    assert 3 not in database.spam_groups_index
@@ -0,0 +1,151 @@
+import threading
+
+import pytest
+
+from app import bench, database, group_migration
+# Ссылки берём при импорте: другие тесты подменяют атрибуты модуля database без восстановления
+from app.database import (
+    clear_spammer_flag_in_group, get_user_entry, groups_where_spammer, mark_seen_in_group,
+    mark_spammer_in_group, mark_unseen_in_group,
+)
+from app.storage import ChangeTrackingUnsupported, MemoryStorage, SQLiteStorage, set_storage
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def storage(request, tmp_path):
+    backend = MemoryStorage() if request.param == "memory" else SQLiteStorage(str(tmp_path / "bot.sqlite3"))
+    backend.setup()
+    yield backend
+    backend.close()
+
+
+@pytest.fixture
+def installed(storage, monkeypatch):
+    """Backend подставлен под database.py; отложенная запись выключена (пишем сразу)."""
+    monkeypatch.setattr(database, 'write_behind', database.WriteBehindQueue(batch_size=100, flush_interval=60))
+    previous = set_storage(storage)
+    yield storage
+    set_storage(previous)
+
+
+def test_entry_contract(storage):
+    assert storage.get_entry(1, 10) is None
+    assert storage.user_state(1, 10) == (False, False, None)
+    storage.upsert_entry(1, 10, seen=False)
+    storage.upsert_entry(1, 20, spammer=True)
+    storage.upsert_entry(1, 10)  # ensure: существующую строку не меняет
+    assert storage.get_entry(1, 10) == (False, False)
+    assert storage.user_state(1, 10) == (True, False, (False, False))
+    storage.upsert_entries([(1, 10, True, False), (2, 10, None, True), (1, 20, None, False)])
+    assert storage.get_entry(1, 10) == (True, False)
+    assert storage.get_entry(1, 20) == (False, True)  # spammer=False флаг не сбрасывает
+    assert storage.seen_anywhere(1) and not storage.seen_anywhere(2)
+    assert storage.spammer_anywhere(2) and storage.spammer_in_group(2, 10)
+    assert sorted(storage.groups_where_spammer(1)) == [20]
+    storage.clear_spammer(1, 20)
+    storage.clear_spammer(3, 30)  # отсутствующая строка не создаётся
+    assert not storage.spammer_anywhere(1) and storage.get_entry(3, 30) is None
+    rows = sorted(row for chunk in storage.scan_user_flags(2) for row in chunk)
+    assert [tuple(map(int, r)) for r in rows] == [(1, 0, 0, 20), (1, 1, 0, 10), (2, 0, 1, 10)]
+
+
+def test_aggregate_flags_and_change_tracking(storage):
+    storage.upsert_entries([(1, 10, False, False), (1, 20, True, True), (2, 10, True, False)])
+    assert storage.aggregate_user_flags([1, 2, 3]) == {1: (True, True, True), 2: (False, True, False)}
+    assert storage.aggregate_user_flags([]) == {}
+    assert not storage.tracks_changes
+    with pytest.raises(ChangeTrackingUnsupported):
+        storage.user_entries_high_water_mark()
+    with pytest.raises(ChangeTrackingUnsupported):
+        storage.user_entry_changes((None, 0), 10)
+    with pytest.raises(ChangeTrackingUnsupported):
+        storage.group_settings_versions()
+
+
+def test_group_contract(storage):
+    storage.add_group(-1, {"instructions": "a"})
+    storage.add_group(-1)  # повторная регистрация настройки не трогает
+    storage.add_group(-2)
+    assert storage.load_groups() == {-1: {"instructions": "a"}, -2: {}}
+    assert storage.load_group(-1) == {"instructions": "a"} and storage.load_group(-3) is None
+    storage.remove_group(-2)
+    assert storage.load_group(-2) is None
+    storage.upsert_entries([(1, -1, True, False), (1, -100, False, True), (2, -1, False, False)])
+    storage.record_group_redirect(-1, -100)
+    assert storage.move_group(-1, -100) == 2
+    assert storage.load_group_redirects() == {-1: -100}
+    assert storage.load_groups() == {-100: {"instructions": "a"}}
+    # Конфликт строк пользователя 1: флаги объединяются
+    assert storage.get_entry(1, -100) == (True, True) and storage.get_entry(1, -1) is None
+    assert storage.get_entry(2, -100) == (False, False)
+
+
+def test_concurrent_writers(storage):
+    def writer(base):
+        for i in range(200):
+            storage.upsert_entry(base + i % 20, 10, seen=bool(i % 2))
+            storage.upsert_entries([(base + i % 20, 11, None, i % 7 == 0)])
+
+    threads = [threading.Thread(target=writer, args=(b,)) for b in (0, 1000, 2000)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(len(chunk) for chunk in storage.scan_user_flags(100)) == 3 * 20 * 2
+
+
+def test_database_layer_runs_on_backend(installed):
+    database.check_and_create_tables()
+    assert mark_unseen_in_group(5, 123) and 5 in database.suspicious_users_cache
+    assert mark_spammer_in_group(5, 123)
+    assert installed.get_entry(5, 123) == (False, True)
+    database.user_entry_cache.clear()
+    assert get_user_entry(5, 123) == (False, True)
+    assert groups_where_spammer(5) == [123]
+    assert clear_spammer_flag_in_group(5, 123) and 5 not in database.spammers_cache
+    mark_seen_in_group(6, 100)
+    stats = database.load_user_caches()
+    assert stats["rows"] == 2 and 6 in database.seen_users_cache and 5 in database.suspicious_users_cache
+    database.spammers_cache.clear()
+    database.not_spammers_cache.clear()
+    assert database.resolve_user_state(6, 100) == database.UserState(False, True, (True, False))
+
+
+def test_groups_and_migration_on_backend(installed):
+    database.register_channel_group(-7)
+    database._insert_configured_group(-8)
+    database.reload_configured_groups()
+    assert database.configured_groups_cache.settings(-7) == {}
+    assert database.configured_groups_cache.instructions(-8) == database.INSTRUCTIONS_DEFAULT_TEXT
+    installed.upsert_entry(9, -8, spammer=True)
+    group_migration.record_group_migration(-8, -1008)
+    # Переадресация и перенос — одна транзакция; задание воркера уже ничего не переносит
+    assert installed.get_entry(9, -1008) == (False, True) and installed.get_entry(9, -8) is None
+    assert group_migration.migrate_group_rows(-8, -1008) == 0
+    assert group_migration.pending_group_migrations() == []
+    database.reload_configured_groups()
+    assert database.resolve_group_id(-8) == -1008 and database.is_group_configured(-8)
+    assert groups_where_spammer(9) == [-1008]
+    database.remove_configured_group(-7)
+    assert installed.load_group(-7) is None and -7 not in database.configured_groups_cache
+
+
+def test_reload_rekeys_group_with_unfinished_move(installed):
+    # Переадресация сохранена, а строки группы ещё под старым id (перенос прерван)
+    installed.add_group(-100, {"instructions": "x"})
+    installed.add_group(-300)
+    installed.add_group(-400, {"instructions": "own"})
+    installed.record_group_redirect(-100, -200)
+    installed.record_group_redirect(-300, -400)
+    database.reload_configured_groups()
+    assert database.is_group_configured(-100) and database.is_group_configured(-200)
+    assert database.configured_groups_cache.settings(-200) == {"instructions": "x"}
+    assert database.configured_groups_cache.settings(-400) == {"instructions": "own"}
+    assert sorted(database.configured_groups_cache.ids()) == [-400, -200]
+
+
+def test_storage_benchmark_runs(tmp_path):
+    rows = bench.bench_storage(["memory", "sqlite"], ops=50, users=20, groups=3, batch=10,
+                               sqlite_path=str(tmp_path / "bench.sqlite3"))
+    assert {(r["backend"], r["op"]) for r in rows} >= {("memory", "upsert"), ("sqlite", "user_state")}
+    assert all(r["ops_per_s"] > 0 for r in rows)
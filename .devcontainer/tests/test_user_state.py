@@ -0,0 +1,80 @@
+import pytest
+import mysql.connector
+
+from app import database
+from app.database import resolve_user_state, UserState
+
+
+class RowCursor:
+    def __init__(self, owner):
+        self.owner = owner
+    def execute(self, q, params=None):
+        if self.owner.fail:
+            raise mysql.connector.errors.OperationalError("db down")
+        self.owner.queries.append((" ".join(q.split()), params))
+    def fetchone(self):
+        return self.owner.row
+    def close(self):
+        pass
+
+
+class RowConn:
+    def __init__(self, row, fail=False):
+        self.row = row
+        self.fail = fail
+        self.queries = []
+    def cursor(self):
+        return RowCursor(self)
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    c = RowConn(row=(None, None, None, None, None))
+    monkeypatch.setattr(database, 'get_db_connection', lambda: c)
+    return c
+
+
+def test_single_query_resolves_global_and_group_state(conn):
+    # seen в другой группе, в этой группе записи нет
+    conn.row = (0, 1, 0, None, None)
+    state = resolve_user_state(7, 100)
+    assert state == UserState(spammer=False, seen=True, entry=None)
+    assert len(conn.queries) == 1
+    q, params = conn.queries[0]
+    assert "MAX(spammer)" in q and params == (100, 100, 100, 7)
+    # Результат прогревает кэши (включая negative)
+    assert 7 in database.seen_users_cache
+    assert 7 in database.not_spammers_cache
+
+
+def test_group_entry_is_returned(conn):
+    conn.row = (0, 0, 1, 0, 0)
+    state = resolve_user_state(8, 100)
+    assert state == UserState(False, False, (False, False))
+    assert 8 in database.not_seen_cache
+
+
+def test_cached_spammer_skips_db(conn):
+    database.spammers_cache.add(9)
+    state = resolve_user_state(9, 100)
+    assert state.spammer is True and state.entry is None
+    assert conn.queries == []
+
+
+def test_db_error_falls_back_to_caches(conn):
+    conn.fail = True
+    database.seen_users_cache.add(11)
+    state = resolve_user_state(11, 100)
+    assert state == UserState(False, True, None)
+
+
+@pytest.mark.asyncio
+async def test_async_repo_resolves_from_memory_without_executor(conn, monkeypatch):
+    database.spammers_cache.add(12)
+    def no_executor():
+        raise AssertionError("cached answer must not go through the executor")
+    monkeypatch.setattr(database, 'get_db_executor', no_executor)
+    state = await database.get_async_user_state_repo().resolve_user_state(12, 100)
+    assert state.spammer is True
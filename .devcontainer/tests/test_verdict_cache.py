@@ -0,0 +1,108 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import app.antispam as antispam
+from app.storage import MemoryStorage, SQLiteStorage, set_storage
+
+# Настоящая функция: conftest подменяет antispam.check_openai_spam заглушкой
+check_openai_spam = antispam.check_openai_spam
+
+
+class CountingCompletions:
+    def __init__(self, delay=0.0, reply=None):
+        self.delay = delay
+        self.reply = reply
+        self.calls = 0
+
+    async def create(self, messages, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        content = messages[-1]["content"]
+        reply = self.reply if self.reply is not None else json.dumps({"result": "spam" in content.lower()})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    completions = CountingCompletions()
+    monkeypatch.setattr(antispam, "get_openai_client",
+                        lambda: SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(antispam, "_openai_slots", None)
+    monkeypatch.setattr(antispam, "VERDICT_CACHE_PERSIST", False)
+    return completions
+
+
+@pytest.fixture
+def storage(fake, monkeypatch):
+    monkeypatch.setattr(antispam, "VERDICT_CACHE_PERSIST", True)
+    backend = MemoryStorage()
+    previous = set_storage(backend)
+    yield backend
+    set_storage(previous)
+
+
+def test_key_ignores_case_and_whitespace():
+    assert antispam.verdict_key("Buy  NOW\n", "a") == antispam.verdict_key(" buy now", "a")
+    assert antispam.verdict_key("buy now", "a") != antispam.verdict_key("buy now", "b")
+    assert all(len(part) == 16 for part in antispam.verdict_key("x", "y"))
+
+
+@pytest.mark.asyncio
+async def test_repeated_text_is_answered_from_cache(fake):
+    before = antispam.get_verdict_cache_stats()
+    assert await check_openai_spam("Cheap SPAM offer", "rules") is True
+    assert await check_openai_spam("cheap   spam OFFER ", "rules") is True
+    assert fake.calls == 1
+    # Другие инструкции группы — другой вердикт
+    assert await check_openai_spam("Cheap SPAM offer", "other rules") is True
+    assert fake.calls == 2
+    stats = antispam.get_verdict_cache_stats()
+    assert stats["hits"] - before["hits"] == 1 and stats["misses"] - before["misses"] == 2
+    assert stats["size"] == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_texts_share_one_call(fake):
+    fake.delay = 0.05
+    coalesced = antispam.verdict_stats["coalesced"]
+    results = await asyncio.gather(*(check_openai_spam("spam wave", "rules") for _ in range(5)))
+    assert results == [True] * 5 and fake.calls == 1
+    assert antispam.verdict_stats["coalesced"] == coalesced + 4
+    assert not antispam._verdict_inflight
+
+
+@pytest.mark.asyncio
+async def test_undecided_verdict_is_not_cached(fake, monkeypatch):
+    fake.reply = "not json"
+    assert await check_openai_spam("spam", "rules") is False
+    assert await antispam.classify_with_openai("spam", "rules") is None
+    assert len(antispam.verdict_cache) == 0
+    fake.reply = None
+    assert await check_openai_spam("spam", "rules") is True and fake.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_verdicts_persist_and_reload(fake, storage):
+    assert await check_openai_spam("persisted spam", "rules") is True
+    await asyncio.gather(*antispam._persist_tasks)
+    assert len(storage.load_verdicts(3600, 10)) == 1
+    antispam.verdict_cache.clear()
+    assert antispam.load_verdict_cache() == 1
+    assert await check_openai_spam("persisted spam", "rules") is True and fake.calls == 1
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_storage_verdict_contract(backend, tmp_path):
+    store = MemoryStorage() if backend == "memory" else SQLiteStorage(str(tmp_path / "v.db"))
+    store.setup()
+    th, ih = b"t" * 16, b"i" * 16
+    store.save_verdicts([(th, ih, True), (b"u" * 16, ih, False)])
+    store.save_verdicts([(th, ih, False)])  # upsert
+    assert sorted(store.load_verdicts(3600, 10)) == [(th, ih, False), (b"u" * 16, ih, False)]
+    assert len(store.load_verdicts(3600, 1)) == 1
+    store.prune_verdicts(-1)
+    assert store.load_verdicts(3600, 10) == []
+    store.close()
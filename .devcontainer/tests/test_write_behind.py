@@ -0,0 +1,121 @@
+import pytest
+import mysql.connector
+
+from app import database
+# Ссылки берём при импорте: другие тесты подменяют атрибуты модуля database без восстановления
+from app.database import (
+    mark_seen_in_group, mark_unseen_in_group, mark_spammer_in_group,
+    ensure_user_entry, get_user_entry, user_is_spammer_in_group,
+    clear_spammer_flag_in_group, clear_spammer_everywhere,
+)
+
+
+class RecordingCursor:
+    def __init__(self, log, fail):
+        self.log = log
+        self.fail = fail
+    def execute(self, q, params=None):
+        if self.fail:
+            raise mysql.connector.errors.OperationalError("db down")
+        self.log.append((" ".join(q.split()), params))
+    def close(self):
+        pass
+
+
+class RecordingConn:
+    def __init__(self, log, commits, fail=False):
+        self.log = log
+        self.commits = commits
+        self.fail = fail
+    def cursor(self):
+        return RecordingCursor(self.log, self.fail)
+    def commit(self):
+        self.commits.append(1)
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    q = database.WriteBehindQueue(batch_size=100, flush_interval=60)
+    monkeypatch.setattr(database, 'write_behind', q)
+    q.start()
+    yield q
+    if q.active:
+        q._thread, thread = None, q._thread
+        with q._cond:
+            q._stopping = True
+            q._cond.notify_all()
+        thread.join()
+
+
+def test_writes_coalesce_and_flush_as_multirow_upserts(queue, monkeypatch):
+    log, commits = [], []
+    monkeypatch.setattr(database, 'get_db_connection', lambda: RecordingConn(log, commits))
+    mark_unseen_in_group(1, 10)
+    mark_seen_in_group(1, 10)
+    mark_spammer_in_group(1, 10)
+    mark_unseen_in_group(2, 10)
+    mark_unseen_in_group(3, 10)
+    ensure_user_entry(4, 10)
+    assert log == []  # ничего не записано до сброса
+    pending = queue.pending_entry(1, 10)
+    assert pending.seen is True and pending.spammer is True
+    assert len(queue) == 4 and queue.stats["coalesced"] == 2
+
+    assert queue.stop() == 4
+    # Три «формы» строк -> три INSERT, одна транзакция
+    assert len(log) == 3 and commits == [1]
+    unseen = next(p for q, p in log if "seen_message=VALUES" in q and "spammer" not in q)
+    assert unseen == (2, 10, False, 3, 10, False)
+    both = next(p for q, p in log if "seen_message=VALUES" in q and "spammer=TRUE" in q)
+    assert both == (1, 10, True)
+    ensure = next(p for q, p in log if "join_date=join_date" in q)
+    assert ensure == (4, 10)
+    assert len(queue) == 0
+
+
+def test_pending_state_is_visible_to_readers(queue, monkeypatch):
+    def no_db():
+        raise AssertionError("fully known pending entry must not hit the DB")
+    monkeypatch.setattr(database, 'get_db_connection', no_db)
+    mark_seen_in_group(5, 20)
+    mark_spammer_in_group(5, 20)
+    assert get_user_entry(5, 20) == (True, True)
+    assert user_is_spammer_in_group(5, 20) is True
+    assert 5 in database.spammers_cache and 5 in database.seen_users_cache
+
+
+def test_failed_flush_keeps_rows_queued(queue, monkeypatch):
+    log, commits = [], []
+    monkeypatch.setattr(database, 'get_db_connection', lambda: RecordingConn(log, commits, fail=True))
+    mark_seen_in_group(6, 30)
+    with pytest.raises(mysql.connector.Error):
+        queue.flush()
+    assert queue.pending_entry(6, 30).seen is True and queue.stats["flush_errors"] == 1
+    monkeypatch.setattr(database, 'get_db_connection', lambda: RecordingConn(log, commits))
+    assert queue.flush() == 1 and len(log) == 1
+
+
+class InsertFailingCursor(RecordingCursor):
+    """Сброс очереди (INSERT) падает, прочие запросы проходят."""
+    def execute(self, q, params=None):
+        self.log.append(" ".join(q.split()))
+        if q.lstrip().startswith("INSERT"):
+            raise mysql.connector.errors.OperationalError("db down")
+    def fetchall(self):
+        return []
+
+
+def test_failed_flush_aborts_spammer_clear(queue, monkeypatch):
+    log = []
+    conn = RecordingConn(log, [])
+    conn.cursor = lambda: InsertFailingCursor(log, False)
+    monkeypatch.setattr(database, 'get_db_connection', lambda: conn)
+    mark_spammer_in_group(7, 40)
+    # Иначе UPDATE снял бы флаг, а следующий успешный flush вернул бы spammer=TRUE
+    assert clear_spammer_flag_in_group(7, 40) is False
+    with pytest.raises(mysql.connector.Error):
+        clear_spammer_everywhere(7)
+    assert not any(q.startswith("UPDATE") for q in log)
+    assert queue.pending_entry(7, 40).spammer is True
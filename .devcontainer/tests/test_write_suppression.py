@@ -0,0 +1,78 @@
+import pytest
+
+from app import database
+# Ссылки берём при импорте: другие тесты подменяют атрибуты модуля database без восстановления
+from app.database import (
+    AsyncUserStateRepository, UserStateRepository, mark_seen_in_group, mark_spammer_in_group, mark_unseen_in_group,
+)
+from app.storage import MemoryStorage, set_storage
+from test_write_behind import queue  # noqa: F401  (фикстура запущенной очереди)
+
+
+class CountingStorage(MemoryStorage):
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def upsert_entries(self, rows):
+        self.writes.extend(rows)
+        super().upsert_entries(rows)
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    monkeypatch.setattr(database, 'write_behind', database.WriteBehindQueue(batch_size=100, flush_interval=60))
+    for fn in (mark_seen_in_group, mark_spammer_in_group, mark_unseen_in_group):
+        monkeypatch.setattr(database, fn.__name__, fn)
+    backend = CountingStorage()
+    previous = set_storage(backend)
+    yield backend
+    set_storage(previous)
+
+
+def test_known_state_skips_db_write(storage):
+    repo = UserStateRepository(suppress_writes=True)
+    assert repo.mark_unseen(1, 10)
+    assert repo.entry(1, 10) == (False, False)  # прогрев entry-кэша
+    assert repo.mark_unseen(1, 10)  # повторный join
+    assert repo.mark_seen(1, 10) and repo.mark_seen(1, 10)
+    assert repo.mark_spammer(1, 10) and repo.mark_spammer(1, 10)
+    assert storage.writes == [(1, 10, False, False), (1, 10, True, False), (1, 10, None, True)]
+    stats = repo.get_write_stats()
+    assert stats["unseen"] == {"executed": 1, "suppressed": 1}
+    assert stats["seen"] == {"executed": 1, "suppressed": 1}
+    assert stats["spammer"] == {"executed": 1, "suppressed": 1}
+    assert stats["total"]["suppressed_rate"] == 0.5
+    # Глобальные кэши обновляются и при подавленной записи
+    assert 1 in database.spammers_cache and 1 not in database.suspicious_users_cache
+
+
+def test_state_change_and_unknown_rows_are_written(storage):
+    repo = UserStateRepository(suppress_writes=True)
+    repo.mark_seen(2, 10)
+    assert repo.mark_unseen(2, 10)  # seen -> unseen меняет строку
+    assert storage.get_entry(2, 10) == (False, False)
+    database.user_entry_cache.clear()
+    repo.mark_unseen(2, 10)  # состояние неизвестно без БД — пишем
+    assert len(storage.writes) == 3
+    assert not UserStateRepository(suppress_writes=False).write_is_redundant(2, 10, seen=False)
+
+
+def test_pending_write_behind_counts_as_known(queue):
+    queue.enqueue(3, 10, spammer=True)
+    assert database.entry_already_in_state(3, 10, spammer=True)
+    assert not database.entry_already_in_state(3, 10, seen=True)
+
+
+@pytest.mark.asyncio
+async def test_async_repo_suppresses_inline(storage, monkeypatch):
+    repo = UserStateRepository(suppress_writes=True)
+    arepo = AsyncUserStateRepository(repo)
+    assert await arepo.entry(4, 10) is None  # прогрев entry-кэша, как в хендлерах
+    await arepo.mark_seen(4, 10)
+
+    async def no_executor(*args, **kwargs):
+        raise AssertionError("redundant write must not go to the DB executor")
+    monkeypatch.setattr(database, 'run_db', no_executor)
+    assert await arepo.mark_seen(4, 10) is True
+    assert repo.write_stats["seen"] == {"executed": 1, "suppressed": 1}
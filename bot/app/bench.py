@@ -0,0 +1,205 @@
+"""Микробенчмарки для структур данных бота.
+
+Запуск (из каталога bot/):
+    python -m app.bench user-sets --size 1000000 --lookups 200000
+    python -m app.bench storage --ops 20000            # memory и sqlite
+    python -m app.bench storage --backends memory,sqlite,mysql   # mysql пишет в DB_CONFIG: только тестовая БД!
+    python -m app.bench classifier --model /data/classifier.npz  # история — из настроенного хранилища
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Sequence
+
+from .caches import new_user_id_set
+
+# Telegram user_id сейчас укладываются примерно в 1..8e9
+_USER_ID_MAX = 8_000_000_000
+
+
+def _measure_build(factory: Callable[[], object]) -> tuple:
+    tracemalloc.start()
+    started = time.perf_counter()
+    obj = factory()
+    elapsed = time.perf_counter() - started
+    current, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, current, elapsed
+
+
+def _lookup_ns(container, probes: List[int]) -> float:
+    started = time.perf_counter()
+    for value in probes:
+        value in container
+    return (time.perf_counter() - started) / len(probes) * 1e9
+
+
+def bench_user_sets(size: int, lookups: int, seed: int = 1) -> List[Dict[str, object]]:
+    """Память и скорость membership для backend'ов множеств user_id."""
+    rng = random.Random(seed)
+    ids = [rng.randrange(1, _USER_ID_MAX) for _ in range(size)]
+    hits = [rng.choice(ids) for _ in range(lookups)]
+    misses = [rng.randrange(1, _USER_ID_MAX) for _ in range(lookups)]
+    churn = [rng.randrange(1, _USER_ID_MAX) for _ in range(min(lookups, 50_000))]
+    results = []
+    for backend in ("set", "compact"):
+        # v + 0 создаёт новые объекты int, как при чтении строк из БД
+        container, mem, build_s = _measure_build(lambda: new_user_id_set(backend, (v + 0 for v in ids)))
+        started = time.perf_counter()
+        for value in churn:
+            container.add(value)
+        add_ns = (time.perf_counter() - started) / len(churn) * 1e9
+        results.append({
+            "backend": backend,
+            "size": len(container),
+            "bytes_per_id": round(mem / max(1, size), 1),
+            "build_s": round(build_s, 3),
+            "hit_ns": round(_lookup_ns(container, hits), 1),
+            "miss_ns": round(_lookup_ns(container, misses), 1),
+            "add_ns": round(add_ns, 1),
+        })
+    return results
+
+
+# Группы бенчмарка хранилища: отдельный диапазон id, не пересекается с настоящими чатами
+_BENCH_GROUP_BASE = -990_000_000_000
+
+
+def _latency_row(backend: str, op: str, samples: List[float], items: int) -> Dict[str, object]:
+    samples.sort()
+    total = sum(samples)
+    return {
+        "backend": backend,
+        "op": op,
+        "mean_us": round(total / len(samples) * 1e6, 1),
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 1),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6, 1),
+        "ops_per_s": round(items / total) if total > 0 else 0,
+    }
+
+
+def _timed(fn: Callable, calls: Sequence[tuple]) -> List[float]:
+    samples = []
+    for args in calls:
+        started = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_storage(backends: Sequence[str], ops: int, users: int = 10_000, groups: int = 50, batch: int = 500,
+                  seed: int = 1, sqlite_path: Optional[str] = None) -> List[Dict[str, object]]:
+    """Задержка и пропускная способность операций StorageBackend на одной и той же нагрузке.
+    ops_per_s у batch_upsert — строки в секунду (батч по batch строк одной транзакцией)."""
+    from .storage import DB_ERRORS, create_storage
+
+    rng = random.Random(seed)
+    user_ids = [rng.randrange(1, _USER_ID_MAX) for _ in range(users)]
+    group_ids = [_BENCH_GROUP_BASE - i for i in range(groups)]
+
+    def pair():
+        return rng.choice(user_ids), rng.choice(group_ids)
+
+    # Одна и та же последовательность операций для каждого backend'а
+    writes = []
+    for _ in range(ops):
+        user_id, group_id = pair()
+        roll = rng.random()
+        writes.append((user_id, group_id, None if roll < 0.3 else roll < 0.9, roll > 0.95))
+    batches = [[(*pair(), rng.random() < 0.5, rng.random() < 0.05) for _ in range(batch)]
+               for _ in range(max(1, ops // batch))]
+    lookups = [pair() for _ in range(ops)]
+    single = [(user_id,) for user_id, _group_id in lookups]
+
+    results = []
+    tmpdir = None
+    for kind in backends:
+        path = sqlite_path
+        if kind == "sqlite" and path is None:
+            tmpdir = tmpdir or tempfile.mkdtemp(prefix="buzzbuster-bench-")
+            path = os.path.join(tmpdir, "bench.sqlite3")
+        storage = create_storage(kind, sqlite_path=path or "")
+        try:
+            storage.setup()
+            results.append(_latency_row(kind, "upsert", _timed(storage.upsert_entry, writes), ops))
+            batch_samples = _timed(storage.upsert_entries, [(rows,) for rows in batches])
+            results.append(_latency_row(kind, "batch_upsert", batch_samples, batch * len(batches)))
+            results.append(_latency_row(kind, "user_state", _timed(storage.user_state, lookups), ops))
+            results.append(_latency_row(kind, "get_entry", _timed(storage.get_entry, lookups), ops))
+            results.append(_latency_row(kind, "spammer_anywhere", _timed(storage.spammer_anywhere, single), ops))
+            results.append(_latency_row(kind, "groups_where_spammer", _timed(storage.groups_where_spammer, single), ops))
+        except DB_ERRORS as e:
+            results.append({"backend": kind, "op": "unavailable", "mean_us": str(e)[:40],
+                            "p50_us": "", "p99_us": "", "ops_per_s": ""})
+        finally:
+            storage.close()
+    if tmpdir is not None:
+        for name in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+    return results
+
+
+def bench_classifier(model_path: str, limit: int = 5000, storage=None) -> List[Dict[str, object]]:
+    """Задержка локального классификатора и согласие с вердиктами OpenAI (без поправок админа)
+    по последним limit сообщениям classification_history, в полосах уверенности из конфига."""
+    from .local_classifier import LocalClassifier, build_training_set, evaluate
+    from .database import get_storage
+
+    model = LocalClassifier.load(model_path)
+    storage = storage or get_storage()
+    # Только сырые вердикты OpenAI: сравниваем с LLM, а не с исправленными метками
+    llm_rows = [[row for row in chunk if row[5] == "llm"] for chunk in storage.scan_classifications(5000)]
+    samples = build_training_set(llm_rows)[-limit:]
+    if not samples:
+        return []
+    texts = [(text,) for text, _label, _scope in samples]
+    row = _latency_row("local", "score", _timed(model.score, texts), len(texts))
+    row.update(evaluate(model, samples))
+    return [row]
+
+
+def _print_rows(rows: List[Dict[str, object]]) -> None:
+    if not rows:
+        return
+    keys = list(rows[0].keys())
+    print("  ".join(f"{k:>12}" for k in keys))
+    for row in rows:
+        print("  ".join(f"{row[k]!s:>12}" for k in keys))
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.bench", description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_sets = sub.add_parser("user-sets", help="set vs CompactIntSet: память и скорость membership")
+    p_sets.add_argument("--size", type=int, default=1_000_000)
+    p_sets.add_argument("--lookups", type=int, default=200_000)
+    p_sets.add_argument("--seed", type=int, default=1)
+    p_storage = sub.add_parser("storage", help="mysql / sqlite / memory: задержка и пропускная способность операций")
+    p_storage.add_argument("--backends", default="memory,sqlite",
+                           help="через запятую; mysql пишет строки в базу из DB_CONFIG")
+    p_storage.add_argument("--ops", type=int, default=20_000)
+    p_storage.add_argument("--users", type=int, default=10_000)
+    p_storage.add_argument("--groups", type=int, default=50)
+    p_storage.add_argument("--batch", type=int, default=500)
+    p_storage.add_argument("--sqlite-path", default=None, help="по умолчанию — временный файл")
+    p_storage.add_argument("--seed", type=int, default=1)
+    p_clf = sub.add_parser("classifier", help="локальный классификатор: задержка и согласие с OpenAI")
+    p_clf.add_argument("--model", required=True, help="файл модели (.npz)")
+    p_clf.add_argument("--limit", type=int, default=5000)
+    args = parser.parse_args(argv)
+    if args.command == "user-sets":
+        _print_rows(bench_user_sets(args.size, args.lookups, args.seed))
+    elif args.command == "storage":
+        backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+        _print_rows(bench_storage(backends, args.ops, args.users, args.groups, args.batch, args.seed, args.sqlite_path))
+    elif args.command == "classifier":
+        _print_rows(bench_classifier(args.model, args.limit))
+
+
+if __name__ == "__main__":
+    main()
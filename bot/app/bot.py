@@ -18,14 +18,25 @@ except ImportError:
     SENTRYSdkAvailable = False
 from app.telegram_messages import handle_message
 from .telegram_groupmembership import handle_my_chat_members, handle_other_chat_members
-from .telegram_commands import help_command, start_command, test_sentry_command, user_command, unban_command, ban_command, diag_command
+from .telegram_commands import help_command, start_command, test_sentry_command, user_command, unban_command, ban_command, diag_command, reload_group_command
 from .logging_setup import logger, with_update_id
 from .formatting import display_chat, display_user
 from .database import (
     check_and_create_tables,
-    load_configured_groups,
-    load_user_caches,
+    close_db_pool,
+    get_db_pool_stats,
+    shutdown_db_executor,
+    start_negative_bloom_rebuild,
+    start_write_behind,
+    stop_write_behind,
 )
+from .snapshot import load_caches, start_snapshot_writer, stop_snapshot_writer
+from .cache_refresh import start_cache_refresher, stop_cache_refresher
+from .cache_bus import start_cache_bus, stop_cache_bus
+from .group_migration import start_group_migrator, stop_group_migrator
+from .settings_reload import start_settings_watcher, stop_settings_watcher
+from .antispam import close_openai_client, load_verdict_cache
+from .local_classifier import load_local_classifier, prune_classification_history
 from telegram import (
     Update,
 )
@@ -103,9 +114,27 @@ async def main():
     # Проверка и создание таблиц
     try:
         check_and_create_tables()
-        # Загрузка настроенных групп и кешей пользователей
-        load_configured_groups()
-        load_user_caches()
+        # Загрузка настроенных групп и кешей пользователей (снимок + догрузка или полная загрузка)
+        source = load_caches()
+        logger.debug(f"Caches loaded ({source}).")
+        logger.debug(f"Classification verdict cache: {load_verdict_cache()} verdicts restored.")
+        if load_local_classifier():
+            logger.debug("Local spam classifier enabled.")
+        if prune_classification_history():
+            logger.debug("Classification history pruned to the retention window.")
+        start_negative_bloom_rebuild()
+        if start_write_behind():
+            logger.debug("Write-behind queue for user_entries started.")
+        if start_snapshot_writer():
+            logger.debug("Periodic cache snapshot writer started.")
+        if start_cache_refresher():
+            logger.debug("Incremental cache refresh started.")
+        if start_cache_bus():
+            logger.debug("Cache invalidation bus started.")
+        if start_group_migrator():
+            logger.debug("Group migration worker started.")
+        if start_settings_watcher():
+            logger.debug("Group settings hot reload started.")
     except Exception as e:
         logger.exception("Failed to initialize database or load caches")
         capture_exception_with_context(e, {"component": "database_initialization"})
@@ -138,6 +167,7 @@ async def main():
     application.add_handler(CommandHandler("unban", unban_command), group=1)
     application.add_handler(CommandHandler("ban", ban_command), group=1)
     application.add_handler(CommandHandler("diag", diag_command), group=1)
+    application.add_handler(CommandHandler("reload_group", reload_group_command), group=1)
 
     # Регистрация обработчиков сообщений
     application.add_handler(
@@ -213,6 +243,19 @@ async def main():
             await application.updater.stop()  # type: ignore[attr-defined]
             await application.stop()
             await application.shutdown()
+            await close_openai_client()
+            logger.debug(f"DB pool stats at shutdown: {get_db_pool_stats()}")
+            shutdown_db_executor()
+            stop_cache_refresher()
+            stop_settings_watcher()
+            # Прерванный перенос группы продолжится при следующем старте
+            stop_group_migrator()
+            # До остановки write-behind: stop() публикует хвост событий после сброса очереди
+            stop_cache_bus()
+            flushed = stop_write_behind()
+            logger.debug(f"Write-behind queue flushed on shutdown ({flushed} rows).")
+            stop_snapshot_writer()
+            close_db_pool()
             logger.info("Bot stopped.")
     except Exception as e:
         logger.exception("Unexpected error during bot operation")
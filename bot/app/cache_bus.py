@@ -0,0 +1,486 @@
+"""Шина инвалидации кэшей между несколькими воркерами бота.
+
+Каждая мутация состояния пользователя (spammer / seen / unseen / снятие бана) и изменение
+конфигурации группы публикуется в шину (database.publish_cache_event); фоновый поток
+пачкой отправляет исходящие события и применяет входящие от других воркеров к локальным
+кэшам. Свои события (origin == WORKER_ID) пропускаются — они уже применены локально.
+
+Реализации:
+  MySQLCacheBus — таблица-журнал cache_events, опрос по id с перечитыванием последних
+    replay_window id (строки с меньшим id могут закоммититься позже);
+  RedisCacheBus — Redis Stream (XADD / XREAD); клиент redis-py или LocalStreamClient
+    (стенд-ин в памяти для тестов и одного процесса).
+События теряются только при переполнении outbox (долгая недоступность шины) или если
+строка MySQL-журнала стала видимой позже, чем через replay_window новых id. Изменения
+user_entries в этом случае догонит фоновая сверка по updated_at (cache_refresh);
+конфигурацию групп — только перезапуск или следующее событие group.
+"""
+
+import os
+import socket
+import threading
+import time
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import mysql.connector
+
+from . import database
+from .config import (
+    CACHE_BUS_BACKEND,
+    CACHE_BUS_BATCH_SIZE,
+    CACHE_BUS_POLL_INTERVAL_MS,
+    CACHE_BUS_REDIS_STREAM,
+    CACHE_BUS_REDIS_URL,
+    CACHE_BUS_REPLAY_WINDOW,
+    CACHE_BUS_RETENTION_SECONDS,
+    WORKER_ID,
+)
+from .logging_setup import logger
+
+USER_EVENT_KINDS = ("spammer", "seen", "unseen", "clear_spammer", "unban")
+GROUP_EVENT_KINDS = ("group", "group_migrated")
+OUTBOX_LIMIT = 100000
+
+
+class CacheEvent(NamedTuple):
+    """kind — см. USER_EVENT_KINDS / GROUP_EVENT_KINDS.
+    value: clear_spammer — остался ли пользователь спамером где-то ещё (1/0);
+    group_migrated — новый group_id; unban (без group_id) — глобальный разбан пользователя."""
+    kind: str
+    user_id: Optional[int] = None
+    group_id: Optional[int] = None
+    value: Optional[int] = None
+    origin: str = ""
+
+
+def default_worker_id() -> str:
+    return WORKER_ID or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def apply_user_event(event: CacheEvent) -> None:
+    """Применяет чужую мутацию пользователя к локальным кэшам. Запись entry-кэша
+    сбрасывается: полное состояние строки событие не несёт."""
+    uid, gid = event.user_id, event.group_id
+    if uid is None:
+        return
+    if gid is not None:
+        database.user_entry_cache.invalidate((uid, gid))
+    if event.kind == "spammer":
+        if gid is not None:
+            database.spam_groups_index.add(uid, gid)
+        database.spammers_cache.add(uid)
+        database.not_spammers_cache.discard(uid)
+        database.suspicious_users_cache.discard(uid)
+    elif event.kind == "seen":
+        database.seen_users_cache.add(uid)
+        database.not_seen_cache.discard(uid)
+        database.suspicious_users_cache.discard(uid)
+    elif event.kind == "unseen":
+        if uid not in database.spammers_cache:
+            database.suspicious_users_cache.add(uid)
+    elif event.kind == "clear_spammer":
+        if gid is not None:
+            database.spam_groups_index.discard(uid, gid)
+        if not event.value:
+            database.spammers_cache.discard(uid)
+            database.not_spammers_cache.add(uid)
+    elif event.kind == "unban":
+        database.user_entry_cache.invalidate_where(lambda key: key[0] == uid)
+        database.spam_groups_index.discard_user(uid)
+        database.spammers_cache.discard(uid)
+        database.not_spammers_cache.add(uid)
+        database.seen_users_cache.add(uid)
+        database.not_seen_cache.discard(uid)
+        database.suspicious_users_cache.discard(uid)
+
+
+def apply_events(events: List[CacheEvent]) -> int:
+    """Применяет пачку событий; конфигурация групп перечитывается один раз на пачку."""
+    groups_changed = False
+    for event in events:
+        if event.kind in USER_EVENT_KINDS:
+            apply_user_event(event)
+        elif event.kind in GROUP_EVENT_KINDS:
+            groups_changed = True
+            if event.group_id is not None:
+                database.invalidate_group_entries(event.group_id)
+            if event.kind == "group_migrated" and event.value is not None:
+                if event.group_id is not None:
+                    database.add_group_redirect(event.group_id, event.value)
+                database.invalidate_group_entries(event.value)
+        else:
+            logger.warning(f"Unknown cache bus event kind {event.kind!r}; ignored.")
+    if groups_changed:
+        database.reload_configured_groups()
+    return len(events)
+
+
+class CacheBus:
+    """Общая часть реализаций: буфер исходящих событий и поток отправки/опроса.
+    Наследники реализуют prepare() (встать в конец журнала), _send() и _receive()."""
+
+    name = "base"
+
+    def __init__(self, origin: Optional[str] = None, interval: float = 0.5, batch_size: int = 500):
+        self.origin = origin or default_worker_id()
+        self.interval = interval
+        self.batch_size = max(1, int(batch_size))
+        self._outbox: deque = deque()
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"published": 0, "sent": 0, "received": 0, "applied": 0, "dropped": 0, "errors": 0}
+
+    def publish(self, kind: str, user_id: Optional[int] = None, group_id: Optional[int] = None,
+                value: Optional[int] = None) -> None:
+        """Не блокирует: событие уйдёт в следующем цикле потока (или при stop())."""
+        if len(self._outbox) >= OUTBOX_LIMIT:
+            # Шина недоступна долго: старые события теряем, их догонит сверка по updated_at
+            self._outbox.popleft()
+            self.stats["dropped"] += 1
+        self._outbox.append(CacheEvent(kind, user_id, group_id, value, self.origin))
+        self.stats["published"] += 1
+
+    def prepare(self) -> None:
+        raise NotImplementedError
+
+    def _send(self, events: List[CacheEvent]) -> None:
+        raise NotImplementedError
+
+    def _receive(self, limit: int) -> List[CacheEvent]:
+        raise NotImplementedError
+
+    def _maintain(self) -> None:
+        """Периодическое обслуживание журнала (очистка); по умолчанию ничего."""
+
+    def flush_outbox(self) -> int:
+        batch: List[CacheEvent] = []
+        while self._outbox:
+            batch.append(self._outbox.popleft())
+        if not batch:
+            return 0
+        sent = 0
+        try:
+            # Строки из write-behind должны попасть в БД раньше, чем другие воркеры
+            # увидят событие и, возможно, перечитают запись
+            database.flush_pending_writes()
+            while sent < len(batch):
+                chunk = batch[sent:sent + self.batch_size]
+                self._send(chunk)
+                sent += len(chunk)
+        except Exception:
+            # Неотправленный остаток — обратно в начало очереди
+            self._outbox.extendleft(reversed(batch[sent:]))
+            raise
+        finally:
+            self.stats["sent"] += sent
+        return sent
+
+    def run_once(self) -> int:
+        """Отправляет исходящие и применяет входящие чужие события; возвращает число применённых."""
+        with self._run_lock:
+            self.flush_outbox()
+            applied = 0
+            while True:
+                events = self._receive(self.batch_size)
+                self.stats["received"] += len(events)
+                foreign = [e for e in events if e.origin != self.origin]
+                if foreign:
+                    applied += apply_events(foreign)
+                if len(events) < self.batch_size:
+                    break
+            self._maintain()
+            self.stats["applied"] += applied
+            return applied
+
+    # ----- фоновый поток -----
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-bus", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        try:
+            self.flush_outbox()
+        except Exception as e:
+            logger.warning(f"Cache bus: {len(self._outbox)} events not published on shutdown: {e}")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                applied = self.run_once()
+                if applied:
+                    logger.debug(f"Cache bus applied {applied} events from other workers.")
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Cache bus cycle failed ({self.name}): {e}")
+
+    def snapshot_stats(self) -> dict:
+        data = dict(self.stats)
+        data["backend"] = self.name
+        data["origin"] = self.origin
+        data["active"] = self.active
+        data["outbox"] = len(self._outbox)
+        return data
+
+
+class MySQLCacheBus(CacheBus):
+    """Журнал событий в таблице cache_events (создаётся миграцией m004).
+    Строки старше retention удаляются не чаще раза в минуту.
+
+    InnoDB выдаёт auto-increment id при вставке, а не при коммите: строка конкурирующего
+    воркера с id меньше last_id может стать видимой уже после опроса. Поэтому каждый опрос
+    перечитывает последние replay_window id, а применённые id этого окна помнятся в _seen
+    и повторно не применяются."""
+
+    name = "mysql"
+
+    def __init__(self, origin: Optional[str] = None, interval: float = 0.5, batch_size: int = 500,
+                 retention: float = 3600.0, replay_window: int = 1000):
+        super().__init__(origin, interval, batch_size)
+        self.retention = retention
+        self.replay_window = max(0, int(replay_window))
+        self.last_id = 0
+        self._seen: Set[int] = set()
+        self._next_purge = 0.0
+        self.stats["late"] = 0
+
+    def prepare(self) -> None:
+        conn = database.get_db_connection()
+        cur = conn.cursor()
+        try:
+            # Состояние до старта уже загружено из БД: читаем только новые события,
+            # уже видимые строки окна перечитывания тоже считаются применёнными
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM cache_events")
+            row = cur.fetchone()
+            self.last_id = int(row[0]) if row else 0
+            cur.execute("SELECT id FROM cache_events WHERE id > %s", (self._window_start(),))
+            self._seen = {int(r[0]) for r in cur.fetchall()}
+        finally:
+            cur.close()
+            conn.close()
+
+    def _send(self, events: List[CacheEvent]) -> None:
+        conn = database.get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.executemany(
+                "INSERT INTO cache_events (origin, kind, user_id, group_id, value) VALUES (%s, %s, %s, %s, %s)",
+                [(e.origin, e.kind, e.user_id, e.group_id, e.value) for e in events],
+            )
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+    def _window_start(self) -> int:
+        return max(0, self.last_id - self.replay_window)
+
+    def _receive(self, limit: int) -> List[CacheEvent]:
+        conn = database.get_db_connection()
+        cur = conn.cursor()
+        try:
+            # Уже применённые строки окна тоже вернутся — лимит увеличен на их число
+            cur.execute(
+                "SELECT id, origin, kind, user_id, group_id, value FROM cache_events "
+                "WHERE id > %s ORDER BY id LIMIT %s",
+                (self._window_start(), limit + len(self._seen)),
+            )
+            rows = [row for row in cur.fetchall() if int(row[0]) not in self._seen][:limit]
+        finally:
+            cur.close()
+            conn.close()
+        for row in rows:
+            event_id = int(row[0])
+            if event_id < self.last_id:
+                self.stats["late"] += 1
+            self._seen.add(event_id)
+        if rows:
+            self.last_id = max(self.last_id, int(rows[-1][0]))
+            start = self._window_start()
+            self._seen = {i for i in self._seen if i > start}
+        return [
+            CacheEvent(kind, _opt_int(uid), _opt_int(gid), _opt_int(value), origin)
+            for _id, origin, kind, uid, gid, value in rows
+        ]
+
+    def _maintain(self) -> None:
+        now = time.monotonic()
+        if self.retention <= 0 or now < self._next_purge:
+            return
+        self._next_purge = now + 60
+        conn = database.get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "DELETE FROM cache_events WHERE created_at < NOW(6) - INTERVAL %s SECOND LIMIT 10000",
+                (int(self.retention),),
+            )
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+
+class LocalStreamClient:
+    """Подмножество Redis Streams (xadd / xread / xrevrange) в памяти процесса.
+    Несколько RedisCacheBus с одним клиентом ведут себя как воркеры с общим Redis."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams: Dict[str, List[Tuple[str, dict]]] = {}
+        self._seq = 0
+
+    def xadd(self, name, fields, maxlen=None, approximate=True):
+        with self._lock:
+            self._seq += 1
+            entry_id = f"{self._seq}-0"
+            stream = self._streams.setdefault(name, [])
+            stream.append((entry_id, dict(fields)))
+            if maxlen is not None and len(stream) > maxlen:
+                del stream[:len(stream) - maxlen]
+            return entry_id
+
+    def xread(self, streams, count=None, block=None):
+        result = []
+        with self._lock:
+            for name, after in streams.items():
+                after_seq = _stream_seq(after)
+                entries = [e for e in self._streams.get(name, []) if _stream_seq(e[0]) > after_seq]
+                if count is not None:
+                    entries = entries[:count]
+                if entries:
+                    result.append((name, entries))
+        return result
+
+    def xrevrange(self, name, max="+", min="-", count=None):
+        with self._lock:
+            entries = list(reversed(self._streams.get(name, [])))
+        return entries[:count] if count is not None else entries
+
+
+class RedisCacheBus(CacheBus):
+    """События в Redis Stream; длина потока ограничивается MAXLEN ~ maxlen."""
+
+    name = "redis"
+
+    def __init__(self, client, stream: str = "buzzbuster:cache_events", origin: Optional[str] = None,
+                 interval: float = 0.5, batch_size: int = 500, maxlen: int = 100000):
+        super().__init__(origin, interval, batch_size)
+        self.client = client
+        self.stream = stream
+        self.maxlen = maxlen
+        self.last_id = "0-0"
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisCacheBus":
+        try:
+            import redis  # type: ignore
+        except ImportError:
+            raise RuntimeError("CACHE_BUS_BACKEND=redis requires the 'redis' package")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def prepare(self) -> None:
+        last = self.client.xrevrange(self.stream, count=1)
+        self.last_id = _decode(last[0][0]) if last else "0-0"
+
+    def _send(self, events: List[CacheEvent]) -> None:
+        pipe = self.client.pipeline(transaction=False) if hasattr(self.client, "pipeline") else self.client
+        for e in events:
+            fields = {"origin": e.origin, "kind": e.kind}
+            for key in ("user_id", "group_id", "value"):
+                if getattr(e, key) is not None:
+                    fields[key] = str(getattr(e, key))
+            pipe.xadd(self.stream, fields, maxlen=self.maxlen, approximate=True)
+        if pipe is not self.client:
+            pipe.execute()
+
+    def _receive(self, limit: int) -> List[CacheEvent]:
+        response = self.client.xread({self.stream: self.last_id}, count=limit)
+        events: List[CacheEvent] = []
+        for _name, entries in response or []:
+            for entry_id, raw in entries:
+                self.last_id = _decode(entry_id)
+                fields = {_decode(k): _decode(v) for k, v in raw.items()}
+                events.append(CacheEvent(
+                    fields.get("kind", ""),
+                    _opt_int(fields.get("user_id")),
+                    _opt_int(fields.get("group_id")),
+                    _opt_int(fields.get("value")),
+                    fields.get("origin", ""),
+                ))
+        return events
+
+
+def _decode(value) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else str(value)
+
+
+def _opt_int(value) -> Optional[int]:
+    return None if value is None or value == "" else int(value)
+
+
+def _stream_seq(entry_id: str) -> Tuple[int, int]:
+    ms, _, seq = str(entry_id).partition("-")
+    return int(ms), int(seq or 0)
+
+
+# ===== Экземпляр процесса =====
+
+cache_bus: Optional[CacheBus] = None
+
+
+def create_cache_bus(backend: Optional[str] = None) -> Optional[CacheBus]:
+    backend = (backend or CACHE_BUS_BACKEND or "none").strip().lower()
+    interval = CACHE_BUS_POLL_INTERVAL_MS / 1000.0
+    if backend in ("", "none", "off"):
+        return None
+    if backend == "mysql":
+        return MySQLCacheBus(interval=interval, batch_size=CACHE_BUS_BATCH_SIZE, retention=CACHE_BUS_RETENTION_SECONDS,
+                             replay_window=CACHE_BUS_REPLAY_WINDOW)
+    if backend == "redis":
+        return RedisCacheBus.from_url(
+            CACHE_BUS_REDIS_URL, stream=CACHE_BUS_REDIS_STREAM, interval=interval, batch_size=CACHE_BUS_BATCH_SIZE,
+        )
+    raise ValueError(f"Unknown CACHE_BUS_BACKEND {backend!r} (expected none, mysql or redis)")
+
+
+def start_cache_bus(bus: Optional[CacheBus] = None) -> bool:
+    """Подключает шину к мутациям database.py и запускает поток. False — шина отключена."""
+    global cache_bus
+    bus = bus or create_cache_bus()
+    if bus is None:
+        return False
+    bus.prepare()
+    cache_bus = bus
+    database.set_cache_event_publisher(bus.publish)
+    bus.start()
+    logger.info(f"Cache bus started ({bus.name}, worker {bus.origin}).")
+    return True
+
+
+def stop_cache_bus() -> None:
+    global cache_bus
+    bus, cache_bus = cache_bus, None
+    if bus is None:
+        return
+    database.set_cache_event_publisher(None)
+    bus.stop()
+
+
+def get_cache_bus_stats() -> dict:
+    if cache_bus is None:
+        return {"backend": "none", "active": False}
+    return cache_bus.snapshot_stats()
@@ -0,0 +1,165 @@
+"""Инкрементальная сверка пользовательских кэшей с user_entries по updated_at.
+
+Фоновый поток раз в CACHE_REFRESH_INTERVAL_SECONDS выбирает строки, изменённые после
+водяной отметки (keyset-пагинация по (updated_at, id), порциями CACHE_REFRESH_BATCH_SIZE),
+и для затронутых пользователей пересчитывает глобальные флаги одним агрегирующим
+запросом: позитивные и negative кэши приводятся к состоянию БД, записи entry-кэша
+сбрасываются, индекс групп спамеров правится по самим строкам. Отметка сдвигается назад на CACHE_REFRESH_LOOKBACK_SECONDS, чтобы не
+пропустить строки из транзакций, закоммиченных с более ранним updated_at.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+import mysql.connector
+
+from . import database
+from .config import CACHE_REFRESH_BATCH_SIZE, CACHE_REFRESH_INTERVAL_SECONDS, CACHE_REFRESH_LOOKBACK_SECONDS
+from .logging_setup import logger
+
+
+def _apply_flags(user_id: int, spammer: bool, seen: bool, suspicious: bool, keep_local: bool) -> None:
+    """Приводит глобальные кэши пользователя к агрегату из БД.
+    keep_local: пользователя только что изменил сам бот — флаги только добавляем."""
+    if spammer:
+        database.spammers_cache.add(user_id)
+        database.not_spammers_cache.discard(user_id)
+    elif not keep_local:
+        database.spammers_cache.discard(user_id)
+        database.not_spammers_cache.add(user_id)
+    if seen:
+        database.seen_users_cache.add(user_id)
+        database.not_seen_cache.discard(user_id)
+    elif not keep_local:
+        database.seen_users_cache.discard(user_id)
+        database.not_seen_cache.add(user_id)
+    if suspicious:
+        database.suspicious_users_cache.add(user_id)
+    elif not keep_local:
+        database.suspicious_users_cache.discard(user_id)
+
+
+class CacheRefresher:
+    """Водяная отметка + цикл сверки. run_once() можно вызывать и синхронно (догрузка при старте)."""
+
+    def __init__(self, interval: float, batch_size: int, lookback: float):
+        self.interval = interval
+        self.batch_size = max(1, int(batch_size))
+        self.lookback = timedelta(seconds=max(0.0, lookback))
+        self.watermark: Optional[datetime] = None
+        self._watermark_id = 0  # id последней применённой строки с updated_at == watermark
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"cycles": 0, "rows": 0, "users": 0, "errors": 0, "last_cycle_seconds": 0.0}
+
+    def set_watermark(self, value: Optional[datetime]) -> None:
+        self.watermark = value
+        self._watermark_id = 0
+
+    def run_once(self) -> int:
+        """Применяет все изменения после отметки; возвращает число прочитанных строк.
+        Ошибки БД пробрасываются (отметка остаётся на последней полностью применённой порции)."""
+        with self._run_lock:
+            started = time.monotonic()
+            if self.watermark is None:
+                # Пустая таблица на момент загрузки: читаем всё
+                cursor: Tuple[datetime, int] = (datetime(1970, 1, 2), 0)
+            elif self.lookback:
+                cursor = (self.watermark - self.lookback, 0)
+            else:
+                cursor = (self.watermark, self._watermark_id)
+            total = 0
+            while True:
+                token = database.local_write_token()
+                rows = database.fetch_user_entry_changes(cursor, self.batch_size)
+                if not rows:
+                    break
+                self._apply_batch(rows, token)
+                total += len(rows)
+                last = rows[-1]
+                cursor = (last[5], int(last[0]))
+                if self.watermark is None or cursor >= (self.watermark, self._watermark_id):
+                    self.watermark, self._watermark_id = cursor
+                if len(rows) < self.batch_size:
+                    break
+            # Фильтры Блума пополняются новыми позитивными id; переполненный перестраиваем
+            database.rebuild_negative_blooms(only_saturated=True)
+            self.stats["cycles"] += 1
+            self.stats["rows"] += total
+            self.stats["last_cycle_seconds"] = round(time.monotonic() - started, 4)
+            return total
+
+    def _apply_batch(self, rows: list, token: int) -> None:
+        user_ids = sorted({int(r[1]) for r in rows})
+        for _id, uid, gid, _seen, _spammer, _ts in rows:
+            database.user_entry_cache.invalidate((int(uid), int(gid)))
+        flags = database.aggregate_user_flags(user_ids)
+        touched = database.users_written_since(token)
+        # Строка несёт своё текущее состояние: индекс групп спамеров правится по ней напрямую
+        for _id, uid, gid, _seen, spammer, _ts in rows:
+            if spammer:
+                database.spam_groups_index.add(int(uid), int(gid))
+            elif int(uid) not in touched:
+                database.spam_groups_index.discard(int(uid), int(gid))
+        for uid in user_ids:
+            spammer, seen, suspicious = flags.get(uid, (False, False, False))
+            _apply_flags(uid, spammer, seen, suspicious, keep_local=uid in touched)
+        self.stats["users"] += len(user_ids)
+
+    # ----- фоновый поток -----
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                applied = self.run_once()
+                if applied:
+                    logger.debug(f"Cache refresh applied {applied} changed user_entries rows (watermark={self.watermark}).")
+            except mysql.connector.Error as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Incremental cache refresh failed: {e}")
+
+    def snapshot_stats(self) -> dict:
+        data = dict(self.stats)
+        data["active"] = self.active
+        data["watermark"] = str(self.watermark) if self.watermark is not None else None
+        return data
+
+
+cache_refresher = CacheRefresher(CACHE_REFRESH_INTERVAL_SECONDS, CACHE_REFRESH_BATCH_SIZE, CACHE_REFRESH_LOOKBACK_SECONDS)
+
+
+def start_cache_refresher() -> bool:
+    # Сверка читает updated_at: SQLite / in-memory backend его не ведут (других писателей нет)
+    if CACHE_REFRESH_INTERVAL_SECONDS <= 0 or not database.get_storage().tracks_changes:
+        return False
+    cache_refresher.start()
+    return True
+
+
+def stop_cache_refresher() -> None:
+    cache_refresher.stop()
+
+
+def get_cache_refresh_stats() -> dict:
+    return cache_refresher.snapshot_stats()
@@ -0,0 +1,603 @@
+"""Структуры данных для in-memory кэшей пользовательского состояния."""
+
+import math
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+# Маркер промаха: None — валидное закэшированное значение («записи нет»)
+MISSING = object()
+
+
+def sort_int64_array(arr: array) -> array:
+    """Сортирует array('q') на месте (numpy поверх того же буфера): без промежуточного
+    списка int-объектов, который дал бы sorted() (~36-40 байт на элемент)."""
+    if len(arr) > 1:
+        np.frombuffer(arr, dtype=np.int64).sort()
+    return arr
+
+
+def sort_int64_pairs(arr: array) -> array:
+    """Сортирует плоские пары (a, b) в array('q') на месте по (a, b)."""
+    if len(arr) > 2:
+        pairs = np.frombuffer(arr, dtype=np.int64).reshape(-1, 2)
+        pairs[:] = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    return arr
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш с ограничением размера и TTL.
+
+    - max_size <= 0 отключает кэш (get всегда промах, put ничего не делает).
+    - ttl <= 0 — без истечения по времени.
+    - write_seq растёт при каждой записи/инвалидации; читатель берёт его до запроса
+      к БД и передаёт в fill(): если за время запроса кто-то писал, устаревший
+      результат в кэш не попадёт.
+    """
+
+    def __init__(self, max_size: int, ttl: float = 0.0, clock: Callable[[], float] = time.monotonic):
+        self.max_size = int(max_size)
+        self.ttl = float(ttl)
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.write_seq = 0
+        self.stats = {"hits": 0, "misses": 0, "fills": 0, "stale_fills": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _lookup(self, key: Hashable) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return MISSING
+        value, expires_at = item
+        if expires_at is not None and self._clock() >= expires_at:
+            del self._data[key]
+            self.stats["expirations"] += 1
+            return MISSING
+        return value
+
+    def get(self, key: Hashable) -> Any:
+        """Значение или MISSING; считает hit/miss и обновляет LRU-порядок."""
+        with self._lock:
+            value = self._lookup(key)
+            if value is MISSING:
+                self.stats["misses"] += 1
+            else:
+                self.stats["hits"] += 1
+                self._data.move_to_end(key)
+            return value
+
+    def peek(self, key: Hashable) -> Any:
+        """Как get(), но без статистики и без изменения LRU-порядка (для писателей)."""
+        with self._lock:
+            return self._lookup(key)
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        expires_at = self._clock() + self.ttl if self.ttl > 0 else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Запись авторитетного значения (после изменения данных)."""
+        with self._lock:
+            self.write_seq += 1
+            if self.enabled:
+                self._store(key, value)
+
+    def fill(self, key: Hashable, value: Any, seq: int) -> bool:
+        """Заполнение результатом чтения, начатого при write_seq == seq."""
+        with self._lock:
+            if not self.enabled:
+                return False
+            if self.write_seq != seq:
+                self.stats["stale_fills"] += 1
+                return False
+            self._store(key, value)
+            self.stats["fills"] += 1
+            return True
+
+    def update(self, key: Hashable, fn: Callable[[Any], Any]) -> None:
+        """Атомарно пересчитывает значение: fn(текущее или MISSING) -> новое или MISSING (удалить)."""
+        with self._lock:
+            self.write_seq += 1
+            if not self.enabled:
+                return
+            new_value = fn(self._lookup(key))
+            if new_value is MISSING:
+                self._data.pop(key, None)
+            else:
+                self._store(key, new_value)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self.write_seq += 1
+            if self._data.pop(key, MISSING) is not MISSING:
+                self.stats["invalidations"] += 1
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Удаляет все ключи, для которых predicate(key) истинно (линейный проход; для редких операций)."""
+        with self._lock:
+            self.write_seq += 1
+            doomed = [k for k in self._data if predicate(k)]
+            for k in doomed:
+                del self._data[k]
+            self.stats["invalidations"] += len(doomed)
+            return len(doomed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.write_seq += 1
+            self._data.clear()
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            data: Dict[str, Any] = dict(self.stats)
+            data["size"] = len(self._data)
+            data["max_size"] = self.max_size
+        lookups = data["hits"] + data["misses"]
+        data["hit_rate"] = round(data["hits"] / lookups, 4) if lookups else None
+        return data
+
+
+
+class CompactIntSet:
+    """Множество int64 с API set (in / add / discard / clear / len / iter).
+
+    Хранение — отсортированные блоки array('q') по ~block_size элементов плюс список
+    первых ключей блоков: 8 байт на элемент против ~60-70 у set[int] (объект int + слот).
+    Поиск — два бинарных поиска (по ключам блоков, затем внутри блока); вставка —
+    сдвиг внутри одного блока, переполненный блок делится пополам.
+    Чтения без блокировки: писатели (под _lock) не меняют массивы и список ключей на месте.
+    Изменённый блок — копия, подставляемая одной ссылкой в список блоков, если его первый
+    элемент не изменился; иначе (новый первый ключ, деление или удаление блока) заменяется
+    весь кортеж состояния. Читатель видит старый или новый блок, но не полуизменённый.
+    """
+
+    __slots__ = ("_state", "_len", "_lock", "block_size")
+
+    def __init__(self, items: Optional[Iterable[int]] = None, block_size: int = 512):
+        self.block_size = max(16, int(block_size))
+        self._lock = threading.Lock()
+        self._state = ([], [])  # (keys: первый элемент каждого блока, blocks: list[array('q')])
+        self._len = 0
+        if items is not None:
+            self.update(items)
+
+    def _locate(self, value: int):
+        keys, blocks = self._state
+        i = bisect_right(keys, value) - 1
+        if i < 0:
+            return keys, blocks, 0, None
+        return keys, blocks, i, blocks[i]
+
+    def __contains__(self, value: object) -> bool:
+        # Горячий путь: без вспомогательных вызовов
+        keys, blocks = self._state
+        try:
+            i = bisect_right(keys, value) - 1
+        except TypeError:
+            return False
+        if i < 0:
+            return False
+        block = blocks[i]
+        j = bisect_left(block, value)
+        return j < len(block) and block[j] == value
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[int]:
+        _keys, blocks = self._state
+        for block in list(blocks):
+            yield from array("q", block)
+
+    def __repr__(self) -> str:
+        return f"CompactIntSet(len={self._len})"
+
+    def add(self, value: int) -> None:
+        value = int(value)
+        with self._lock:
+            keys, blocks, i, block = self._locate(value)
+            if block is None:
+                if not blocks:
+                    self._state = ([value], [array("q", [value])])
+                    self._len += 1
+                    return
+                block = blocks[0]
+            j = bisect_left(block, value)
+            if j < len(block) and block[j] == value:
+                return
+            new_block = block[:j]
+            new_block.append(value)
+            new_block.extend(block[j:])
+            self._len += 1
+            if len(new_block) > 2 * self.block_size:
+                half = len(new_block) // 2
+                left, right = new_block[:half], new_block[half:]
+                self._state = (
+                    keys[:i] + [left[0], right[0]] + keys[i + 1:],
+                    blocks[:i] + [left, right] + blocks[i + 1:],
+                )
+            elif j == 0:
+                self._state = (keys[:i] + [value] + keys[i + 1:], blocks[:i] + [new_block] + blocks[i + 1:])
+            else:
+                blocks[i] = new_block
+
+    def discard(self, value: int) -> None:
+        if not isinstance(value, int):
+            return
+        with self._lock:
+            keys, blocks, i, block = self._locate(value)
+            if block is None:
+                return
+            j = bisect_left(block, value)
+            if j >= len(block) or block[j] != value:
+                return
+            self._len -= 1
+            if len(block) == 1:
+                self._state = (keys[:i] + keys[i + 1:], blocks[:i] + blocks[i + 1:])
+                return
+            new_block = block[:j]
+            new_block.extend(block[j + 1:])
+            if j == 0:
+                self._state = (keys[:i] + [new_block[0]] + keys[i + 1:], blocks[:i] + [new_block] + blocks[i + 1:])
+            else:
+                blocks[i] = new_block
+
+    def remove(self, value: int) -> None:
+        if value not in self:
+            raise KeyError(value)
+        self.discard(value)
+
+    def update(self, items: Iterable[int]) -> None:
+        if self._len:
+            for value in items:
+                self.add(value)
+            return
+        # Пустое множество: сортируем и режем на блоки за один проход
+        ordered = sort_int64_array(array("q", (int(v) for v in items)))
+        keys, blocks = [], []
+        block = array("q")
+        last = None
+        for value in ordered:
+            if value == last:
+                continue
+            last = value
+            if len(block) >= self.block_size:
+                keys.append(block[0])
+                blocks.append(block)
+                block = array("q")
+            block.append(value)
+        if block:
+            keys.append(block[0])
+            blocks.append(block)
+        with self._lock:
+            self._state = (keys, blocks)
+            self._len = sum(len(b) for b in blocks)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._state = ([], [])
+            self._len = 0
+
+    def memory_bytes(self) -> int:
+        """Оценка занимаемой памяти (блоки + индекс ключей)."""
+        keys, blocks = self._state
+        return (
+            sys.getsizeof(keys) + sys.getsizeof(blocks)
+            + sum(sys.getsizeof(b) for b in blocks) + 32 * len(keys)
+        )
+
+
+_MASK64 = (1 << 64) - 1
+
+
+class BloomFilter:
+    """Фильтр Блума для int64: ~9.6 бит на элемент при error_rate=0.01.
+    Позиции — двойное хеширование от splitmix64(value). Удаления не поддерживаются."""
+
+    __slots__ = ("capacity", "error_rate", "size_bits", "hashes", "count", "_bits")
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(1, int(capacity))
+        self.error_rate = min(max(float(error_rate), 1e-9), 0.5)
+        self.size_bits = max(64, math.ceil(-self.capacity * math.log(self.error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size_bits / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size_bits + 7) // 8)
+
+    def _hash(self, value: int):
+        x = (value + 0x9E3779B97F4A7C15) & _MASK64
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+        x ^= x >> 31
+        return x & 0xFFFFFFFF, (x >> 32) | 1
+
+    def add(self, value: int) -> None:
+        h1, h2 = self._hash(int(value))
+        bits, m = self._bits, self.size_bits
+        for i in range(self.hashes):
+            pos = (h1 + i * h2) % m
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def update(self, items: Iterable[int]) -> None:
+        for value in items:
+            self.add(value)
+
+    def __contains__(self, value: object) -> bool:
+        if not isinstance(value, int):
+            return False
+        h1, h2 = self._hash(value)
+        bits, m = self._bits, self.size_bits
+        for i in range(self.hashes):
+            pos = (h1 + i * h2) % m
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    @property
+    def saturated(self) -> bool:
+        """Добавлено больше расчётной ёмкости: доля ложных срабатываний выше error_rate."""
+        return self.count > self.capacity
+
+    def memory_bytes(self) -> int:
+        return sys.getsizeof(self._bits)
+
+
+class NegativeCache:
+    """Подтверждённые отрицательные ответы по user_id («флага нет») с ограничением размера,
+    LRU-вытеснением, TTL и необязательным фильтром Блума спереди.
+
+    Фильтр строится по ПОЗИТИВНОМУ множеству после полной загрузки кэшей (rebuild_bloom)
+    и пополняется в discard(): вызывающий код снимает negative ровно тогда, когда id
+    становится позитивным. Пока фильтр есть, id вне его гарантированно негативен без
+    отдельной записи; записи LRU/TTL нужны только для id, на которые фильтр отвечает
+    «возможно» (ложные срабатывания и пользователи, с которых флаг сняли).
+    clear() сбрасывает и фильтр: до следующей полной загрузки — только явные записи.
+    max_size <= 0 отключает явные записи; bloom_error_rate <= 0 — фильтр.
+    """
+
+    BLOOM_MIN_CAPACITY = 1024
+    BLOOM_HEADROOM = 2  # ёмкость фильтра = HEADROOM * размер позитивного множества
+
+    def __init__(self, max_size: int, ttl: float = 0.0, bloom_error_rate: float = 0.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_size = int(max_size)
+        self.ttl = float(ttl)
+        self.bloom_error_rate = float(bloom_error_rate)
+        self.bloom: Optional[BloomFilter] = None
+        self._clock = clock
+        self._data: "OrderedDict[int, Optional[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bloom_negatives": 0, "bloom_false_positives": 0,
+                      "evictions": 0, "expirations": 0}
+
+    def __contains__(self, key: object) -> bool:
+        bloom = self.bloom
+        if bloom is not None and key not in bloom:
+            self.stats["bloom_negatives"] += 1
+            return True
+        with self._lock:
+            expires_at = self._data.get(key, MISSING)  # type: ignore[call-overload]
+            if expires_at is not MISSING and expires_at is not None and self._clock() >= expires_at:
+                del self._data[key]  # type: ignore[arg-type]
+                self.stats["expirations"] += 1
+                expires_at = MISSING
+            if expires_at is MISSING:
+                self.stats["misses"] += 1
+                return False
+            self._data.move_to_end(key)  # type: ignore[arg-type]
+            self.stats["hits"] += 1
+            return True
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __iter__(self) -> Iterator[int]:
+        with self._lock:
+            keys = list(self._data)
+        return iter(keys)
+
+    def add(self, key: int) -> None:
+        bloom = self.bloom
+        if bloom is not None:
+            if key not in bloom:
+                return  # фильтр и так отвечает «нет»
+            self.stats["bloom_false_positives"] += 1
+        if self.max_size <= 0:
+            return
+        expires_at = self._clock() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            self._data[key] = expires_at
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def update(self, keys: Iterable[int]) -> None:
+        for key in keys:
+            self.add(key)
+
+    def discard(self, key: int) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            if self.bloom is not None:
+                self.bloom.add(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bloom = None
+
+    def rebuild_bloom(self, positives: Iterable[int], count: int) -> None:
+        """Строит фильтр по полному позитивному множеству (снимок: list(...) до вызова)."""
+        if self.bloom_error_rate <= 0:
+            return
+        bloom = BloomFilter(max(self.BLOOM_MIN_CAPACITY, self.BLOOM_HEADROOM * count), self.bloom_error_rate)
+        bloom.update(positives)
+        with self._lock:
+            self.bloom = bloom
+            # Явные записи, на которые фильтр теперь отвечает «нет», больше не нужны
+            for key in [k for k in self._data if k not in bloom]:
+                del self._data[key]
+
+    @property
+    def bloom_saturated(self) -> bool:
+        bloom = self.bloom
+        return bloom is not None and bloom.saturated
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            data: Dict[str, Any] = dict(self.stats)
+            data["size"] = len(self._data)
+            data["max_size"] = self.max_size
+        bloom = self.bloom
+        data["bloom_items"] = bloom.count if bloom is not None else None
+        data["bloom_capacity"] = bloom.capacity if bloom is not None else None
+        data["bloom_bytes"] = bloom.memory_bytes() if bloom is not None else 0
+        # Доля ответов «возможно», которые оказались негативными (среди всех негативов через фильтр)
+        through_bloom = data["bloom_negatives"] + data["bloom_false_positives"]
+        data["bloom_fp_rate"] = round(data["bloom_false_positives"] / through_bloom, 4) if through_bloom else None
+        return data
+
+
+class SpamGroupIndex:
+    """user_id -> группы, где у пользователя spammer=TRUE (сырые group_id из user_entries).
+
+    Значение — int для единственной группы (типичный спамер) или отсортированный tuple:
+    без отдельного set на пользователя. Писатели заменяют значение целиком под
+    блокировкой, читатели берут его без блокировки (замена ключа dict атомарна).
+    ready — индекс полон (построен холодной загрузкой или восстановлен из снимка) и
+    может отвечать вместо БД; до этого читатели обязаны идти в БД. clear() его снимает.
+    """
+
+    def __init__(self):
+        self._data: Dict[int, Any] = {}
+        self._lock = threading.Lock()
+        self.ready = False
+
+    @staticmethod
+    def _unpack(value: Any) -> Tuple[int, ...]:
+        if value is None:
+            return ()
+        return value if isinstance(value, tuple) else (value,)
+
+    @staticmethod
+    def _pack(groups: Iterable[int]) -> Any:
+        groups = tuple(sorted(set(groups)))
+        if not groups:
+            return None
+        return groups[0] if len(groups) == 1 else groups
+
+    def _store(self, user_id: int, groups: Iterable[int]) -> int:
+        value = self._pack(groups)
+        if value is None:
+            self._data.pop(user_id, None)
+            return 0
+        self._data[user_id] = value
+        return 1 if not isinstance(value, tuple) else len(value)
+
+    def __contains__(self, user_id: object) -> bool:
+        return user_id in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def groups(self, user_id: int) -> Tuple[int, ...]:
+        return self._unpack(self._data.get(user_id))
+
+    def count(self, user_id: int) -> int:
+        value = self._data.get(user_id)
+        if value is None:
+            return 0
+        return len(value) if isinstance(value, tuple) else 1
+
+    def pairs(self) -> Iterator[Tuple[int, int]]:
+        """Снимок пар (user_id, group_id)."""
+        with self._lock:
+            items = list(self._data.items())
+        for user_id, value in items:
+            for group_id in self._unpack(value):
+                yield user_id, group_id
+
+    def add(self, user_id: int, group_id: int) -> int:
+        """Возвращает число групп пользователя после добавления."""
+        with self._lock:
+            groups = self._unpack(self._data.get(user_id))
+            if group_id in groups:
+                return len(groups)
+            return self._store(user_id, groups + (group_id,))
+
+    def discard(self, user_id: int, group_id: int) -> int:
+        """Возвращает число оставшихся групп пользователя."""
+        with self._lock:
+            groups = self._unpack(self._data.get(user_id))
+            if group_id not in groups:
+                return len(groups)
+            return self._store(user_id, (g for g in groups if g != group_id))
+
+    def discard_user(self, user_id: int) -> Tuple[int, ...]:
+        with self._lock:
+            return self._unpack(self._data.pop(user_id, None))
+
+    def rekey_group(self, old_id: int, new_id: int) -> int:
+        """Переносит пары группы на новый id (миграция в супергруппу); O(пользователей)."""
+        moved = 0
+        with self._lock:
+            for user_id, value in list(self._data.items()):
+                groups = self._unpack(value)
+                if old_id in groups:
+                    self._store(user_id, [new_id if g == old_id else g for g in groups])
+                    moved += 1
+        return moved
+
+    def replace(self, pairs: Iterable[Tuple[int, int]]) -> None:
+        """Полная замена содержимого (холодная загрузка / снимок); после неё индекс ready."""
+        grouped: Dict[int, list] = {}
+        for user_id, group_id in pairs:
+            grouped.setdefault(int(user_id), []).append(int(group_id))
+        data = {user_id: self._pack(groups) for user_id, groups in grouped.items()}
+        with self._lock:
+            self._data = data
+            self.ready = True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data = {}
+            self.ready = False
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            values = list(self._data.values())
+        multi = [len(v) for v in values if isinstance(v, tuple)]
+        return {
+            "ready": self.ready,
+            "users": len(values),
+            "pairs": len(values) - len(multi) + sum(multi),
+            "multi_group_users": len(multi),
+        }
+
+
+def new_user_id_set(backend: str = "set", items: Optional[Iterable[int]] = None):
+    """Фабрика множеств user_id: "set" — обычный set, "compact" — CompactIntSet."""
+    if backend == "compact":
+        return CompactIntSet(items)
+    if backend != "set":
+        raise ValueError(f"Unknown user cache backend: {backend!r}")
+    return set(items) if items is not None else set()
@@ -6,6 +6,35 @@ import os
 TELEGRAM_API_KEY = os.getenv("TELEGRAM_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MODEL_NAME = os.getenv("MODEL_NAME", "gpt-4o-mini")
+# Классификация через OpenAI: одновременных запросов, таймаут вызова (включая повторы),
+# ожидание свободного слота и число повторов клиента
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "15"))
+OPENAI_QUEUE_TIMEOUT_SECONDS = float(os.getenv("OPENAI_QUEUE_TIMEOUT_SECONDS", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "1"))
+# Микро-батчи: до OPENAI_BATCH_MAX_ITEMS сообщений с одинаковыми инструкциями, собранных за
+# OPENAI_BATCH_WINDOW_MS, классифицируются одним запросом. 1 — каждое сообщение отдельно
+OPENAI_BATCH_MAX_ITEMS = int(os.getenv("OPENAI_BATCH_MAX_ITEMS", "1"))
+OPENAI_BATCH_WINDOW_MS = float(os.getenv("OPENAI_BATCH_WINDOW_MS", "50"))
+# Кэш вердиктов (хэш нормализованного текста + хэш инструкций группы): размер (0 отключает),
+# TTL и сохранение в БД (таблица verdict_cache) для переживания рестарта
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", "50000"))
+VERDICT_CACHE_TTL_SECONDS = float(os.getenv("VERDICT_CACHE_TTL_SECONDS", "86400"))
+VERDICT_CACHE_PERSIST = os.getenv("VERDICT_CACHE_PERSIST", "1").strip().lower() in {"1", "true", "yes", "on"}
+# Индекс SimHash-отпечатков недавнего спама: близкие вариации шаблона (эмодзи, пробелы, другая
+# ссылка) помечаются без OpenAI. Порог — максимум отличающихся бит из 64; размер 0 отключает
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "3"))
+NEAR_DUPLICATE_INDEX_SIZE = int(os.getenv("NEAR_DUPLICATE_INDEX_SIZE", "10000"))
+NEAR_DUPLICATE_TTL_SECONDS = float(os.getenv("NEAR_DUPLICATE_TTL_SECONDS", "86400"))
+# Локальный классификатор (local_classifier.py): файл модели (пусто — выключен) и полосы
+# уверенности: оценка >= SPAM — спам, <= HAM — не спам, между ними — запрос к OpenAI.
+# История вердиктов OpenAI и /ban, /unban пишется в classification_history для обучения
+CLASSIFIER_MODEL_PATH = os.getenv("CLASSIFIER_MODEL_PATH", "")
+CLASSIFIER_SPAM_THRESHOLD = float(os.getenv("CLASSIFIER_SPAM_THRESHOLD", "0.97"))
+CLASSIFIER_HAM_THRESHOLD = float(os.getenv("CLASSIFIER_HAM_THRESHOLD", "0.03"))
+CLASSIFIER_HISTORY_ENABLED = os.getenv("CLASSIFIER_HISTORY_ENABLED", "1").strip().lower() in {"1", "true", "yes", "on"}
+# Срок хранения истории (в ней тексты сообщений пользователей); 0 — хранить бессрочно
+CLASSIFIER_HISTORY_RETENTION_DAYS = float(os.getenv("CLASSIFIER_HISTORY_RETENTION_DAYS", "90"))
 INSTRUCTIONS_LENGTH_LIMIT = int(os.getenv("INSTRUCTIONS_LENGTH_LIMIT", "1024"))
 INSTRUCTIONS_DEFAULT_TEXT = os.getenv(
     "INSTRUCTIONS_DEFAULT_TEXT", "Любые спам-признаки."
@@ -30,3 +59,76 @@ DB_CONFIG = {
     "host": os.getenv("DB_HOST", "db"),
     "database": os.getenv("DB_NAME"),
 }
+
+# Хранилище записей пользователей и групп: mysql (по умолчанию) | sqlite | memory
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mysql").strip().lower()
+# Файл базы для STORAGE_BACKEND=sqlite (режим WAL)
+SQLITE_PATH = os.getenv("SQLITE_PATH", "buzzbuster.sqlite3")
+
+# Пул соединений с БД
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "5"))
+DB_POOL_MAX_IDLE_SECONDS = float(os.getenv("DB_POOL_MAX_IDLE_SECONDS", "300"))
+DB_POOL_MAX_LIFETIME_SECONDS = float(os.getenv("DB_POOL_MAX_LIFETIME_SECONDS", "3600"))
+DB_POOL_PING_INTERVAL_SECONDS = float(os.getenv("DB_POOL_PING_INTERVAL_SECONDS", "30"))
+# Потоки для блокирующих DB-вызовов из async-хендлеров (по умолчанию = размер пула)
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", str(DB_POOL_SIZE)))
+
+# Сколько ждать блокировку миграций схемы, пока её держит другой воркер
+SCHEMA_MIGRATION_LOCK_TIMEOUT_SECONDS = float(os.getenv("SCHEMA_MIGRATION_LOCK_TIMEOUT_SECONDS", "300"))
+
+# Write-behind: отложенная пакетная запись seen/unseen/spammer в user_entries
+DB_WRITE_BEHIND_ENABLED = os.getenv("DB_WRITE_BEHIND_ENABLED", "1").strip().lower() in {"1", "true", "yes", "on"}
+DB_WRITE_BEHIND_BATCH_SIZE = int(os.getenv("DB_WRITE_BEHIND_BATCH_SIZE", "500"))
+DB_WRITE_BEHIND_FLUSH_INTERVAL_MS = int(os.getenv("DB_WRITE_BEHIND_FLUSH_INTERVAL_MS", "200"))
+
+# Пропуск записей seen/unseen/spammer, когда кэш уже знает это состояние строки (UserStateRepository)
+DB_WRITE_SUPPRESSION_ENABLED = os.getenv("DB_WRITE_SUPPRESSION_ENABLED", "1").strip().lower() in {"1", "true", "yes", "on"}
+
+# LRU/TTL кэш записей (seen, spammer) по (user_id, group_id); 0 отключает кэш
+USER_ENTRY_CACHE_SIZE = int(os.getenv("USER_ENTRY_CACHE_SIZE", "100000"))
+USER_ENTRY_CACHE_TTL_SECONDS = float(os.getenv("USER_ENTRY_CACHE_TTL_SECONDS", "600"))
+
+# Negative caches («флага нет»): размер (LRU), TTL и точность фильтра Блума по позитивным id (0 отключает фильтр)
+NEGATIVE_CACHE_SIZE = int(os.getenv("NEGATIVE_CACHE_SIZE", "100000"))
+NEGATIVE_CACHE_TTL_SECONDS = float(os.getenv("NEGATIVE_CACHE_TTL_SECONDS", "3600"))
+NEGATIVE_CACHE_BLOOM_ERROR_RATE = float(os.getenv("NEGATIVE_CACHE_BLOOM_ERROR_RATE", "0.01"))
+
+# Представление множеств user_id в памяти: "set" (по умолчанию) или "compact" (~8 байт на id)
+USER_CACHE_BACKEND = os.getenv("USER_CACHE_BACKEND", "set").strip().lower()
+
+# Холодная загрузка кэшей: размер порции fetchmany и период логирования прогресса
+USER_CACHE_LOAD_CHUNK_SIZE = int(os.getenv("USER_CACHE_LOAD_CHUNK_SIZE", "10000"))
+USER_CACHE_LOAD_PROGRESS_SECONDS = float(os.getenv("USER_CACHE_LOAD_PROGRESS_SECONDS", "5"))
+
+# Бинарный снимок кэшей для быстрого рестарта (пустой путь отключает)
+CACHE_SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH", "cache_snapshot.bin")
+CACHE_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("CACHE_SNAPSHOT_INTERVAL_SECONDS", "300"))
+# Старше этого снимок не используется (догрузка изменений стала бы дороже полной загрузки)
+CACHE_SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("CACHE_SNAPSHOT_MAX_AGE_SECONDS", "604800"))
+
+# Инкрементальная сверка кэшей с user_entries по updated_at (0 отключает фоновый поток)
+CACHE_REFRESH_INTERVAL_SECONDS = float(os.getenv("CACHE_REFRESH_INTERVAL_SECONDS", "30"))
+CACHE_REFRESH_BATCH_SIZE = int(os.getenv("CACHE_REFRESH_BATCH_SIZE", "1000"))
+CACHE_REFRESH_LOOKBACK_SECONDS = float(os.getenv("CACHE_REFRESH_LOOKBACK_SECONDS", "5"))
+
+# Шина инвалидации кэшей между воркерами: none (один процесс) | mysql (таблица cache_events) | redis
+CACHE_BUS_BACKEND = os.getenv("CACHE_BUS_BACKEND", "none").strip().lower()
+CACHE_BUS_POLL_INTERVAL_MS = int(os.getenv("CACHE_BUS_POLL_INTERVAL_MS", "500"))
+CACHE_BUS_BATCH_SIZE = int(os.getenv("CACHE_BUS_BATCH_SIZE", "500"))
+CACHE_BUS_RETENTION_SECONDS = float(os.getenv("CACHE_BUS_RETENTION_SECONDS", "3600"))
+# MySQL-журнал: сколько последних id перечитывать — auto-increment id конкурирующих
+# транзакций становятся видимыми не по порядку
+CACHE_BUS_REPLAY_WINDOW = int(os.getenv("CACHE_BUS_REPLAY_WINDOW", "1000"))
+CACHE_BUS_REDIS_URL = os.getenv("CACHE_BUS_REDIS_URL", "redis://localhost:6379/0")
+CACHE_BUS_REDIS_STREAM = os.getenv("CACHE_BUS_REDIS_STREAM", "buzzbuster:cache_events")
+# Идентификатор воркера в событиях шины (по умолчанию hostname-pid)
+WORKER_ID = os.getenv("WORKER_ID", "")
+
+# Горячая перезагрузка настроек групп: опрос group_settings.updated_at (0 отключает)
+GROUP_SETTINGS_POLL_SECONDS = float(os.getenv("GROUP_SETTINGS_POLL_SECONDS", "60"))
+
+# Фоновый перенос строк группы на новый chat_id (миграция в супергруппу): порция по PK и пауза между порциями
+GROUP_MIGRATION_CHUNK_SIZE = int(os.getenv("GROUP_MIGRATION_CHUNK_SIZE", "1000"))
+GROUP_MIGRATION_PAUSE_MS = int(os.getenv("GROUP_MIGRATION_PAUSE_MS", "50"))
+GROUP_MIGRATION_RETRY_SECONDS = float(os.getenv("GROUP_MIGRATION_RETRY_SECONDS", "30"))
@@ -1,397 +1,648 @@
 from .config import *
 from .logging_setup import logger
-import mysql.connector
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from .caches import LRUCache, MISSING, NegativeCache, SpamGroupIndex, new_user_id_set
+from .db_pool import ConnectionPool, mysql_connect_factory
 from .formatting import display_chat, display_user
-from typing import List, Optional, Tuple
+from .group_registry import GroupRegistry
+# Тексты горячих запросов (*_SQL) живут в storage.py; имена реэкспортируются для query_plans.py
+from .storage import (
+    COLD_LOAD_SQL, DB_ERRORS, GROUPS_WHERE_SPAMMER_SQL, SEEN_ANYWHERE_SQL, SPAMMER_ANYWHERE_SQL,
+    SPAMMER_IN_GROUP_SQL, USER_ENTRY_SQL, USER_STATE_SQL, ChangeTrackingUnsupported, aggregate_user_flags_sql,
+    get_storage,
+)
+from itertools import islice
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
 
 # Глобальные переменные для кэширования данных
-configured_groups_cache = []  # [{group_id, settings}]
-suspicious_users_cache = set()  # user_ids currently having at least one unseen (seen_message=FALSE) non-spam entry
-spammers_cache = set()  # user_ids having any spammer=TRUE entry
-seen_users_cache = set()  # user_ids having at least one seen_message=TRUE entry
+# Множества user_id: set или компактный CompactIntSet (USER_CACHE_BACKEND), API одинаковый
+configured_groups_cache = GroupRegistry(INSTRUCTIONS_DEFAULT_TEXT)  # group_id -> {group_id, settings} + GroupInfo
+suspicious_users_cache = new_user_id_set(USER_CACHE_BACKEND)  # user_ids currently having at least one unseen (seen_message=FALSE) non-spam entry
+spammers_cache = new_user_id_set(USER_CACHE_BACKEND)  # user_ids having any spammer=TRUE entry
+seen_users_cache = new_user_id_set(USER_CACHE_BACKEND)  # user_ids having at least one seen_message=TRUE entry
 
 # Negative caches ("absence" memoization) to avoid повторных холостых запросов в БД.
 # ВНИМАНИЕ: они инвалиируются при позитивных апдейтах (mark_spammer/mark_seen) и при очистке кэшей.
-not_spammers_cache = set()  # user_ids для которых подтверждено ОТСУТСТВИЕ spammer=TRUE записей
-not_seen_cache = set()      # user_ids для которых подтверждено отсутствие любых seen_message=TRUE записей
+# Ограничены по размеру (LRU) и TTL; фильтр Блума по позитивному множеству (rebuild_negative_blooms)
+# отвечает «точно нет» для всех остальных пользователей без отдельных записей.
+not_spammers_cache = NegativeCache(NEGATIVE_CACHE_SIZE, NEGATIVE_CACHE_TTL_SECONDS, NEGATIVE_CACHE_BLOOM_ERROR_RATE)  # user_ids для которых подтверждено ОТСУТСТВИЕ spammer=TRUE записей
+not_seen_cache = NegativeCache(NEGATIVE_CACHE_SIZE, NEGATIVE_CACHE_TTL_SECONDS, NEGATIVE_CACHE_BLOOM_ERROR_RATE)  # user_ids для которых подтверждено отсутствие любых seen_message=TRUE записей
+
+# (seen, spammer) по ключу (user_id, group_id); None = записи нет. Ограничен по размеру (LRU) и TTL.
+# Согласованность поддерживают писатели mark_*/clear_*, миграция id группы и удаление группы.
+user_entry_cache = LRUCache(USER_ENTRY_CACHE_SIZE, USER_ENTRY_CACHE_TTL_SECONDS)
+
+# user_id -> группы со spammer=TRUE. Строится холодной загрузкой (или из снимка) и
+# поддерживается mark_spammer / clear_* / миграцией id группы; пока ready, списки групп
+# спамера и глобальная проверка отвечают без БД.
+spam_groups_index = SpamGroupIndex()
+
+# Переадресация старого chat_id группы на новый после миграции в супергруппу (group_migrations).
+# Заполняется на месте и только пополняется (строки group_migrations не удаляются);
+# запись появляется сразу при ChatMigrated, до фонового переноса строк.
+group_redirects: Dict[int, int] = {}
 
 # Отладочные счётчики количества реальных (лениво инициированных) запросов к БД
 # для функций user_has_spammer_anywhere / user_has_seen_anywhere. Используются в тестах производительности.
 debug_counter_spammer_queries = 0
 debug_counter_seen_queries = 0
+debug_counter_state_queries = 0  # агрегированные запросы resolve_user_state
+
+# Общий пул соединений (создаётся лениво при первом обращении)
+_db_pool: Optional[ConnectionPool] = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool() -> ConnectionPool:
+    """Singleton пула соединений, сконфигурированного из DB_CONFIG / DB_POOL_*."""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ConnectionPool(
+                    mysql_connect_factory(DB_CONFIG),
+                    size=DB_POOL_SIZE,
+                    acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT,
+                    max_idle=DB_POOL_MAX_IDLE_SECONDS,
+                    max_lifetime=DB_POOL_MAX_LIFETIME_SECONDS,
+                    ping_interval=DB_POOL_PING_INTERVAL_SECONDS,
+                )
+    return _db_pool
 
 def get_db_connection():
-    """Return a new DB connection."""
-    return mysql.connector.connect(**DB_CONFIG)
+    """Return a pooled DB connection; close() returns it to the pool."""
+    return get_db_pool().acquire()
 
+def get_db_pool_stats() -> dict:
+    """Статистика пула (created/reused/recycled/broken/waits/timeouts/in_use/idle)."""
+    if _db_pool is None:
+        return {"size": DB_POOL_SIZE, "open": 0, "idle": 0, "in_use": 0}
+    return _db_pool.stats()
 
-def check_and_create_tables():
-    conn = None
-    cursor = None  # predeclare for finally safety
-    initial_count = None
-    final_count = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # Capture initial row count for summary later (ignore failures silently)
-        try:
-            cursor.execute("SELECT COUNT(*) FROM user_entries")
-            row = cursor.fetchone()
-            if row:
-                initial_count = int(row[0])  # type: ignore[index]
-        except Exception:
-            initial_count = None
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS `groups` (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            group_id BIGINT NOT NULL UNIQUE
-            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
-            """
-        )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS group_settings (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            group_id BIGINT NOT NULL,
-            parameter VARCHAR(255) NOT NULL,
-            value TEXT,
-            UNIQUE KEY unique_group_parameter (group_id, parameter)
-            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
-            """
-        )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS user_entries (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            group_id BIGINT NOT NULL,
-            join_date DATETIME NOT NULL,
-            seen_message BOOLEAN DEFAULT FALSE,
-            spammer BOOLEAN DEFAULT FALSE,
-            UNIQUE KEY uniq_user_group (user_id, group_id),
-            KEY idx_user (user_id),
-            KEY idx_group (group_id),
-            KEY idx_spammer (spammer),
-            KEY idx_seen (seen_message)
-            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
-            """
-        )
-        conn.commit()
+# Ограниченный executor для блокирующих DB-вызовов из корутин (event loop не блокируется)
+_db_executor: Optional[ThreadPoolExecutor] = None
 
-        # ===== Post-creation hardening: ensure required indexes exist even if table pre-existed without them =====
-        def _existing_indexes(table: str):
-            c2 = conn.cursor()
-            try:
-                c2.execute(f"SHOW INDEX FROM {table}")
-                names = set()
-                for raw in c2.fetchall():
-                    # Treat raw as tuple for positional access (SHOW INDEX format)
-                    try:
-                        row: tuple = raw  # type: ignore[assignment]
-                        if len(row) >= 3 and row[2]:
-                            names.add(str(row[2]))
-                    except Exception:
-                        continue
-                return names
-            except mysql.connector.Error as e:  # type: ignore[name-defined]
-                logger.warning(f"Cannot list indexes for {table}: {e}")
-                return set()
-            finally:
-                c2.close()
-
-        # user_entries required indexes
-        required_user_entries_indexes = [
-            ("uniq_user_group", "UNIQUE KEY uniq_user_group (user_id, group_id)", True),
-            ("idx_user", "KEY idx_user (user_id)", False),
-            ("idx_group", "KEY idx_group (group_id)", False),
-            ("idx_spammer", "KEY idx_spammer (spammer)", False),
-            ("idx_seen", "KEY idx_seen (seen_message)", False),
-        ]
-
-        existing = _existing_indexes("user_entries")
-        # Detect duplicates before trying to add unique key if missing
-        if "uniq_user_group" not in existing:
-            dup_cursor = conn.cursor()
-            try:
-                # First detect existence of duplicates (full, not limited) for decision
-                dup_cursor.execute(
-                    "SELECT COUNT(*) FROM (SELECT user_id, group_id FROM user_entries GROUP BY user_id, group_id HAVING COUNT(*)>1) x"
+def get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor
+    if _db_executor is None:
+        with _db_pool_lock:
+            if _db_executor is None:
+                _db_executor = ThreadPoolExecutor(
+                    max_workers=max(1, DB_EXECUTOR_WORKERS), thread_name_prefix="db"
                 )
-                total_duplicate_pairs_row = dup_cursor.fetchone()
-                total_duplicate_pairs = int(total_duplicate_pairs_row[0]) if total_duplicate_pairs_row else 0  # type: ignore[index]
-                if total_duplicate_pairs > 0:
-                    # Sample for logging
-                    dup_cursor.execute(
-                        "SELECT user_id, group_id, COUNT(*) c FROM user_entries GROUP BY user_id, group_id HAVING c>1 LIMIT 5"
-                    )
-                    sample_rows = dup_cursor.fetchall()
-                    sample_fmt = []
-                    for r in sample_rows:
-                        try:
-                            user_id, group_id, cnt = r  # type: ignore[misc]
-                            sample_fmt.append(f"(user_id={user_id}, group_id={group_id}, cnt={cnt})")
-                        except Exception:
-                            sample_fmt.append(str(r))
-                    logger.warning(
-                        f"Found {total_duplicate_pairs} duplicate (user_id,group_id) pairs in user_entries. Beginning deduplication. Sample: "
-                        + ", ".join(sample_fmt)
-                    )
-                    # Consolidate flags (OR logic) into latest (MAX id) row per pair
-                    try:
-                        cursor.execute(
-                            """
-                            UPDATE user_entries u
-                            JOIN (
-                              SELECT MAX(id) AS keep_id, user_id, group_id,
-                                     MAX(join_date) AS max_join_date,
-                                     MAX(seen_message) AS seen_any,
-                                     MAX(spammer) AS spammer_any
-                              FROM user_entries
-                              GROUP BY user_id, group_id
-                              HAVING COUNT(*)>1
-                            ) agg ON u.id = agg.keep_id
-                            SET u.join_date = agg.max_join_date,
-                                u.seen_message = agg.seen_any,
-                                u.spammer = agg.spammer_any
-                            """
-                        )
-                        logger.info("Canonical rows updated with aggregated flags")
-                    except mysql.connector.Error as e:  # type: ignore[name-defined]
-                        logger.exception(f"Failed to consolidate duplicate rows before deletion: {e}")
-
-                    # Delete all non-canonical duplicates (keep MAX(id))
-                    try:
-                        cursor.execute(
-                            """
-                            DELETE ue FROM user_entries ue
-                            JOIN (
-                              SELECT MAX(id) AS keep_id, user_id, group_id
-                              FROM user_entries
-                              GROUP BY user_id, group_id
-                              HAVING COUNT(*)>1
-                            ) d ON ue.user_id=d.user_id AND ue.group_id=d.group_id AND ue.id<>d.keep_id
-                            """
-                        )
-                        removed = cursor.rowcount
-                        logger.info(f"Removed {removed} duplicate rows from user_entries.")
-                    except mysql.connector.Error as e:  # type: ignore[name-defined]
-                        logger.exception(f"Failed deleting duplicate rows: {e}")
-                    # Re-check duplicates
-                    recheck_cursor = conn.cursor()
-                    try:
-                        recheck_cursor.execute(
-                            "SELECT COUNT(*) FROM (SELECT user_id, group_id FROM user_entries GROUP BY user_id, group_id HAVING COUNT(*)>1) x"
-                        )
-                        rc_row = recheck_cursor.fetchone()
-                        still = int(rc_row[0]) if rc_row else 0  # type: ignore[index]
-                        if still == 0:
-                            logger.info("Deduplication complete; proceeding to add unique index uniq_user_group.")
-                            try:
-                                cursor.execute("ALTER TABLE user_entries ADD UNIQUE KEY uniq_user_group (user_id, group_id)")
-                                logger.info("Added missing unique index uniq_user_group on user_entries.")
-                            except mysql.connector.Error as e:  # type: ignore[name-defined]
-                                logger.exception(f"Failed adding unique index uniq_user_group after deduplication: {e}")
-                        else:
-                            logger.critical(
-                                f"Deduplication attempted but {still} duplicate pairs remain; UNIQUE index not added. Manual intervention required."
-                            )
-                    finally:
-                        recheck_cursor.close()
-                else:
-                    # No duplicates -> safe to add unique index immediately
-                    try:
-                        cursor.execute("ALTER TABLE user_entries ADD UNIQUE KEY uniq_user_group (user_id, group_id)")
-                        logger.info("Added missing unique index uniq_user_group on user_entries.")
-                    except mysql.connector.Error as e:  # type: ignore[name-defined]
-                        logger.exception(f"Failed adding unique index uniq_user_group: {e}")
-            finally:
-                dup_cursor.close()
-            # Refresh existing set after potential addition
-            existing = _existing_indexes("user_entries")
-
-        # Add any missing non-unique indexes
-        for name, ddl_fragment, _is_unique in required_user_entries_indexes:
-            if name == "uniq_user_group":
-                continue  # handled above
-            if name not in existing:
-                try:
-                    cursor.execute(f"ALTER TABLE user_entries ADD {ddl_fragment}")
-                    logger.info(f"Added missing index {name} on user_entries.")
-                except mysql.connector.Error as e:  # type: ignore[name-defined]
-                    logger.exception(f"Failed adding index {name} on user_entries: {e}")
-
-        # Ensure group_settings unique composite exists (if table pre-existed without it)
-        gs_indexes = _existing_indexes("group_settings")
-        if "unique_group_parameter" not in gs_indexes:
-            try:
-                cursor.execute("ALTER TABLE group_settings ADD UNIQUE KEY unique_group_parameter (group_id, parameter)")
-                logger.info("Added missing unique index unique_group_parameter on group_settings.")
-            except mysql.connector.Error as e:  # type: ignore[name-defined]
-                logger.exception(f"Failed adding unique_group_parameter index: {e}")
-    except mysql.connector.Error as err:
-        logger.critical(f"Database error while checking and creating tables: {err}.")
+    return _db_executor
+
+async def run_db(fn, *args):
+    """Выполняет блокирующую DB-функцию в executor'е и ожидает результат.
+    Контекст (current_update_id для логов) копируется в рабочий поток."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(get_db_executor(), functools.partial(ctx.run, fn, *args))
+
+def shutdown_db_executor():
+    global _db_executor
+    with _db_pool_lock:
+        executor, _db_executor = _db_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+def close_db_pool():
+    """Закрывает пул (при остановке бота). Следующий get_db_connection() создаст новый."""
+    global _db_pool
+    with _db_pool_lock:
+        pool, _db_pool = _db_pool, None
+    if pool is not None:
+        pool.close()
+
+
+def check_and_create_tables():
+    """Приводит схему к актуальной версии: для MySQL — миграции (migrations.py; при
+    актуальной схеме — один лёгкий запрос к schema_version, без сканов таблиц),
+    SQLite / in-memory backend создают свою схему сами (StorageBackend.setup)."""
+    from .migrations import MigrationError
+    storage = get_storage()
+    try:
+        applied = storage.setup()
+        if applied:
+            logger.info(f"Applied schema migrations: {applied}.")
+    except DB_ERRORS + (MigrationError, OSError) as err:
+        logger.critical(f"Database error while checking and creating tables ({storage.kind}): {err}.")
         raise SystemExit("Database error.")
-    finally:
-        # Capture final row count BEFORE closing cursor/connection (open new lightweight cursor if needed)
-        if conn:
-            c_final = None
-            try:
-                c_final = conn.cursor()
-                c_final.execute("SELECT COUNT(*) FROM user_entries")
-                fr = c_final.fetchone()
-                if fr:
-                    final_count = int(fr[0])  # type: ignore[index]
-            except Exception:
-                final_count = None
-            finally:
-                if c_final is not None:
-                    try:
-                        c_final.close()
-                    except Exception:
-                        pass
-        if cursor:
-            try:
-                cursor.close()
-            except Exception:
-                pass
-        if conn:
-            try:
-                conn.close()
-            except Exception:
-                pass
-        # Summary log: final counts & dedup stats
-        try:
-            from .logging_setup import log_event
-            log_event('schema_harden_summary', initial_rows=initial_count, final_rows=final_count)
-        except Exception:
-            pass
-        logger.debug("Tables checked and created if necessary.")
+    logger.debug("Tables checked and created if necessary.")
+
+def resolve_group_id(group_id: int, redirects: Optional[Dict[int, int]] = None) -> int:
+    """Актуальный id группы: старый chat_id мигрировавшей группы переадресуется на новый."""
+    if redirects is None:
+        redirects = group_redirects
+    for _ in range(8):  # цепочка old -> new -> newer; защита от цикла
+        new_id = redirects.get(group_id)
+        if new_id is None or new_id == group_id:
+            break
+        group_id = new_id
+    return group_id
+
+def add_group_redirect(old_id: int, new_id: int) -> None:
+    """Запоминает переадресацию и переносит группу в кэше настроенных групп на новый id."""
+    group_redirects[old_id] = new_id
+    configured_groups_cache.rekey(old_id, new_id)
+    spam_groups_index.rekey_group(old_id, new_id)
 
 def is_group_configured(group_id: int) -> bool:
     """Проверка наличия группы в кэше настроенных групп."""
-    return any(group["group_id"] == group_id for group in configured_groups_cache)
+    return resolve_group_id(group_id) in configured_groups_cache
+
+def _insert_configured_group(group_id: int):
+    get_storage().add_group(group_id, {"instructions": INSTRUCTIONS_DEFAULT_TEXT})
+    publish_cache_event("group", group_id=group_id)
 
 async def add_configured_group(update):
     chat = update.effective_chat
     user = update.effective_user
-    conn = None
-    cursor = None
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO `groups` (group_id) VALUES (%s) ON DUPLICATE KEY UPDATE group_id=group_id",
-            (chat.id,)
-        )
-        cursor.execute(
-            "INSERT INTO `group_settings` (group_id, parameter, value) VALUES (%s, %s, %s) "
-            "ON DUPLICATE KEY UPDATE value=%s",
-            (chat.id, "instructions", INSTRUCTIONS_DEFAULT_TEXT, INSTRUCTIONS_DEFAULT_TEXT)
-        )
-        conn.commit()
-    except mysql.connector.Error as err:
+        await run_db(_insert_configured_group, chat.id)
+    except DB_ERRORS as err:
         logger.exception(f"Database error when configuring group {display_chat(chat)}: {err}")
         await update.message.reply_text("Ошибка настройки бота для этой группы.")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
 
     # Обновление кэша настроенных групп
-    configured_groups_cache.append(
-        {"group_id": chat.id, "settings": {
-            "instructions": INSTRUCTIONS_DEFAULT_TEXT}}
-    )
+    configured_groups_cache.upsert(chat.id, {"instructions": INSTRUCTIONS_DEFAULT_TEXT})
 
     await update.message.reply_text(
         "Бот настроен для этой группы. Используйте /help, чтобы увидеть доступные команды."
     )
     logger.info(f"User {display_user(user)} configured group {display_chat(chat)}.")
 
+def register_channel_group(group_id: int):
+    """Регистрирует канал (бот стал админом канала). Ошибки БД пробрасываются вызывающему."""
+    get_storage().add_group(group_id)
+    publish_cache_event("group", group_id=group_id)
+    if group_id not in configured_groups_cache:
+        configured_groups_cache.upsert(group_id, {})
+
+def remove_configured_group(group_id: int):
+    """Удаляет группу и её настройки (бот удалён из группы). Ошибки БД пробрасываются вызывающему."""
+    get_storage().remove_group(group_id)
+    publish_cache_event("group", group_id=group_id)
+    configured_groups_cache.discard(group_id)
+    invalidate_group_entries(group_id)
+
 def load_configured_groups():
     """Загрузка настроенных групп из базы данных."""
-    global configured_groups_cache
-    configured_groups_cache = []
     logger.debug("Loading configured groups from the database.")
-
-    conn = None
-    cur = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(dictionary=True)
-        cur.execute(
-            """
-            SELECT g.group_id, s.parameter, s.value 
-            FROM `groups` g 
-            LEFT JOIN group_settings s ON g.group_id = s.group_id
-            """
-        )
-        group_dict = {}
-        for row in cur.fetchall():
-            group_id = row.get("group_id") if isinstance(row, dict) else row[0]
-            parameter = row.get("parameter") if isinstance(row, dict) else None
-            value = row.get("value") if isinstance(row, dict) else None
-            if group_id not in group_dict:
-                group_dict[group_id] = {"group_id": group_id, "settings": {}}
-            if parameter and value:
-                group_dict[group_id]["settings"][parameter] = value
-        configured_groups_cache = list(group_dict.values())
-    except mysql.connector.Error as err:
+        reload_configured_groups()
+    except DB_ERRORS as err:
         logger.critical(f"Database error while loading configured groups: {err}.")
         raise SystemExit("Database error.")
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
-
     logger.debug(f"Loaded {len(configured_groups_cache)} configured groups.")
 
+def reload_configured_groups():
+    """Перечитывает группы и настройки в configured_groups_cache. Ошибки БД пробрасываются
+    (фоновые потоки не должны завершать процесс, как стартовая загрузка)."""
+    storage = get_storage()
+    groups = storage.load_groups()
+    redirects = storage.load_group_redirects()
+    # Перенос строк мог не завершиться (остановка посреди миграции): группа ещё лежит под
+    # старым id, а resolve_group_id ведёт на новый. Реестр строится сразу по новым id;
+    # настройки, уже сохранённые под новым id, не перезаписываются (как в rekey).
+    entries: Dict[int, Dict[str, str]] = {}
+    for gid in sorted(groups, key=lambda g: resolve_group_id(g, redirects) != g):
+        entries.setdefault(resolve_group_id(gid, redirects), groups[gid])
+    # Без clear(): переадресации только добавляются, а update() словарём атомарен под GIL,
+    # так что читатели не видят момента без переадресаций
+    group_redirects.update(redirects)
+    # Заменяем на месте (одной подменой): модули импортируют configured_groups_cache по имени
+    configured_groups_cache.replace({"group_id": gid, "settings": settings} for gid, settings in entries.items())
+
+
+def reload_group_settings(group_id: int) -> bool:
+    """Перечитывает одну группу и атомарно подменяет её запись в реестре (GroupInfo
+    пересчитывается). False — группы больше нет в БД, она убрана из реестра.
+    Ошибки БД пробрасываются."""
+    settings = get_storage().load_group(group_id)
+    if settings is None:
+        configured_groups_cache.discard(group_id)
+        return False
+    configured_groups_cache.upsert(group_id, settings)
+    return True
+
+
+def fetch_group_settings_versions(after: Optional[datetime] = None) -> Dict[int, datetime]:
+    """{group_id: MAX(updated_at)} настроек, изменённых после after (None — всех групп).
+    Только для backend'а с tracks_changes, иначе ChangeTrackingUnsupported."""
+    return get_storage().group_settings_versions(after)
+
 
-def load_user_caches():
-    """Полная загрузка пользовательских кэшей из БД (cold start / full refresh)."""
-    global suspicious_users_cache, spammers_cache, seen_users_cache
-    suspicious_users_cache = set()
-    spammers_cache = set()
-    seen_users_cache = set()
-    # Очистка negative caches и счётчиков
+def _scan_user_entries(where: str = "", params: tuple = ()) -> Tuple[array, array, array, array, int]:
+    """Один проход по user_entries порциями scan_user_flags (MySQL: небуферизованный курсор, fetchmany).
+    Каждая строка независимо вносит user_id в spammers / seen / suspicious; id копятся
+    в array('q') (8 байт на строку) вместо списков кортежей fetchall(). spam_pairs —
+    плоские пары user_id, group_id spammer-строк для spam_groups_index.
+    Возвращает (spammers, seen, suspicious, spam_pairs, rows). Ошибки БД пробрасываются."""
+    spammers, seen, suspicious, spam_pairs = array("q"), array("q"), array("q"), array("q")
+    rows = 0
+    started = time.monotonic()
+    last_progress = started
+    for chunk in get_storage().scan_user_flags(USER_CACHE_LOAD_CHUNK_SIZE, where, params):
+        for uid, seen_message, spammer, gid in chunk:  # type: ignore[misc]
+            if uid is None:
+                continue
+            if spammer:
+                spammers.append(uid)
+                spam_pairs.append(uid)
+                spam_pairs.append(gid)
+            if seen_message:
+                seen.append(uid)
+            # Подозрительные: хотя бы одна запись без seen и без spammer
+            if not seen_message and not spammer:
+                suspicious.append(uid)
+        rows += len(chunk)
+        now = time.monotonic()
+        if now - last_progress >= USER_CACHE_LOAD_PROGRESS_SECONDS:
+            last_progress = now
+            logger.info(f"Loading user caches: {rows} rows scanned ({rows / (now - started):.0f} rows/s).")
+    return spammers, seen, suspicious, spam_pairs, rows
+
+
+def _reset_lazy_caches():
+    """Сброс negative caches, кэша записей и отладочных счётчиков."""
     not_spammers_cache.clear()
     not_seen_cache.clear()
-    global debug_counter_spammer_queries, debug_counter_seen_queries
+    user_entry_cache.clear()
+    global debug_counter_spammer_queries, debug_counter_seen_queries, debug_counter_state_queries
     debug_counter_spammer_queries = 0
     debug_counter_seen_queries = 0
+    debug_counter_state_queries = 0
+
+
+def rebuild_negative_blooms(only_saturated: bool = False) -> int:
+    """Строит фильтры Блума negative caches по текущим позитивным множествам.
+    only_saturated — только переполненные (фоновая сверка). Возвращает число перестроенных."""
+    rebuilt = 0
+    for negative, positive in ((not_spammers_cache, spammers_cache), (not_seen_cache, seen_users_cache)):
+        if only_saturated and not negative.bloom_saturated:
+            continue
+        started = time.monotonic()
+        # list(): снимок множества, которое параллельно меняют обработчики
+        ids = list(positive)
+        negative.rebuild_bloom(ids, len(ids))
+        rebuilt += 1
+        logger.debug(f"Negative cache Bloom filter rebuilt over {len(ids)} ids in {time.monotonic() - started:.2f}s.")
+    return rebuilt
+
+def start_negative_bloom_rebuild() -> Optional[threading.Thread]:
+    """Построение фильтров в фоне после стартовой загрузки: до его завершения negative
+    caches отвечают только явными записями (как без фильтра)."""
+    if NEGATIVE_CACHE_BLOOM_ERROR_RATE <= 0:
+        return None
+    thread = threading.Thread(target=rebuild_negative_blooms, name="negative-bloom", daemon=True)
+    thread.start()
+    return thread
+
+def get_negative_cache_stats() -> dict:
+    """Статистика negative caches; db_fallbacks — запросы в БД при промахе обоих кэшей."""
+    spammer = not_spammers_cache.snapshot_stats()
+    spammer["db_fallbacks"] = debug_counter_spammer_queries
+    seen = not_seen_cache.snapshot_stats()
+    seen["db_fallbacks"] = debug_counter_seen_queries
+    return {"spammer": spammer, "seen": seen, "state_db_fallbacks": debug_counter_state_queries}
+
+def load_user_caches() -> dict:
+    """Полная загрузка пользовательских кэшей из БД (cold start / full refresh).
+
+    Один потоковый проход по user_entries (см. _scan_user_entries). Кэши заполняются
+    на месте (ссылки, импортированные по имени в других модулях, остаются валидными).
+    Возвращает статистику загрузки (rows, seconds, rows_per_sec)."""
+    _reset_lazy_caches()
     logger.debug("Loading user caches from the database (full refresh).")
-    conn = None
-    cur = None
+    started = time.monotonic()
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        # Спамеры
-        cur.execute("SELECT DISTINCT user_id FROM user_entries WHERE spammer = TRUE")  # type: ignore[arg-type]
-        spammers_cache = {int(uid) for (uid,) in cur.fetchall() if uid is not None}  # type: ignore[misc]
-        # Seen пользователи
-        cur.execute("SELECT DISTINCT user_id FROM user_entries WHERE seen_message = TRUE")  # type: ignore[arg-type]
-        seen_users_cache = {int(uid) for (uid,) in cur.fetchall() if uid is not None}  # type: ignore[misc]
-        # Подозрительные: хотя бы одна запись без seen и без spammer
-        cur.execute("""SELECT DISTINCT user_id FROM user_entries 
-            WHERE seen_message = FALSE AND spammer = FALSE""")  # type: ignore[arg-type]
-        suspicious_users_cache = {int(uid) for (uid,) in cur.fetchall() if uid is not None}  # type: ignore[misc]
-    except mysql.connector.Error as err:
+        flush_pending_writes()
+        spammers, seen, suspicious, spam_pairs, rows = _scan_user_entries()
+    except DB_ERRORS as err:
         logger.critical(f"Database error while loading user caches: {err}.")
         raise SystemExit("Database error.")
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
-
-    logger.debug(
-        f"User caches loaded. Seen: {len(seen_users_cache)}, Suspicious: {len(suspicious_users_cache)}, Spammers: {len(spammers_cache)}"
+
+    for cache, ids in ((spammers_cache, spammers), (seen_users_cache, seen), (suspicious_users_cache, suspicious)):
+        cache.clear()
+        cache.update(ids)
+    spam_groups_index.replace(zip(spam_pairs[0::2], spam_pairs[1::2]))
+    elapsed = time.monotonic() - started
+    rate = rows / elapsed if elapsed > 0 else float(rows)
+    logger.info(
+        f"User caches loaded from {rows} rows in {elapsed:.2f}s ({rate:.0f} rows/s). "
+        f"Seen: {len(seen_users_cache)}, Suspicious: {len(suspicious_users_cache)}, Spammers: {len(spammers_cache)}"
     )
+    return {"rows": rows, "seconds": round(elapsed, 3), "rows_per_sec": round(rate)}
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def watermark_to_int(value: Optional[datetime]) -> int:
+    """updated_at (naive, в часовом поясе сессии) -> микросекунды от эпохи (для заголовка снимка)."""
+    if value is None:
+        return 0
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+
+def watermark_from_int(value: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=int(value))
+
+
+def get_user_entries_high_water_mark() -> Optional[datetime]:
+    """Отметка изменений: MAX(updated_at) в user_entries (None для пустой таблицы)."""
+    return get_storage().user_entries_high_water_mark()
+
+
+def fetch_user_entry_changes(after: Tuple[datetime, int], limit: int) -> list:
+    """Строки user_entries, изменённые после (updated_at, id), в порядке (updated_at, id).
+    Каждая строка: (id, user_id, group_id, seen_message, spammer, updated_at)."""
+    return get_storage().user_entry_changes(after, limit)
+
+
+def aggregate_user_flags(user_ids: List[int]) -> Dict[int, Tuple[bool, bool, bool]]:
+    """Глобальные флаги по БД: user_id -> (spammer_any, seen_any, has_unseen_non_spam_row)."""
+    if not user_ids:
+        return {}
+    return get_storage().aggregate_user_flags(user_ids)
+
+
+# Локальные записи пользователей: фоновая сверка с БД не снимает флаги с пользователя,
+# которого бот сам изменил, пока шёл запрос (см. cache_refresh.py).
+_local_writes_lock = threading.Lock()
+_local_write_seq = 0
+_local_write_users: Dict[int, int] = {}
+
+
+def _note_local_write(user_id: int) -> None:
+    global _local_write_seq
+    with _local_writes_lock:
+        _local_write_seq += 1
+        _local_write_users[user_id] = _local_write_seq
+
+
+def local_write_token() -> int:
+    return _local_write_seq
+
+
+def users_written_since(token: int) -> set:
+    """user_id, изменённые локально после token; более старые отметки удаляются."""
+    with _local_writes_lock:
+        recent = {uid for uid, seq in _local_write_users.items() if seq > token}
+        for uid in [uid for uid, seq in _local_write_users.items() if seq <= token]:
+            del _local_write_users[uid]
+        return recent
+
 
+# Публикация мутаций в шину инвалидации между воркерами (cache_bus.py подключает её при старте)
+_cache_event_publisher: Optional[Callable[..., None]] = None
+
+
+def set_cache_event_publisher(publisher: Optional[Callable[..., None]]) -> None:
+    global _cache_event_publisher
+    _cache_event_publisher = publisher
+
+
+def publish_cache_event(kind: str, user_id: Optional[int] = None, group_id: Optional[int] = None,
+                        value: Optional[int] = None) -> None:
+    publisher = _cache_event_publisher
+    if publisher is not None:
+        publisher(kind, user_id=user_id, group_id=group_id, value=value)
+
+
+# ===== Write-behind очередь для user_entries =====
+
+class PendingWrite:
+    """Накопленные флаги для одной пары (user_id, group_id).
+    seen: None — не трогать, False — unseen, True — seen (OR-семантика: True побеждает).
+    spammer: OR всех mark_spammer."""
+
+    __slots__ = ("seen", "spammer")
+
+    def __init__(self, seen: Optional[bool] = None, spammer: bool = False):
+        self.seen = seen
+        self.spammer = spammer
+
+    def merge(self, seen: Optional[bool] = None, spammer: bool = False) -> None:
+        if seen is True or (seen is False and self.seen is None):
+            self.seen = seen
+        self.spammer = self.spammer or spammer
+
+
+class WriteBehindQueue:
+    """Коалесцирующая очередь записей в user_entries.
+
+    Записи копятся по ключу (user_id, group_id) и сбрасываются фоновым потоком одним
+    multi-row upsert'ом на «форму» строки (какие колонки меняются) в одной транзакции —
+    по достижении batch_size или раз в flush_interval секунд. Пока запись не
+    закоммичена, она видна читателям через pending_entry() (кэши остаются авторитетными).
+    Пока очередь не запущена (start), enqueue() возвращает False и вызывающий пишет сразу.
+    """
+
+    def __init__(self, batch_size: int = 500, flush_interval: float = 0.2):
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[int, int], PendingWrite] = {}
+        self._inflight: Dict[Tuple[int, int], PendingWrite] = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.stats = {"enqueued": 0, "coalesced": 0, "flushed_rows": 0, "flush_batches": 0, "flush_errors": 0}
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> int:
+        """Останавливает фоновый поток и синхронно сбрасывает всё накопленное."""
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+        return self.flush()
+
+    def enqueue(self, user_id: int, group_id: int, seen: Optional[bool] = None, spammer: bool = False) -> bool:
+        if self._thread is None:
+            return False
+        key = (user_id, group_id)
+        with self._cond:
+            self.stats["enqueued"] += 1
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = PendingWrite(seen, spammer)
+            else:
+                pending.merge(seen, spammer)
+                self.stats["coalesced"] += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def pending_entry(self, user_id: int, group_id: int) -> Optional[PendingWrite]:
+        """Незакоммиченное состояние пары (очередь + сбрасываемый сейчас батч) или None."""
+        key = (user_id, group_id)
+        with self._cond:
+            inflight = self._inflight.get(key)
+            pending = self._pending.get(key)
+            if inflight is None and pending is None:
+                return None
+            merged = PendingWrite()
+            for part in (inflight, pending):
+                if part is not None:
+                    merged.merge(part.seen, part.spammer)
+            return merged
+
+    def pending_spam_groups(self, user_id: int) -> List[int]:
+        with self._cond:
+            return [gid for source in (self._inflight, self._pending)
+                    for (uid, gid), w in source.items() if uid == user_id and w.spammer]
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._pending) + len(self._inflight)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait_for(
+                        lambda: self._stopping or len(self._pending) >= self.batch_size,
+                        timeout=self.flush_interval,
+                    )
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # Уже залогировано; батч возвращён в очередь. Пауза, чтобы не долбить недоступную БД.
+                with self._cond:
+                    self._cond.wait_for(lambda: self._stopping, timeout=max(self.flush_interval, 1.0))
+
+    def flush(self) -> int:
+        """Синхронно записывает всё накопленное; возвращает число записанных строк.
+        При ошибке БД батч возвращается в очередь (с OR-слиянием) и ошибка пробрасывается."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    if not self._pending:
+                        break
+                    keys = list(islice(self._pending, self.batch_size))
+                    batch = {k: self._pending.pop(k) for k in keys}
+                    self._inflight = batch
+                try:
+                    _flush_user_entry_batch(batch)
+                except Exception as err:
+                    with self._cond:
+                        for key, w in batch.items():
+                            newer = self._pending.get(key)
+                            if newer is not None:
+                                w.merge(newer.seen, newer.spammer)
+                            self._pending[key] = w
+                        self._inflight = {}
+                        self.stats["flush_errors"] += 1
+                    logger.exception(f"Write-behind flush of {len(batch)} user_entries rows failed: {err}")
+                    raise
+                with self._cond:
+                    self._inflight = {}
+                    self.stats["flushed_rows"] += len(batch)
+                    self.stats["flush_batches"] += 1
+                written += len(batch)
+        return written
+
+    def snapshot_stats(self) -> dict:
+        with self._cond:
+            data = dict(self.stats)
+            data["pending"] = len(self._pending) + len(self._inflight)
+            data["active"] = self._thread is not None
+        return data
+
+
+def _flush_user_entry_batch(batch: Dict[Tuple[int, int], PendingWrite]) -> None:
+    """Пакетный upsert батча одной транзакцией (для MySQL — по одному multi-row
+    INSERT ... ON DUPLICATE KEY UPDATE на «форму» строки, см. MySQLStorage.upsert_entries)."""
+    get_storage().upsert_entries([(user_id, group_id, w.seen, w.spammer) for (user_id, group_id), w in batch.items()])
+
+
+write_behind = WriteBehindQueue(
+    batch_size=DB_WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=DB_WRITE_BEHIND_FLUSH_INTERVAL_MS / 1000.0,
+)
+
+def start_write_behind() -> bool:
+    """Включает отложенную запись (вызывается из bot.main), если она разрешена конфигом."""
+    if not DB_WRITE_BEHIND_ENABLED:
+        return False
+    write_behind.start()
+    return True
+
+def flush_pending_writes() -> int:
+    """Синхронный сброс очереди (перед UPDATE'ами, которые должны видеть все записи).
+
+    Ошибки БД пробрасываются: неудачная порция вернулась в очередь, и UPDATE, выполненный
+    после такого сброса, позже перезаписался бы ею (например, spammer=TRUE после разбана)."""
+    return write_behind.flush()
+
+def stop_write_behind() -> int:
+    """Останавливает фоновый сброс и синхронно дописывает очередь (shutdown)."""
+    try:
+        return write_behind.stop()
+    except DB_ERRORS as err:
+        logger.critical(f"Write-behind queue could not be flushed on shutdown ({len(write_behind)} rows lost): {err}")
+        return 0
+
+def get_write_behind_stats() -> dict:
+    return write_behind.snapshot_stats()
+
+
+# ===== Кэш записей (user_id, group_id) =====
+
+def _entry_cache_apply(user_id: int, group_id: int, seen: Optional[bool] = None,
+                       spammer: Optional[bool] = None, insert: bool = True) -> None:
+    """Отражает запись в user_entries в entry-кэше так же, как её применит БД.
+    insert=False — UPDATE (отсутствующую строку не создаёт). Если прежнее состояние
+    не закэшировано, ключ остаётся пустым (частичная запись его не определяет)."""
+    _note_local_write(user_id)
+    def apply(cached):
+        if cached is MISSING:
+            return MISSING
+        if cached is None:
+            if not insert:
+                return None
+            cached = (False, False)
+        return (
+            cached[0] if seen is None else bool(seen),
+            cached[1] if spammer is None else bool(spammer),
+        )
+    user_entry_cache.update((user_id, group_id), apply)
+
+def invalidate_group_entries(group_id: int) -> int:
+    """Сбрасывает закэшированные записи группы (миграция id, удаление группы)."""
+    return user_entry_cache.invalidate_where(lambda key: key[1] == group_id)
+
+def get_user_entry_cache_stats() -> dict:
+    return user_entry_cache.snapshot_stats()
+
+def get_spam_groups_index_stats() -> dict:
+    return spam_groups_index.snapshot_stats()
 
 # ===== New helper functions for new logic =====
 
@@ -404,32 +655,22 @@ def user_has_spammer_anywhere(user_id: int) -> bool:
     # Negative cache hit
     if user_id in not_spammers_cache:
         return False
+    # Полный индекс групп спамеров: отсутствие в нём — точное «нет»
+    if spam_groups_index.ready:
+        return user_id in spam_groups_index
     global debug_counter_spammer_queries
     debug_counter_spammer_queries += 1
-    conn = None
-    cur = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT 1 FROM user_entries WHERE user_id=%s AND spammer=TRUE LIMIT 1",
-            (user_id,),
-        )
-        if cur.fetchone() is not None:
+        if get_storage().spammer_anywhere(user_id):
             spammers_cache.add(user_id)
             not_spammers_cache.discard(user_id)
             return True
         # negative result -> кэшируем отсутствие
         not_spammers_cache.add(user_id)
         return False
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         logger.exception(f"DB error user_has_spammer_anywhere({user_id}): {err}")
         return False
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
 
 def user_has_seen_anywhere(user_id: int) -> bool:
     if user_id in seen_users_cache:
@@ -442,192 +683,133 @@ def user_has_seen_anywhere(user_id: int) -> bool:
         return False
     global debug_counter_seen_queries
     debug_counter_seen_queries += 1
-    conn = None
-    cur = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT 1 FROM user_entries WHERE user_id=%s AND seen_message=TRUE LIMIT 1",
-            (user_id,),
-        )
-        if cur.fetchone() is not None:
+        if get_storage().seen_anywhere(user_id):
             seen_users_cache.add(user_id)
             not_seen_cache.discard(user_id)
             return True
         not_seen_cache.add(user_id)
         return False
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         logger.exception(f"DB error user_has_seen_anywhere({user_id}): {err}")
         return False
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
 
 def ensure_user_entry(user_id: int, group_id: int):
-    conn = None
-    cur = None
+    if write_behind.enqueue(user_id, group_id):
+        _entry_cache_apply(user_id, group_id)
+        return
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO user_entries (user_id, group_id, join_date)
-            VALUES (%s, %s, NOW())
-            ON DUPLICATE KEY UPDATE join_date=join_date
-            """,
-            (user_id, group_id),
-        )
-        conn.commit()
-    except mysql.connector.Error as err:
+        get_storage().upsert_entry(user_id, group_id)
+        _entry_cache_apply(user_id, group_id)
+    except DB_ERRORS as err:
+        user_entry_cache.invalidate((user_id, group_id))
         logger.exception(f"DB error ensure_user_entry({user_id},{group_id}): {err}")
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+
+def _apply_spammer_caches(user_id: int) -> None:
+    spammers_cache.add(user_id)
+    not_spammers_cache.discard(user_id)
+    suspicious_users_cache.discard(user_id)
+
+def _apply_seen_caches(user_id: int) -> None:
+    seen_users_cache.add(user_id)
+    not_seen_cache.discard(user_id)
+    suspicious_users_cache.discard(user_id)
+
+def _apply_unseen_caches(user_id: int) -> None:
+    # Добавляем в suspicious если не спамер
+    if user_id not in spammers_cache:
+        suspicious_users_cache.add(user_id)
 
 def mark_spammer_in_group(user_id: int, group_id: int):
     """Помечает пользователя спамером в группе + обновляет кэши."""
     global spammers_cache, not_spammers_cache, suspicious_users_cache
-    conn = None
-    cur = None
     success = False
     try:
         from .logging_setup import log_event
         log_event('db_mark_spammer_attempt', user_id=user_id, chat_id=group_id)
-        conn = get_db_connection()
-        log_event('db_mark_spammer_connected', user_id=user_id, chat_id=group_id, host=DB_CONFIG.get('host'), db=DB_CONFIG.get('database'), user=DB_CONFIG.get('user'))
-        cur = conn.cursor()
-        log_event('db_mark_spammer_executing', user_id=user_id, chat_id=group_id)
-        cur.execute(
-            """
-            INSERT INTO user_entries (user_id, group_id, join_date, spammer)
-            VALUES (%s, %s, NOW(), TRUE)
-            ON DUPLICATE KEY UPDATE spammer=TRUE
-            """,
-            (user_id, group_id),
-        )
-        log_event('db_mark_spammer_before_commit', user_id=user_id, chat_id=group_id)
-        conn.commit()
-        success = True
-        log_event('db_mark_spammer_success', user_id=user_id, chat_id=group_id)
-    except mysql.connector.Error as err:
+        if write_behind.enqueue(user_id, group_id, spammer=True):
+            # Запись уйдёт в БД батчем; кэши ниже обновляются сразу и авторитетны до сброса
+            success = True
+            log_event('db_mark_spammer_queued', user_id=user_id, chat_id=group_id)
+        else:
+            storage = get_storage()
+            log_event('db_mark_spammer_executing', user_id=user_id, chat_id=group_id, backend=storage.kind)
+            storage.upsert_entry(user_id, group_id, spammer=True)
+            success = True
+            log_event('db_mark_spammer_success', user_id=user_id, chat_id=group_id)
+    except DB_ERRORS as err:
+        user_entry_cache.invalidate((user_id, group_id))
         logger.exception(f"DB error mark_spammer_in_group({user_id},{group_id}): {err}")
         try:
             from .logging_setup import log_event
-            log_event('db_mark_spammer_failed', user_id=user_id, chat_id=group_id, error=str(err), host=DB_CONFIG.get('host'), db=DB_CONFIG.get('database'), user=DB_CONFIG.get('user'))
+            log_event('db_mark_spammer_failed', user_id=user_id, chat_id=group_id, error=str(err), backend=STORAGE_BACKEND, host=DB_CONFIG.get('host'), db=DB_CONFIG.get('database'), user=DB_CONFIG.get('user'))
         except Exception:
             pass
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+    if success:
+        _entry_cache_apply(user_id, group_id, spammer=True)
+        spam_groups_index.add(user_id, group_id)
+        publish_cache_event("spammer", user_id, group_id)
     # Всегда обновляем кэш (даже если БД не сработала, чтобы тесты с фейковыми коннектами могли опираться на поведение)
-    spammers_cache.add(user_id)
-    not_spammers_cache.discard(user_id)
-    suspicious_users_cache.discard(user_id)
+    _apply_spammer_caches(user_id)
     return success
 
 def mark_seen_in_group(user_id: int, group_id: int) -> bool:
     global seen_users_cache, not_seen_cache, suspicious_users_cache
     # Оптимистично обновляем кэши ДО обращения к БД, чтобы последующие чтения сразу видели статус.
-    seen_users_cache.add(user_id)
-    not_seen_cache.discard(user_id)
-    suspicious_users_cache.discard(user_id)
-    # Дополнительное гарантированное обновление ссылки (на случай если где-то удерживается старая ссылка)
-    if user_id not in seen_users_cache:
-        # rebind (хотя теоретически не нужно, но оставляем как страховку)
-        tmp = set(seen_users_cache)
-        tmp.add(user_id)
-        seen_users_cache = tmp  # type: ignore
-    if user_id in not_seen_cache:
-        not_seen_cache = {x for x in not_seen_cache if x != user_id}  # type: ignore
-    conn = None
-    cur = None
+    _note_local_write(user_id)
+    _apply_seen_caches(user_id)
     success = False
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO user_entries (user_id, group_id, join_date, seen_message)
-            VALUES (%s, %s, NOW(), TRUE)
-            ON DUPLICATE KEY UPDATE seen_message=TRUE
-            """,
-            (user_id, group_id),
-        )
-        conn.commit()
+    if write_behind.enqueue(user_id, group_id, seen=True):
         success = True
-    except mysql.connector.Error as err:
-        logger.exception(f"DB error mark_seen_in_group({user_id},{group_id}): {err}")
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+        _entry_cache_apply(user_id, group_id, seen=True)
+    else:
+        try:
+            get_storage().upsert_entry(user_id, group_id, seen=True)
+            success = True
+            _entry_cache_apply(user_id, group_id, seen=True)
+        except DB_ERRORS as err:
+            user_entry_cache.invalidate((user_id, group_id))
+            logger.exception(f"DB error mark_seen_in_group({user_id},{group_id}): {err}")
     # Повторно (идемпотентно) актуализируем кэши после операции
-    seen_users_cache.add(user_id)
-    not_seen_cache.discard(user_id)
-    suspicious_users_cache.discard(user_id)
+    _apply_seen_caches(user_id)
     # Принудительно прогреваем позитивный путь для user_has_seen_anywhere
     user_has_seen_anywhere(user_id)
+    if success:
+        publish_cache_event("seen", user_id, group_id)
     return success
 
 def mark_unseen_in_group(user_id: int, group_id: int) -> bool:
     """Создаёт / фиксирует запись со статусом unseen (используется при джойне). Добавляем в suspicious.
     Возвращает bool успех операции записи в БД."""
-    conn = None
-    cur = None
     success = False
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO user_entries (user_id, group_id, join_date, seen_message)
-            VALUES (%s, %s, NOW(), FALSE)
-            ON DUPLICATE KEY UPDATE seen_message=FALSE
-            """,
-            (user_id, group_id),
-        )
-        conn.commit()
+    if write_behind.enqueue(user_id, group_id, seen=False):
         success = True
-        # Добавляем в suspicious если не спамер
-        if user_id not in spammers_cache:
-            suspicious_users_cache.add(user_id)
-    except mysql.connector.Error as err:
-        logger.exception(f"DB error mark_unseen_in_group({user_id},{group_id}): {err}")
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+    else:
+        try:
+            get_storage().upsert_entry(user_id, group_id, seen=False)
+            success = True
+        except DB_ERRORS as err:
+            user_entry_cache.invalidate((user_id, group_id))
+            logger.exception(f"DB error mark_unseen_in_group({user_id},{group_id}): {err}")
+    if success:
+        _entry_cache_apply(user_id, group_id, seen=False)
+        _apply_unseen_caches(user_id)
+        publish_cache_event("unseen", user_id, group_id)
     return success
 
 def clear_spammer_flag_in_group(user_id: int, group_id: int) -> bool:
-    conn = None
-    cur = None
     success = False
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "UPDATE user_entries SET spammer=FALSE WHERE user_id=%s AND group_id=%s",
-            (user_id, group_id),
-        )
-        conn.commit()
+        # UPDATE должен видеть все отложенные вставки (иначе поздний flush вернёт spammer=TRUE);
+        # не удалось сбросить очередь — флаг не снимаем
+        flush_pending_writes()
+        get_storage().clear_spammer(user_id, group_id)
         success = True
-    except mysql.connector.Error as err:
+        _entry_cache_apply(user_id, group_id, spammer=False, insert=False)
+        spam_groups_index.discard(user_id, group_id)
+    except DB_ERRORS as err:
+        user_entry_cache.invalidate((user_id, group_id))
         logger.exception(f"DB error clear_spammer_flag_in_group({user_id},{group_id}): {err}")
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
     # Пересчёт глобального флага спамера
     if user_id in spammers_cache:
         if not groups_where_spammer(user_id):
@@ -636,80 +818,233 @@ def clear_spammer_flag_in_group(user_id: int, group_id: int) -> bool:
             not_spammers_cache.add(user_id)
     # Возможно вернуть в suspicious если остались unseen записи
     # (упрощённо не добавляем обратно здесь — это можно расширить при необходимости)
+    if success:
+        publish_cache_event("clear_spammer", user_id, group_id, value=int(user_id in spammers_cache))
     logger.info(f"Cleared spammer flag for user {user_id} in group {group_id}.")
     return success
 
+def clear_spammer_everywhere(user_id: int) -> List[int]:
+    """Глобальный разбан: одна транзакция снимает spammer во всех группах пользователя и
+    ставит seen (доверие восстановлено), кэши исправляются один раз. Возвращает группы
+    (актуальные id), где флаг был снят. Ошибки БД пробрасываются вызывающему."""
+    # UPDATE должен видеть все отложенные вставки (иначе поздний flush вернёт spammer=TRUE);
+    # ошибка сброса прерывает разбан
+    flush_pending_writes()
+    raw_groups = get_storage().clear_spammer_everywhere(user_id)
+    spam_groups_index.discard_user(user_id)
+    cleared: List[int] = []
+    for gid in raw_groups:
+        _entry_cache_apply(user_id, gid, seen=True, spammer=False, insert=False)
+        resolved = resolve_group_id(gid)
+        if resolved != gid:
+            user_entry_cache.invalidate((user_id, resolved))
+        if resolved not in cleared:
+            cleared.append(resolved)
+    # Больше ни одной spammer-строки: отрицательный ответ можно кэшировать
+    spammers_cache.discard(user_id)
+    not_spammers_cache.add(user_id)
+    if cleared:
+        seen_users_cache.add(user_id)
+        not_seen_cache.discard(user_id)
+        suspicious_users_cache.discard(user_id)
+        publish_cache_event("unban", user_id)
+    logger.info(f"Cleared spammer flag for user {user_id} in groups {cleared}.")
+    return cleared
+
+def _merge_spam_groups(user_id: int, raw_groups) -> List[int]:
+    groups = []
+    for gid in raw_groups:
+        # Строки группы, которая ещё переносится на новый id, отдаём под новым id
+        gid = resolve_group_id(gid)
+        if gid not in groups:
+            groups.append(gid)
+    # Отложенные (ещё не сброшенные) пометки спамера тоже считаются
+    for gid in write_behind.pending_spam_groups(user_id):
+        if gid not in groups:
+            groups.append(gid)
+    return groups
+
 def groups_where_spammer(user_id: int) -> List[int]:
-    conn = None
-    cur = None
+    if spam_groups_index.ready:
+        return _merge_spam_groups(user_id, spam_groups_index.groups(user_id))
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT group_id FROM user_entries WHERE user_id=%s AND spammer=TRUE",
-            (user_id,),
-        )
-        rows = cur.fetchall()
-        return [int(row[0]) for row in rows if row and row[0] is not None]  # type: ignore[misc]
-    except mysql.connector.Error as err:
+        return _merge_spam_groups(user_id, get_storage().groups_where_spammer(user_id))
+    except DB_ERRORS as err:
         logger.exception(f"DB error groups_where_spammer({user_id}): {err}")
-        return []
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+        return write_behind.pending_spam_groups(user_id)
+
+def spam_group_count(user_id: int) -> int:
+    """Число групп, где пользователь помечен спамером (при готовом индексе — без БД)."""
+    return len(groups_where_spammer(user_id))
 
 def user_is_spammer_in_group(user_id: int, group_id: int) -> bool:
-    conn = None
-    cur = None
+    pending = write_behind.pending_entry(user_id, group_id)
+    if pending is not None and pending.spammer:
+        return True
+    if spam_groups_index.ready:
+        target = resolve_group_id(group_id)
+        return any(resolve_group_id(gid) == target for gid in spam_groups_index.groups(user_id))
+    cached = user_entry_cache.get((user_id, group_id))
+    if cached is not MISSING:
+        return bool(cached and cached[1])
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT 1 FROM user_entries WHERE user_id=%s AND group_id=%s AND spammer=TRUE LIMIT 1",
-            (user_id, group_id),
-        )
-        return cur.fetchone() is not None
-    except mysql.connector.Error as err:
+        return get_storage().spammer_in_group(user_id, group_id)
+    except DB_ERRORS as err:
         logger.exception(f"DB error user_is_spammer_in_group({user_id},{group_id}): {err}")
         return False
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+
+def _overlay_pending(entry: Optional[Tuple[bool, bool]], pending: Optional[PendingWrite]) -> Optional[Tuple[bool, bool]]:
+    """Применяет отложенную запись к (seen, spammer) так же, как это сделает upsert при сбросе."""
+    if pending is None:
+        return entry
+    base_seen, base_spammer = entry if entry is not None else (False, False)
+    seen = pending.seen if pending.seen is not None else base_seen
+    return bool(seen), bool(base_spammer or pending.spammer)
+
+def entry_already_in_state(user_id: int, group_id: int, seen: Optional[bool] = None, spammer: bool = False) -> bool:
+    """True, если строка (user_id, group_id) уже в запрошенном состоянии по памяти:
+    entry-кэш с наложенной очередью write-behind (или одна очередь — для флагов, которые
+    она задаёт). Незакэшированная строка — False: без БД состояние неизвестно."""
+    pending = write_behind.pending_entry(user_id, group_id)
+    cached = user_entry_cache.peek((user_id, group_id))
+    if cached is not MISSING:
+        entry = _overlay_pending(cached, pending)
+        if entry is None:
+            return False  # строки нет — запись её создаст
+        known_seen, known_spammer = entry
+    elif pending is not None:
+        known_seen, known_spammer = pending.seen, (True if pending.spammer else None)
+    else:
+        return False
+    if seen is not None and known_seen is not bool(seen):
+        return False
+    return not spammer or known_spammer is True
 
 def get_user_entry(user_id: int, group_id: int) -> Optional[Tuple[bool, bool]]:
-    """Return tuple (seen_message, spammer) or None if no record."""
-    conn = None
-    cur = None
+    """Return tuple (seen_message, spammer) or None if no record.
+    Незакоммиченные записи write-behind очереди накладываются поверх строки из БД."""
+    pending = write_behind.pending_entry(user_id, group_id)
+    if pending is not None and pending.seen is not None and pending.spammer:
+        return bool(pending.seen), True
+    key = (user_id, group_id)
+    cached = user_entry_cache.get(key)
+    if cached is not MISSING:
+        return _overlay_pending(cached, pending)
+    seq = user_entry_cache.write_seq
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT seen_message, spammer FROM user_entries WHERE user_id=%s AND group_id=%s LIMIT 1",
-            (user_id, group_id),
-        )
-        row = cur.fetchone()
-        if row is None:
-            return None
-        seen, spammer = row
-        return bool(seen), bool(spammer)
-    except mysql.connector.Error as err:
+        entry = _overlay_pending(get_storage().get_entry(user_id, group_id), pending)
+        user_entry_cache.fill(key, entry, seq)
+        return entry
+    except DB_ERRORS as err:
         logger.exception(f"DB error get_user_entry({user_id},{group_id}): {err}")
+        return _overlay_pending(None, pending)
+
+class UserState(NamedTuple):
+    """Состояние пользователя для классификации сообщения в группе.
+    spammer / seen — глобальные флаги (в любой группе); entry — (seen, spammer) в этой группе
+    или None, если записи нет. Для спамера entry не разрешается (не нужен) и равен None."""
+    spammer: bool
+    seen: bool
+    entry: Optional[Tuple[bool, bool]]
+
+
+def resolve_user_state_from_cache(user_id: int, group_id: int) -> Optional[UserState]:
+    """Ответ только из памяти или None, если без БД не обойтись."""
+    if user_id in spammers_cache:
+        return UserState(True, user_id in seen_users_cache, None)
+    if user_id not in not_spammers_cache and not (spam_groups_index.ready and user_id not in spam_groups_index):
         return None
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+    if user_id in seen_users_cache:
+        seen = True
+    elif user_id in not_seen_cache:
+        seen = False
+    else:
+        return None
+    pending = write_behind.pending_entry(user_id, group_id)
+    if pending is not None and pending.seen is not None and pending.spammer:
+        return UserState(False, seen, (bool(pending.seen), True))
+    entry = user_entry_cache.get((user_id, group_id))
+    if entry is not MISSING:
+        return UserState(False, seen, _overlay_pending(entry, pending))
+    return None
+
+
+def resolve_user_state(user_id: int, group_id: int) -> UserState:
+    """Глобальные флаги spammer/seen и запись (seen, spammer) этой группы за один запрос.
+    Если кэши уже знают ответ — без обращения к БД. Результат запроса прогревает
+    позитивные и negative кэши. При ошибке БД — эвристика по кэшам."""
+    cached = resolve_user_state_from_cache(user_id, group_id)
+    if cached is not None:
+        return cached
+    return _query_user_state(user_id, group_id)
+
+def _query_user_state(user_id: int, group_id: int) -> UserState:
+    global debug_counter_state_queries
+    debug_counter_state_queries += 1
+    pending = write_behind.pending_entry(user_id, group_id)
+    seq = user_entry_cache.write_seq
+    try:
+        spam_any, seen_any, entry = get_storage().user_state(user_id, group_id)
+    except DB_ERRORS as err:
+        logger.exception(f"DB error resolve_user_state({user_id},{group_id}): {err}")
+        return UserState(
+            user_id in spammers_cache,
+            user_id in seen_users_cache,
+            _overlay_pending(None, pending),
+        )
+    # Кэши (включая ещё не сброшенные записи) авторитетнее только что прочитанной строки
+    spammer = bool(spam_any) or user_id in spammers_cache
+    seen = bool(seen_any) or user_id in seen_users_cache
+    if spammer:
+        spammers_cache.add(user_id)
+        not_spammers_cache.discard(user_id)
+    else:
+        not_spammers_cache.add(user_id)
+    if seen:
+        seen_users_cache.add(user_id)
+        not_seen_cache.discard(user_id)
+    else:
+        not_seen_cache.add(user_id)
+    entry = _overlay_pending(entry, pending)
+    user_entry_cache.fill((user_id, group_id), entry, seq)
+    return UserState(spammer, seen, entry)
 
 # =================== Repository Pattern (advanced abstraction) ===================
 
 class UserStateRepository:
     """Высокоуровневый слой для операций со статусами пользователей.
-    Все обновления должны идти через него (постепенная миграция), чтобы кэш оставался консистентным."""
+    Все обновления должны идти через него (постепенная миграция), чтобы кэш оставался консистентным.
+    Старый id мигрировавшей группы переадресуется на новый (resolve_group_id).
+
+    Подавление записей (suppress_writes): mark_seen / mark_unseen / mark_spammer, чьё
+    состояние строки кэш уже знает (entry_already_in_state), не ходят в БД и не публикуют
+    событие — только обновляют глобальные кэши. write_stats считает executed / suppressed."""
+
+    WRITE_KINDS = ("seen", "unseen", "spammer")
+
+    def __init__(self, suppress_writes: bool = DB_WRITE_SUPPRESSION_ENABLED):
+        self.suppress_writes = suppress_writes
+        self.write_stats = {kind: {"executed": 0, "suppressed": 0} for kind in self.WRITE_KINDS}
+        self._stats_lock = threading.Lock()
+
+    def write_is_redundant(self, user_id: int, group_id: int, seen: Optional[bool] = None, spammer: bool = False) -> bool:
+        return self.suppress_writes and entry_already_in_state(user_id, group_id, seen, spammer)
+
+    def _suppressed(self, kind: str, user_id: int, group_id: int, seen: Optional[bool] = None, spammer: bool = False) -> bool:
+        redundant = self.write_is_redundant(user_id, group_id, seen, spammer)
+        with self._stats_lock:
+            self.write_stats[kind]["suppressed" if redundant else "executed"] += 1
+        return redundant
+
+    def get_write_stats(self) -> dict:
+        with self._stats_lock:
+            data = {kind: dict(counts) for kind, counts in self.write_stats.items()}
+        executed = sum(c["executed"] for c in data.values())
+        suppressed = sum(c["suppressed"] for c in data.values())
+        total = executed + suppressed
+        data["total"] = {"executed": executed, "suppressed": suppressed,
+                         "suppressed_rate": round(suppressed / total, 4) if total else None}
+        return data
 
     def is_spammer(self, user_id: int) -> bool:
         return user_has_spammer_anywhere(user_id)
@@ -720,35 +1055,146 @@ class UserStateRepository:
     def is_suspicious(self, user_id: int) -> bool:
         return (user_id in suspicious_users_cache) and (user_id not in spammers_cache)
 
+    def resolve_user_state(self, user_id: int, group_id: int) -> UserState:
+        group_id = resolve_group_id(group_id)
+        return resolve_user_state(user_id, group_id)
+
     def mark_spammer(self, user_id: int, group_id: int) -> bool:
+        group_id = resolve_group_id(group_id)
+        if self._suppressed("spammer", user_id, group_id, spammer=True):
+            _apply_spammer_caches(user_id)
+            spam_groups_index.add(user_id, group_id)
+            return True
         return mark_spammer_in_group(user_id, group_id)
 
     def mark_seen(self, user_id: int, group_id: int) -> bool:
+        group_id = resolve_group_id(group_id)
+        if self._suppressed("seen", user_id, group_id, seen=True):
+            _apply_seen_caches(user_id)
+            return True
         return mark_seen_in_group(user_id, group_id)
 
     def mark_unseen(self, user_id: int, group_id: int) -> bool:
+        group_id = resolve_group_id(group_id)
+        if self._suppressed("unseen", user_id, group_id, seen=False):
+            _apply_unseen_caches(user_id)
+            return True
         return mark_unseen_in_group(user_id, group_id)
 
     def clear_spammer(self, user_id: int, group_id: int) -> bool:
+        group_id = resolve_group_id(group_id)
         return clear_spammer_flag_in_group(user_id, group_id)
 
+    def clear_spammer_everywhere(self, user_id: int) -> List[int]:
+        return clear_spammer_everywhere(user_id)
+
     def groups_with_spam_flag(self, user_id: int):
         return groups_where_spammer(user_id)
 
+    def spam_group_count(self, user_id: int) -> int:
+        return len(self.groups_with_spam_flag(user_id))
+
     def entry(self, user_id: int, group_id: int):
+        group_id = resolve_group_id(group_id)
         return get_user_entry(user_id, group_id)
 
     def is_spammer_in_group(self, user_id: int, group_id: int) -> bool:
         """Precise per-group spammer flag check (DB-backed). Falls back to cache heuristic if DB inaccessible."""
+        group_id = resolve_group_id(group_id)
         try:
             return user_is_spammer_in_group(user_id, group_id)
         except Exception:
             return (user_id in spammers_cache)
 
 
+class AsyncUserStateRepository:
+    """Async-фасад над UserStateRepository для корутин-хендлеров.
+    Ответы, известные из кэшей, возвращаются сразу; блокирующие DB-вызовы выполняются
+    в ограниченном executor'е (get_db_executor), поэтому медленный запрос не останавливает
+    обработку апдейтов других групп. Методы синхронного репозитория вызываются через
+    атрибуты экземпляра, так что его подмена (DI / тесты) действует и здесь."""
+
+    def __init__(self, repo: UserStateRepository):
+        self._repo = repo
+
+    @property
+    def sync(self) -> UserStateRepository:
+        return self._repo
+
+    async def is_spammer(self, user_id: int) -> bool:
+        if user_id in spammers_cache:
+            return True
+        if spam_groups_index.ready:
+            return self._repo.is_spammer(user_id)
+        return await run_db(self._repo.is_spammer, user_id)
+
+    async def is_seen(self, user_id: int) -> bool:
+        if user_id in seen_users_cache:
+            return True
+        return await run_db(self._repo.is_seen, user_id)
+
+    async def is_suspicious(self, user_id: int) -> bool:
+        # Только кэши, без I/O
+        return self._repo.is_suspicious(user_id)
+
+    async def resolve_user_state(self, user_id: int, group_id: int) -> UserState:
+        group_id = resolve_group_id(group_id)
+        cached = resolve_user_state_from_cache(user_id, group_id)
+        if cached is not None:
+            return cached
+        return await run_db(_query_user_state, user_id, group_id)
+
+    # Избыточная запись (состояние уже в кэше) выполняется на месте, без перехода в executor
+
+    async def mark_spammer(self, user_id: int, group_id: int) -> bool:
+        if self._repo.write_is_redundant(user_id, resolve_group_id(group_id), spammer=True):
+            return self._repo.mark_spammer(user_id, group_id)
+        return await run_db(self._repo.mark_spammer, user_id, group_id)
+
+    async def mark_seen(self, user_id: int, group_id: int) -> bool:
+        if self._repo.write_is_redundant(user_id, resolve_group_id(group_id), seen=True):
+            return self._repo.mark_seen(user_id, group_id)
+        return await run_db(self._repo.mark_seen, user_id, group_id)
+
+    async def mark_unseen(self, user_id: int, group_id: int) -> bool:
+        if self._repo.write_is_redundant(user_id, resolve_group_id(group_id), seen=False):
+            return self._repo.mark_unseen(user_id, group_id)
+        return await run_db(self._repo.mark_unseen, user_id, group_id)
+
+    async def clear_spammer(self, user_id: int, group_id: int) -> bool:
+        return await run_db(self._repo.clear_spammer, user_id, group_id)
+
+    async def clear_spammer_everywhere(self, user_id: int) -> List[int]:
+        return await run_db(self._repo.clear_spammer_everywhere, user_id)
+
+    async def groups_with_spam_flag(self, user_id: int) -> List[int]:
+        # Готовый индекс групп спамеров отвечает из памяти — executor не нужен
+        if spam_groups_index.ready:
+            return self._repo.groups_with_spam_flag(user_id)
+        return await run_db(self._repo.groups_with_spam_flag, user_id)
+
+    async def spam_group_count(self, user_id: int) -> int:
+        return len(await self.groups_with_spam_flag(user_id))
+
+    async def entry(self, user_id: int, group_id: int) -> Optional[Tuple[bool, bool]]:
+        return await run_db(self._repo.entry, user_id, group_id)
+
+    async def is_spammer_in_group(self, user_id: int, group_id: int) -> bool:
+        if spam_groups_index.ready:
+            return self._repo.is_spammer_in_group(user_id, group_id)
+        return await run_db(self._repo.is_spammer_in_group, user_id, group_id)
+
+
 # Singleton instance (можно заменить фабрикой при DI)
 user_state_repo = UserStateRepository()
+async_user_state_repo = AsyncUserStateRepository(user_state_repo)
 
 def get_user_state_repo() -> UserStateRepository:
     return user_state_repo
 
+def get_async_user_state_repo() -> AsyncUserStateRepository:
+    return async_user_state_repo
+
+def get_write_suppression_stats() -> dict:
+    return user_state_repo.get_write_stats()
+
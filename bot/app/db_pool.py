@@ -0,0 +1,292 @@
+"""Ограниченный пул соединений MySQL с проверкой здоровья.
+
+Каждый helper в database.py раньше открывал новое соединение (TCP + auth handshake)
+на каждый запрос. Пул переиспользует соединения: `acquire()` выдаёт обёртку, чей
+`close()` возвращает соединение в пул, поэтому существующие call sites
+(`conn = get_db_connection(); ...; conn.close()`) менять не нужно.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+import mysql.connector
+from mysql.connector import errors as mysql_errors
+
+
+class _PoolSlot:
+    """Физическое соединение + метаданные для recycle-политики."""
+
+    __slots__ = ("raw", "created_at", "last_used")
+
+    def __init__(self, raw: Any):
+        now = time.monotonic()
+        self.raw = raw
+        self.created_at = now
+        self.last_used = now
+
+
+class PooledConnection:
+    """Обёртка над соединением из пула. close() возвращает соединение в пул (идемпотентно)."""
+
+    def __init__(self, pool: "ConnectionPool", slot: _PoolSlot):
+        self._pool = pool
+        self._slot: Optional[_PoolSlot] = slot
+        self._broken = False
+
+    def _raw(self):
+        if self._slot is None:
+            raise mysql_errors.OperationalError("Connection already returned to pool")
+        return self._slot.raw
+
+    def cursor(self, *args, **kwargs):
+        try:
+            return _PooledCursor(self, self._raw().cursor(*args, **kwargs))
+        except (mysql_errors.OperationalError, mysql_errors.InterfaceError):
+            self._broken = True
+            raise
+
+    def commit(self):
+        try:
+            return self._raw().commit()
+        except (mysql_errors.OperationalError, mysql_errors.InterfaceError):
+            self._broken = True
+            raise
+
+    def rollback(self):
+        return self._raw().rollback()
+
+    def close(self):
+        slot, self._slot = self._slot, None
+        if slot is not None:
+            self._pool._release(slot, broken=self._broken)
+
+    def __getattr__(self, item):
+        # Прозрачно проксируем остальные атрибуты (in_transaction, start_transaction, ...)
+        return getattr(self._raw(), item)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and isinstance(exc, (mysql_errors.OperationalError, mysql_errors.InterfaceError)):
+            self._broken = True
+        self.close()
+        return False
+
+
+class _PooledCursor:
+    """Прокси курсора: помечает соединение битым при сетевых ошибках выполнения запроса."""
+
+    __slots__ = ("_owner", "_cursor")
+
+    def __init__(self, owner: PooledConnection, cursor: Any):
+        self._owner = owner
+        self._cursor = cursor
+
+    def execute(self, *args, **kwargs):
+        try:
+            return self._cursor.execute(*args, **kwargs)
+        except (mysql_errors.OperationalError, mysql_errors.InterfaceError):
+            self._owner._broken = True
+            raise
+
+    def executemany(self, *args, **kwargs):
+        try:
+            return self._cursor.executemany(*args, **kwargs)
+        except (mysql_errors.OperationalError, mysql_errors.InterfaceError):
+            self._owner._broken = True
+            raise
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, item):
+        return getattr(self._cursor, item)
+
+
+class ConnectionPool:
+    """Потокобезопасный пул с верхней границей размера.
+
+    - size: максимум одновременно открытых соединений; при исчерпании acquire() ждёт
+      до acquire_timeout секунд, затем бросает mysql.connector.errors.PoolError
+      (подкласс mysql.connector.Error — существующие except-блоки его ловят).
+    - max_idle / max_lifetime: соединения, простоявшие или прожившие дольше, пересоздаются.
+    - ping_interval: соединения, простоявшие дольше, перед выдачей проверяются ping'ом;
+      битые отбрасываются и заменяются новыми.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        size: int = 8,
+        acquire_timeout: float = 5.0,
+        max_idle: float = 300.0,
+        max_lifetime: float = 3600.0,
+        ping_interval: float = 30.0,
+    ):
+        self._connect = connect
+        self.size = max(1, int(size))
+        self.acquire_timeout = acquire_timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self._idle: Deque[_PoolSlot] = deque()
+        self._open = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {
+            "created": 0,
+            "reused": 0,
+            "recycled": 0,
+            "broken": 0,
+            "connect_errors": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "acquired": 0,
+            "wait_seconds_total": 0.0,
+        }
+
+    # ----- checkout / checkin -----
+
+    def acquire(self) -> PooledConnection:
+        deadline = time.monotonic() + self.acquire_timeout
+        waited = False
+        started = time.monotonic()
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise mysql_errors.PoolError("Connection pool is closed")
+                if self._idle:
+                    slot = self._idle.pop()  # LIFO: самое «тёплое» соединение
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    slot = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise mysql_errors.PoolError(
+                        f"Timed out after {self.acquire_timeout}s waiting for a DB connection (pool size {self.size})"
+                    )
+                if not waited:
+                    waited = True
+                    self._stats["waits"] += 1
+                self._cond.wait(remaining)
+            if waited:
+                self._stats["wait_seconds_total"] += time.monotonic() - started
+        # Сетевые операции (connect / ping) выполняем вне блокировки.
+        try:
+            if slot is None:
+                slot = self._new_slot()
+            else:
+                slot = self._checked(slot)
+        except BaseException:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats["acquired"] += 1
+        return PooledConnection(self, slot)
+
+    def _new_slot(self) -> _PoolSlot:
+        try:
+            raw = self._connect()
+        except BaseException:
+            with self._cond:
+                self._stats["connect_errors"] += 1
+            raise
+        with self._cond:
+            self._stats["created"] += 1
+        return _PoolSlot(raw)
+
+    def _checked(self, slot: _PoolSlot) -> _PoolSlot:
+        """Проверка/пересоздание соединения из idle-очереди перед выдачей."""
+        now = time.monotonic()
+        if (now - slot.created_at) > self.max_lifetime or (now - slot.last_used) > self.max_idle:
+            self._discard(slot.raw)
+            with self._cond:
+                self._stats["recycled"] += 1
+            return self._new_slot()
+        if (now - slot.last_used) > self.ping_interval and not self._is_alive(slot.raw):
+            self._discard(slot.raw)
+            with self._cond:
+                self._stats["broken"] += 1
+            return self._new_slot()
+        with self._cond:
+            self._stats["reused"] += 1
+        return slot
+
+    @staticmethod
+    def _is_alive(raw) -> bool:
+        try:
+            ping = getattr(raw, "ping", None)
+            if ping is not None:
+                ping(reconnect=False)
+                return True
+            return bool(raw.is_connected())
+        except Exception:
+            return False
+
+    @staticmethod
+    def _discard(raw) -> None:
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _release(self, slot: _PoolSlot, broken: bool = False) -> None:
+        raw = slot.raw
+        if not broken:
+            # Незакрытую транзакцию откатываем, непрочитанные результаты дочитываем,
+            # чтобы следующий владелец получил «чистое» соединение.
+            try:
+                if getattr(raw, "unread_result", False):
+                    raw.consume_results()
+                if getattr(raw, "in_transaction", False):
+                    raw.rollback()
+            except Exception:
+                broken = True
+        if broken or self._closed:
+            self._discard(raw)
+        with self._cond:
+            if broken:
+                self._stats["broken"] += 1
+            if broken or self._closed:
+                self._open -= 1
+            else:
+                slot.last_used = time.monotonic()
+                self._idle.append(slot)
+            self._cond.notify()
+
+    # ----- lifecycle / introspection -----
+
+    def close(self) -> None:
+        """Закрывает idle-соединения; выданные закроются при возврате."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for slot in idle:
+            self._discard(slot.raw)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            data: Dict[str, Any] = dict(self._stats)
+            data["size"] = self.size
+            data["open"] = self._open
+            data["idle"] = len(self._idle)
+            data["in_use"] = self._open - len(self._idle)
+        data["wait_seconds_total"] = round(data["wait_seconds_total"], 6)
+        return data
+
+
+def mysql_connect_factory(config: Dict[str, Any]) -> Callable[[], Any]:
+    """Фабрика физических соединений MySQL по DB_CONFIG."""
+    def _connect():
+        return mysql.connector.connect(**config)
+    return _connect
@@ -0,0 +1,291 @@
+"""Перенос данных группы на новый chat_id (миграция группы в супергруппу).
+
+При ChatMigrated send_safe только запоминает переадресацию old -> new (database.group_redirects
+и строка в group_migrations) и ставит задание в очередь: последующие отправки, баны и
+проверки по старому id сразу идут на новый, без повторного ChatMigrated.
+
+Строки переносит фоновый поток: `groups` / group_settings одним коротким запросом,
+user_entries — порциями по первичному ключу (GROUP_MIGRATION_CHUNK_SIZE), каждая порция
+в своей транзакции. Если пользователь уже есть в новой группе, флаги сливаются (OR) в его
+строку, а старая удаляется. Перенесённые строки уже имеют новый group_id, поэтому задание,
+прерванное остановкой или падением (done = FALSE), при следующем старте продолжается
+с оставшихся строк.
+
+SQLite / in-memory backend (storage.py) записывают переадресацию и переносят группу одной
+транзакцией StorageBackend.move_group, и record_group_migration делает это сразу: переадресации
+без перенесённых строк (и незавершённых заданий) у них не бывает.
+"""
+
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import mysql.connector
+
+from . import database
+from .config import GROUP_MIGRATION_CHUNK_SIZE, GROUP_MIGRATION_PAUSE_MS, GROUP_MIGRATION_RETRY_SECONDS
+from .logging_setup import logger
+
+
+def _upsert_job(cur, old_id: int, new_id: int) -> None:
+    cur.execute(
+        "INSERT INTO group_migrations (old_group_id, new_group_id) VALUES (%s, %s) "
+        "ON DUPLICATE KEY UPDATE new_group_id = VALUES(new_group_id)",
+        (old_id, new_id),
+    )
+
+
+def record_group_migration(old_id: int, new_id: int) -> None:
+    """Сохраняет переадресацию и задание переноса (одна строка). Ошибки БД пробрасываются.
+    Не-MySQL backend переносит группу сразу, вместе с переадресацией."""
+    if database.get_storage().kind != "mysql":
+        migrate_group_rows(old_id, new_id)
+        return
+    conn = None
+    cur = None
+    try:
+        conn = database.get_db_connection()
+        cur = conn.cursor()
+        _upsert_job(cur, old_id, new_id)
+        cur.execute("UPDATE group_migrations SET done = FALSE WHERE old_group_id = %s", (old_id,))
+        conn.commit()
+        # Другие воркеры сразу начинают переадресовывать старый id
+        database.publish_cache_event("group_migrated", group_id=old_id, value=new_id)
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+def pending_group_migrations() -> List[Tuple[int, int]]:
+    """Незавершённые задания [(old_id, new_id)] в порядке создания."""
+    if database.get_storage().kind != "mysql":
+        return []
+    conn = None
+    cur = None
+    try:
+        conn = database.get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT old_group_id, new_group_id FROM group_migrations WHERE done = FALSE ORDER BY created_at")
+        return [(int(row[0]), int(row[1])) for row in cur.fetchall()]
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+def _move_group_tables(cur, old_id: int, new_id: int) -> None:
+    # Строки новой группы могли появиться раньше (бот уже получил апдейт из супергруппы):
+    # они сохраняются, старые дубликаты удаляются
+    cur.execute("UPDATE IGNORE `groups` SET group_id = %s WHERE group_id = %s", (new_id, old_id))
+    cur.execute("DELETE FROM `groups` WHERE group_id = %s", (old_id,))
+    cur.execute("UPDATE IGNORE group_settings SET group_id = %s WHERE group_id = %s", (new_id, old_id))
+    cur.execute("DELETE FROM group_settings WHERE group_id = %s", (old_id,))
+
+
+def _move_user_entries_chunk(cur, old_id: int, new_id: int, chunk_size: int) -> int:
+    """Переносит до chunk_size строк старой группы; возвращает число обработанных строк."""
+    cur.execute("SELECT id FROM user_entries WHERE group_id = %s ORDER BY id LIMIT %s", (old_id, chunk_size))
+    ids = [int(row[0]) for row in cur.fetchall()]
+    if not ids:
+        return 0
+    placeholders = ", ".join(["%s"] * len(ids))
+    # Пользователь уже есть в новой группе: флаги сливаются в его строку, старая удаляется
+    cur.execute(
+        "UPDATE user_entries n JOIN user_entries o ON o.user_id = n.user_id AND n.group_id = %s "
+        "SET n.seen_message = (n.seen_message OR o.seen_message), n.spammer = (n.spammer OR o.spammer) "
+        f"WHERE o.id IN ({placeholders})",
+        (new_id, *ids),
+    )
+    cur.execute(
+        "DELETE o FROM user_entries o JOIN user_entries n ON n.user_id = o.user_id AND n.group_id = %s "
+        f"WHERE o.id IN ({placeholders})",
+        (new_id, *ids),
+    )
+    cur.execute(
+        f"UPDATE user_entries SET group_id = %s WHERE id IN ({placeholders}) AND group_id = %s",
+        (new_id, *ids, old_id),
+    )
+    return len(ids)
+
+
+def migrate_group_rows(old_id: int, new_id: int, chunk_size: int = GROUP_MIGRATION_CHUNK_SIZE,
+                       pause: float = GROUP_MIGRATION_PAUSE_MS / 1000.0,
+                       stop: Optional[threading.Event] = None) -> Optional[int]:
+    """Переносит все строки группы old_id на new_id; возвращает число строк user_entries
+    или None, если перенос прерван через stop (продолжится при следующем запуске).
+    Ошибки БД пробрасываются: незакоммиченная порция откатывается, готовые остаются."""
+    # Отложенные строки со старым id должны попасть в БД до переноса
+    database.flush_pending_writes()
+    storage = database.get_storage()
+    if storage.kind != "mysql":
+        try:
+            total = storage.move_group(old_id, new_id)
+        finally:
+            database.invalidate_group_entries(old_id)
+            database.invalidate_group_entries(new_id)
+        database.publish_cache_event("group_migrated", group_id=old_id, value=new_id)
+        return total
+    chunk_size = max(1, int(chunk_size))
+    conn = None
+    cur = None
+    total = 0
+    try:
+        conn = database.get_db_connection()
+        cur = conn.cursor()
+        _upsert_job(cur, old_id, new_id)
+        _move_group_tables(cur, old_id, new_id)
+        conn.commit()
+        while True:
+            if stop is not None and stop.is_set():
+                return None
+            moved = _move_user_entries_chunk(cur, old_id, new_id, chunk_size)
+            if moved:
+                cur.execute(
+                    "UPDATE group_migrations SET rows_moved = rows_moved + %s WHERE old_group_id = %s",
+                    (moved, old_id),
+                )
+            conn.commit()
+            total += moved
+            if moved < chunk_size:
+                break
+            if pause > 0:
+                # Пауза между порциями — место для конкурирующих запросов к таблице
+                if stop is not None:
+                    stop.wait(pause)
+                else:
+                    time.sleep(pause)
+        cur.execute("UPDATE group_migrations SET done = TRUE WHERE old_group_id = %s", (old_id,))
+        conn.commit()
+        database.publish_cache_event("group_migrated", group_id=old_id, value=new_id)
+        return total
+    except mysql.connector.Error:
+        if conn:
+            try:
+                conn.rollback()
+            except mysql.connector.Error:
+                pass
+        raise
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+        # Записи обеих групп в entry-кэше больше не соответствуют БД
+        database.invalidate_group_entries(old_id)
+        database.invalidate_group_entries(new_id)
+
+
+class GroupMigrationWorker:
+    """Очередь заданий {old_id: new_id} и поток, выполняющий их по одному.
+    При старте подхватывает незавершённые задания из group_migrations."""
+
+    def __init__(self, chunk_size: int, pause: float, retry_delay: float):
+        self.chunk_size = max(1, int(chunk_size))
+        self.pause = pause
+        self.retry_delay = retry_delay
+        self._jobs: Dict[int, int] = {}
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"submitted": 0, "completed": 0, "rows": 0, "errors": 0}
+
+    def submit(self, old_id: int, new_id: int) -> None:
+        with self._cond:
+            self._jobs[old_id] = new_id
+            self.stats["submitted"] += 1
+            self._cond.notify()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._jobs)
+
+    def run_once(self) -> bool:
+        """Выполняет первое задание очереди; False — очередь пуста или перенос прерван.
+        Ошибки БД пробрасываются, задание остаётся в очереди."""
+        with self._cond:
+            if not self._jobs:
+                return False
+            old_id, new_id = next(iter(self._jobs.items()))
+        moved = migrate_group_rows(old_id, new_id, self.chunk_size, self.pause, self._stop)
+        if moved is None:
+            return False
+        with self._cond:
+            if self._jobs.get(old_id) == new_id:
+                del self._jobs[old_id]
+        self.stats["completed"] += 1
+        self.stats["rows"] += moved
+        logger.info(f"Group migration {old_id} -> {new_id} finished ({moved} user_entries rows).")
+        return True
+
+    # ----- фоновый поток -----
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="group-migration", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        with self._cond:
+            self._stop.set()
+            self._cond.notify_all()
+        thread.join()
+
+    def _resume(self) -> None:
+        try:
+            jobs = pending_group_migrations()
+        except database.DB_ERRORS as e:
+            logger.warning(f"Could not load unfinished group migrations: {e}")
+            return
+        for old_id, new_id in jobs:
+            logger.info(f"Resuming group migration {old_id} -> {new_id}.")
+            self.submit(old_id, new_id)
+
+    def _run(self) -> None:
+        self._resume()
+        while not self._stop.is_set():
+            with self._cond:
+                while not self._jobs and not self._stop.is_set():
+                    self._cond.wait()
+            if self._stop.is_set():
+                return
+            try:
+                self.run_once()
+            except database.DB_ERRORS as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Group migration failed, retrying in {self.retry_delay}s: {e}")
+                self._stop.wait(self.retry_delay)
+
+    def snapshot_stats(self) -> dict:
+        data = dict(self.stats)
+        data["active"] = self.active
+        data["pending"] = self.pending()
+        data["redirects"] = len(database.group_redirects)
+        return data
+
+
+group_migrator = GroupMigrationWorker(GROUP_MIGRATION_CHUNK_SIZE, GROUP_MIGRATION_PAUSE_MS / 1000.0, GROUP_MIGRATION_RETRY_SECONDS)
+
+
+def start_group_migrator() -> bool:
+    group_migrator.start()
+    return True
+
+
+def stop_group_migrator() -> None:
+    group_migrator.stop()
+
+
+def get_group_migration_stats() -> dict:
+    return group_migrator.snapshot_stats()
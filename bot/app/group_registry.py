@@ -0,0 +1,188 @@
+"""Реестр настроенных групп с доступом по group_id за O(1).
+
+Раньше configured_groups_cache был списком [{group_id, settings}], и каждое сообщение
+искало в нём свою группу перебором. GroupRegistry хранит те же записи в словаре по
+group_id и рядом — предвычисленные данные группы (GroupInfo: инструкции с учётом
+значения по умолчанию, права бота из my_chat_member).
+
+Запись — copy-on-write: мутация собирает новые словари под блокировкой и подменяет их
+одной операцией присваивания, читатели обходятся без блокировки и всегда видят
+согласованный снимок. Для совместимости реестр ведёт себя как прежний список:
+итерация отдаёт dict-записи, работают append/remove/clear/len/[:] = [...] и сравнение
+со списком.
+"""
+
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+
+class GroupInfo(NamedTuple):
+    group_id: int
+    settings: Dict[str, Any]
+    instructions: str
+    bot_status: Optional[str]  # administrator / member / None (неизвестно)
+    bot_rights: Dict[str, bool]  # can_delete_messages, can_restrict_members, ...
+
+
+class GroupRegistry:
+    """Настроенные группы по group_id. Записи — dict {group_id, settings}; менять их
+    нужно через методы реестра, чтобы предвычисленные данные оставались актуальными."""
+
+    def __init__(self, default_instructions: str = ""):
+        self.default_instructions = default_instructions
+        self._lock = threading.Lock()
+        # (записи, GroupInfo, права бота) — подменяются целиком
+        self._state: Tuple[Dict[int, dict], Dict[int, GroupInfo], Dict[int, tuple]] = ({}, {}, {})
+
+    def _info(self, entry: dict, rights: Optional[tuple]) -> GroupInfo:
+        settings = entry.get("settings") or {}
+        status, bot_rights = rights if rights is not None else (None, {})
+        return GroupInfo(
+            group_id=entry["group_id"],
+            settings=settings,
+            instructions=settings.get("instructions") or self.default_instructions,
+            bot_status=status,
+            bot_rights=bot_rights,
+        )
+
+    def _commit(self, groups: Dict[int, dict], rights: Dict[int, tuple], changed: Optional[Iterable[int]] = None) -> None:
+        """changed — группы, чьи производные данные нужно пересчитать (None — все)."""
+        if changed is None:
+            infos = {gid: self._info(entry, rights.get(gid)) for gid, entry in groups.items()}
+        else:
+            old_infos = self._state[1]
+            infos = {gid: info for gid, info in old_infos.items() if gid in groups}
+            for gid in changed:
+                if gid in groups:
+                    infos[gid] = self._info(groups[gid], rights.get(gid))
+        self._state = (groups, infos, rights)
+
+    # ----- чтение (без блокировки) -----
+
+    def get(self, group_id: int) -> Optional[dict]:
+        return self._state[0].get(group_id)
+
+    def info(self, group_id: int) -> Optional[GroupInfo]:
+        return self._state[1].get(group_id)
+
+    def settings(self, group_id: int) -> Dict[str, Any]:
+        info = self._state[1].get(group_id)
+        return info.settings if info is not None else {}
+
+    def instructions(self, group_id: int) -> str:
+        info = self._state[1].get(group_id)
+        return info.instructions if info is not None else self.default_instructions
+
+    def ids(self) -> List[int]:
+        return list(self._state[0])
+
+    # ----- запись -----
+
+    def upsert(self, group_id: int, settings: Optional[Dict[str, Any]] = None) -> dict:
+        """Добавляет группу или заменяет её настройки; возвращает запись."""
+        entry = {"group_id": group_id, "settings": dict(settings or {})}
+        with self._lock:
+            groups, _infos, rights = self._state
+            groups = dict(groups)
+            groups[group_id] = entry
+            self._commit(groups, rights, (group_id,))
+        return entry
+
+    def set_setting(self, group_id: int, parameter: str, value: Any) -> None:
+        with self._lock:
+            groups, _infos, rights = self._state
+            if group_id not in groups:
+                return
+            groups = dict(groups)
+            entry = groups[group_id]
+            groups[group_id] = {"group_id": group_id, "settings": {**(entry.get("settings") or {}), parameter: value}}
+            self._commit(groups, rights, (group_id,))
+
+    def discard(self, group_id: int) -> bool:
+        with self._lock:
+            groups, _infos, rights = self._state
+            if group_id not in groups:
+                return False
+            groups = dict(groups)
+            del groups[group_id]
+            rights = {gid: r for gid, r in rights.items() if gid != group_id}
+            self._commit(groups, rights, ())
+            return True
+
+    def rekey(self, old_id: int, new_id: int) -> bool:
+        """Переносит группу на новый id (миграция в супергруппу); настройки новой группы,
+        если она уже есть, не перезаписываются."""
+        with self._lock:
+            groups, _infos, rights = self._state
+            if old_id not in groups:
+                return False
+            groups = dict(groups)
+            entry = groups.pop(old_id)
+            if new_id not in groups:
+                groups[new_id] = {"group_id": new_id, "settings": dict(entry.get("settings") or {})}
+            rights = dict(rights)
+            if old_id in rights:
+                rights.setdefault(new_id, rights.pop(old_id))
+            self._commit(groups, rights, (new_id,))
+            return True
+
+    def set_bot_rights(self, group_id: int, status: Optional[str], **rights: bool) -> None:
+        """Статус и права бота в группе (из my_chat_member); сохраняются при перезагрузке настроек."""
+        with self._lock:
+            groups, _infos, all_rights = self._state
+            all_rights = dict(all_rights)
+            all_rights[group_id] = (status, dict(rights))
+            self._commit(groups, all_rights, (group_id,))
+
+    def replace(self, entries: Iterable[dict]) -> None:
+        """Атомарная замена всего набора (перезагрузка из БД, восстановление снимка)."""
+        groups = {}
+        for entry in entries:
+            gid = entry["group_id"]
+            groups[gid] = {"group_id": gid, "settings": dict(entry.get("settings") or {})}
+        with self._lock:
+            _groups, _infos, rights = self._state
+            self._commit(groups, {gid: r for gid, r in rights.items() if gid in groups})
+
+    # ----- совместимость со списком [{group_id, settings}] -----
+
+    def append(self, entry: dict) -> None:
+        self.upsert(entry["group_id"], entry.get("settings"))
+
+    def remove(self, entry: dict) -> None:
+        if not self.discard(entry["group_id"]):
+            raise ValueError(f"group {entry['group_id']} is not configured")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._state = ({}, {}, {})
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(list(self._state[0].values()))
+
+    def __len__(self) -> int:
+        return len(self._state[0])
+
+    def __contains__(self, item) -> bool:
+        group_id = item.get("group_id") if isinstance(item, dict) else item
+        return group_id in self._state[0]
+
+    def __getitem__(self, index):
+        return list(self._state[0].values())[index]
+
+    def __setitem__(self, index, entries) -> None:
+        if not isinstance(index, slice) or index != slice(None):
+            raise TypeError("GroupRegistry supports only full-slice assignment: registry[:] = entries")
+        self.replace(entries)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, GroupRegistry):
+            other = list(other)
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"GroupRegistry({list(self)!r})"
@@ -0,0 +1,362 @@
+"""Локальный классификатор спама до запроса к OpenAI.
+
+Логистическая регрессия по хэшированным символьным n-граммам (2-4) нормализованного
+текста, на NumPy. Обучается офлайн на истории classification_history: вердиктах OpenAI
+с поправками админа (/ban — спам, /unban — не спам для более ранних сообщений
+пользователя). В боте уверенные оценки решают сами, неуверенные (между
+CLASSIFIER_HAM_THRESHOLD и CLASSIFIER_SPAM_THRESHOLD) уходят в OpenAI.
+
+Модель применяется только к группам с теми инструкциями, на вердиктах по которым
+она обучена: «спам» зависит от правил группы.
+
+Файл модели — .npz (np.savez_compressed, без pickle): weights float32[n_features],
+bias float64[1], meta — JSON-строка (format, n_features, ngram_sizes, scopes, метрики).
+
+Обучение и оценка (из каталога bot/, БД — из обычных переменных окружения):
+    python -m app.local_classifier train --out /data/classifier.npz
+    python -m app.local_classifier evaluate --model /data/classifier.npz
+Задержка и согласие с OpenAI: python -m app.bench classifier --model /data/classifier.npz
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from . import database
+from .config import (
+    CLASSIFIER_HAM_THRESHOLD, CLASSIFIER_HISTORY_ENABLED, CLASSIFIER_HISTORY_RETENTION_DAYS, CLASSIFIER_MODEL_PATH,
+    CLASSIFIER_SPAM_THRESHOLD,
+)
+from .logging_setup import logger
+
+MODEL_FORMAT = 1
+DEFAULT_FEATURE_BITS = 18
+DEFAULT_NGRAM_SIZES = (2, 3, 4)
+
+# (текст, вердикт, хэш инструкций | None)
+Sample = Tuple[str, bool, Optional[bytes]]
+
+_URL = re.compile(r"(?:https?://|www\.|t\.me/)\S+", re.IGNORECASE)
+_MENTION = re.compile(r"@\w+")
+_DIGITS = re.compile(r"\d+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Ссылки, упоминания и числа — в общие метки; эмодзи и пунктуация остаются признаками."""
+    text = _URL.sub(" \x01 ", text.casefold())
+    text = _MENTION.sub(" \x02 ", text)
+    text = _DIGITS.sub("0", text)
+    return " " + _WHITESPACE.sub(" ", text).strip() + " "
+
+
+def feature_indices(text: str, n_features: int, ngram_sizes: Sequence[int] = DEFAULT_NGRAM_SIZES) -> np.ndarray:
+    """Уникальные индексы признаков: crc32 n-граммы по модулю n_features (стабильно между процессами)."""
+    norm = normalize_text(text)
+    grams = {norm[i:i + n] for n in ngram_sizes for i in range(len(norm) - n + 1)}
+    return np.unique(np.fromiter((zlib.crc32(g.encode("utf-8")) % n_features for g in grams),
+                                 dtype=np.int64, count=len(grams)))
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -35.0, 35.0)))
+
+
+class LocalClassifier:
+    def __init__(self, weights: np.ndarray, bias: float, meta: Dict[str, Any]):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+        self.meta = dict(meta)
+        self.n_features = int(self.meta.get("n_features", len(self.weights)))
+        self.ngram_sizes = tuple(self.meta.get("ngram_sizes", DEFAULT_NGRAM_SIZES))
+        self.scopes: Set[str] = set(self.meta.get("scopes", ()))
+
+    def applies_to(self, instructions_hash: Optional[bytes]) -> bool:
+        return instructions_hash is not None and instructions_hash.hex() in self.scopes
+
+    def score(self, text: str) -> float:
+        """Вероятность спама 0..1; 0.5 для текста без признаков."""
+        idx = feature_indices(text, self.n_features, self.ngram_sizes)
+        if not len(idx):
+            return 0.5
+        z = float(self.weights[idx].sum()) / math.sqrt(len(idx)) + self.bias
+        return float(_sigmoid(z))
+
+    def save(self, path: str) -> None:
+        """Атомарно (tmp + rename) записывает .npz."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as fh:
+            np.savez_compressed(fh, weights=self.weights, bias=np.array([self.bias]),
+                                meta=np.array(json.dumps(self.meta, ensure_ascii=False)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LocalClassifier":
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("format") != MODEL_FORMAT:
+                raise ValueError(f"unsupported classifier model format {meta.get('format')!r}")
+            weights = data["weights"]
+            bias = float(data["bias"][0])
+        if len(weights) != int(meta["n_features"]):
+            raise ValueError("classifier weights do not match n_features")
+        return cls(weights, bias, meta)
+
+
+# ===== Обучение =====
+
+def build_training_set(chunks: Iterable[Sequence[tuple]]) -> List[Sample]:
+    """Обучающие примеры из порций scan_classifications().
+
+    Исправление админа перекрывает вердикт OpenAI для более ранних сообщений пользователя
+    (/ban — в той группе, /unban — во всех: group_id 0). Одинаковые нормализованные тексты
+    схлопываются (волна спама не должна доминировать), побеждает последний вердикт.
+    """
+    messages = []
+    corrections: Dict[int, list] = {}
+    for chunk in chunks:
+        for user_id, group_id, instructions_hash, text, is_spam, source, created_at in chunk:
+            if source == "llm" and text:
+                messages.append((user_id, group_id, instructions_hash, text, bool(is_spam), created_at))
+            elif source in ("ban", "unban"):
+                corrections.setdefault(user_id, []).append((created_at, group_id, bool(is_spam)))
+    samples: Dict[Tuple[str, Optional[bytes]], Sample] = {}
+    for user_id, group_id, instructions_hash, text, label, created_at in messages:
+        for fixed_at, fixed_group, fixed_label in corrections.get(user_id, ()):
+            if fixed_at >= created_at and fixed_group in (0, group_id):
+                label = fixed_label
+        samples[(normalize_text(text), instructions_hash)] = (text, label, instructions_hash)
+    return list(samples.values())
+
+
+def train(samples: Sequence[Sample], feature_bits: int = DEFAULT_FEATURE_BITS, epochs: int = 8,
+          learning_rate: float = 0.5, l2: float = 1e-6, batch_size: int = 64, seed: int = 1) -> LocalClassifier:
+    """Мини-батчевый SGD логистической регрессии с балансировкой классов."""
+    n_features = 1 << int(feature_bits)
+    rows = [(feature_indices(text, n_features), float(label)) for text, label, _ in samples]
+    rows = [(idx, y) for idx, y in rows if len(idx)]
+    if not rows or len({y for _, y in rows}) < 2:
+        raise ValueError("training needs both spam and non-spam samples")
+    labels = np.array([y for _, y in rows])
+    n_spam = float(labels.sum())
+    class_weight = np.where(labels > 0, len(rows) / (2 * n_spam), len(rows) / (2 * (len(rows) - n_spam)))
+    rng = np.random.default_rng(seed)
+    weights = np.zeros(n_features, dtype=np.float64)
+    bias = 0.0
+    for epoch in range(epochs):
+        lr = learning_rate / math.sqrt(epoch + 1)
+        order = rng.permutation(len(rows))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            idx = [rows[i][0] for i in batch]
+            lengths = np.array([len(a) for a in idx])
+            flat = np.concatenate(idx)
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            scale = 1.0 / np.sqrt(lengths)
+            z = np.add.reduceat(weights[flat], starts) * scale + bias
+            grad = (_sigmoid(z) - labels[batch]) * class_weight[batch]
+            # Признаки разреженные: шаг по весам — как у поштучного SGD, сдвиг — средний по батчу
+            weights *= 1.0 - lr * l2
+            np.add.at(weights, flat, -lr * np.repeat(grad * scale, lengths))
+            bias -= lr * float(grad.mean())
+    scopes = sorted({ih.hex() for _, _, ih in samples if ih is not None})
+    meta = {
+        "format": MODEL_FORMAT,
+        "n_features": n_features,
+        "ngram_sizes": list(DEFAULT_NGRAM_SIZES),
+        "scopes": scopes,
+        "samples": len(rows),
+        "spam_samples": int(n_spam),
+        "trained_at": time.time(),
+    }
+    return LocalClassifier(weights.astype(np.float32), bias, meta)
+
+
+def evaluate(model: LocalClassifier, samples: Sequence[Sample], spam_threshold: float = CLASSIFIER_SPAM_THRESHOLD,
+             ham_threshold: float = CLASSIFIER_HAM_THRESHOLD) -> Dict[str, Any]:
+    """Доля решённых локально (coverage) и согласие этих решений с метками (agreement)."""
+    decided = agreed = local_spam = 0
+    correct_at_half = 0
+    for text, label, _ in samples:
+        p = model.score(text)
+        correct_at_half += (p >= 0.5) == bool(label)
+        if p >= spam_threshold or p <= ham_threshold:
+            decided += 1
+            local_spam += p >= spam_threshold
+            agreed += (p >= spam_threshold) == bool(label)
+    n = len(samples)
+    return {
+        "samples": n,
+        "coverage": round(decided / n, 4) if n else None,
+        "agreement": round(agreed / decided, 4) if decided else None,
+        "local_spam": local_spam,
+        "local_ham": decided - local_spam,
+        "escalated": n - decided,
+        "accuracy_at_0.5": round(correct_at_half / n, 4) if n else None,
+    }
+
+
+def split_holdout(samples: Sequence[Sample], fraction: float, seed: int = 1) -> Tuple[list, list]:
+    order = np.random.default_rng(seed).permutation(len(samples))
+    cut = int(len(samples) * (1.0 - fraction))
+    return [samples[i] for i in order[:cut]], [samples[i] for i in order[cut:]]
+
+
+def load_history(storage=None, chunk_size: int = 5000) -> List[Sample]:
+    if storage is None:
+        storage = database.get_storage()
+    return build_training_set(storage.scan_classifications(chunk_size))
+
+
+# ===== Работа в боте =====
+
+_model: Optional[LocalClassifier] = None
+classifier_stats = {"spam": 0, "ham": 0, "escalated": 0, "out_of_scope": 0, "recorded": 0, "record_errors": 0,
+                    "prunes": 0}
+_record_tasks: Set[asyncio.Future] = set()
+# История чистится при старте и затем не чаще раза в PRUNE_INTERVAL_SECONDS (по ходу записи)
+PRUNE_INTERVAL_SECONDS = 3600.0
+_last_prune: Optional[float] = None
+
+
+def load_local_classifier(path: str = CLASSIFIER_MODEL_PATH) -> bool:
+    """Загружает модель при старте; без файла или при ошибке бот работает только с OpenAI."""
+    global _model
+    if not path:
+        return False
+    try:
+        _model = LocalClassifier.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Local classifier model {path} not loaded: {e}")
+        _model = None
+        return False
+    logger.info(f"Local classifier loaded from {path} ({_model.meta.get('samples')} samples, "
+                f"{len(_model.scopes)} instruction sets).")
+    return True
+
+
+def set_local_classifier(model: Optional[LocalClassifier]) -> None:
+    global _model
+    _model = model
+
+
+def classify_locally(text: Optional[str], instructions_hash: Optional[bytes]) -> Optional[bool]:
+    """True/False — уверенный локальный вердикт; None — решать OpenAI."""
+    model = _model
+    if model is None or not text:
+        return None
+    if not model.applies_to(instructions_hash):
+        classifier_stats["out_of_scope"] += 1
+        return None
+    p = model.score(text)
+    if p >= CLASSIFIER_SPAM_THRESHOLD:
+        classifier_stats["spam"] += 1
+        return True
+    if p <= CLASSIFIER_HAM_THRESHOLD:
+        classifier_stats["ham"] += 1
+        return False
+    classifier_stats["escalated"] += 1
+    return None
+
+
+def _record_done(task: asyncio.Future) -> None:
+    _record_tasks.discard(task)
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        classifier_stats["record_errors"] += 1
+        logger.warning(f"Failed to record classification history: {error}")
+    else:
+        classifier_stats["recorded"] += 1
+
+
+def prune_classification_history(storage=None) -> bool:
+    """Удаляет строки старше CLASSIFIER_HISTORY_RETENTION_DAYS (0 — хранить бессрочно).
+    Ошибка БД не критична: попытка повторится через PRUNE_INTERVAL_SECONDS."""
+    global _last_prune
+    _last_prune = time.monotonic()
+    if CLASSIFIER_HISTORY_RETENTION_DAYS <= 0:
+        return False
+    storage = storage or database.get_storage()
+    try:
+        storage.prune_classifications(CLASSIFIER_HISTORY_RETENTION_DAYS * 86400)
+    except database.DB_ERRORS as e:
+        logger.warning(f"Could not prune classification history: {e}")
+        return False
+    classifier_stats["prunes"] += 1
+    return True
+
+
+def record_classification(user_id: int, group_id: int, instructions_hash: Optional[bytes], text: Optional[str],
+                          is_spam: bool, source: str = "llm") -> None:
+    """Фоновая запись в classification_history через DB executor.
+    Локальные вердикты не пишутся: модель не должна учиться на своих же ответах."""
+    if not CLASSIFIER_HISTORY_ENABLED:
+        return
+    storage = database.get_storage()
+    row = (user_id, group_id, instructions_hash, text, bool(is_spam), source)
+    task = asyncio.ensure_future(database.run_db(storage.record_classifications, [row]))
+    _record_tasks.add(task)
+    task.add_done_callback(_record_done)
+    if _last_prune is None or time.monotonic() - _last_prune >= PRUNE_INTERVAL_SECONDS:
+        prune = asyncio.ensure_future(database.run_db(prune_classification_history, storage))
+        _record_tasks.add(prune)
+        prune.add_done_callback(_record_tasks.discard)
+
+
+def record_correction(user_id: int, group_id: int, is_spam: bool) -> None:
+    """/ban (group_id — группа) или /unban (group_id 0 — все группы) от админа."""
+    record_classification(user_id, group_id, None, None, is_spam, "ban" if is_spam else "unban")
+
+
+def get_local_classifier_stats() -> Dict[str, Any]:
+    data: Dict[str, Any] = dict(classifier_stats)
+    data["loaded"] = _model is not None
+    if _model is not None:
+        data["samples"] = _model.meta.get("samples")
+        data["scopes"] = len(_model.scopes)
+    return data
+
+
+# ===== CLI =====
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.local_classifier", description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_train = sub.add_parser("train", help="обучить модель на classification_history")
+    p_train.add_argument("--out", required=True, help="путь к файлу модели (.npz)")
+    p_train.add_argument("--feature-bits", type=int, default=DEFAULT_FEATURE_BITS, help="2^bits хэшированных признаков")
+    p_train.add_argument("--epochs", type=int, default=8)
+    p_train.add_argument("--learning-rate", type=float, default=0.5)
+    p_train.add_argument("--holdout", type=float, default=0.2, help="доля примеров для оценки")
+    p_train.add_argument("--min-samples", type=int, default=200)
+    p_train.add_argument("--seed", type=int, default=1)
+    p_eval = sub.add_parser("evaluate", help="оценить модель на classification_history")
+    p_eval.add_argument("--model", required=True)
+    args = parser.parse_args(argv)
+
+    samples = load_history()
+    if args.command == "train":
+        if len(samples) < args.min_samples:
+            raise SystemExit(f"Only {len(samples)} samples in classification_history (need {args.min_samples}).")
+        train_set, holdout = split_holdout(samples, args.holdout, args.seed)
+        model = train(train_set, args.feature_bits, args.epochs, args.learning_rate, seed=args.seed)
+        metrics = evaluate(model, holdout) if holdout else {}
+        model.meta["holdout"] = metrics
+        model.save(args.out)
+        print(json.dumps({"out": args.out, "samples": len(train_set), "holdout": metrics}, ensure_ascii=False))
+    elif args.command == "evaluate":
+        print(json.dumps(evaluate(LocalClassifier.load(args.model), samples), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
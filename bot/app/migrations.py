@@ -0,0 +1,409 @@
+"""Версионированные миграции схемы.
+
+Применённые шаги записываются в schema_version. При старте читается MAX(version): если
+схема актуальна, больше ничего не выполняется (никаких COUNT(*) / SHOW INDEX / сканов
+user_entries). Недостающие шаги применяются по порядку под именованной блокировкой
+GET_LOCK — несколько воркеров, стартующих одновременно, не выполнят миграцию дважды.
+
+Каждый шаг идемпотентен (проверяет текущее состояние): DDL в MySQL коммитится неявно,
+и шаг, прерванный до записи версии, при следующем старте повторяется. Индексы и колонки
+добавляются онлайн (ALGORITHM=INPLACE, LOCK=NONE), если сервер это поддерживает.
+Новый шаг — функция _mNNN_* и строка в MIGRATIONS с номером больше последнего.
+"""
+
+import time
+from typing import Callable, List, NamedTuple, Set
+
+import mysql.connector
+
+from .config import SCHEMA_MIGRATION_LOCK_TIMEOUT_SECONDS
+from .logging_setup import logger
+
+LOCK_NAME = "buzzbuster_schema_migration"
+
+
+class MigrationError(Exception):
+    """Миграция не может быть применена (нет блокировки, остались дубликаты и т.п.)."""
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable  # apply(conn) -> None
+
+
+# ===== Вспомогательные функции =====
+
+def _existing_indexes(conn, table: str) -> Set[str]:
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SHOW INDEX FROM {table}")
+        # SHOW INDEX: третья колонка — Key_name
+        return {str(row[2]) for row in cur.fetchall() if len(row) >= 3 and row[2]}
+    finally:
+        cur.close()
+
+
+def _has_column(conn, table: str, column: str) -> bool:
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SHOW COLUMNS FROM {table} LIKE %s", (column,))
+        return bool(cur.fetchall())
+    finally:
+        cur.close()
+
+
+def _alter_online(conn, table: str, clause: str) -> None:
+    """ALTER без блокировки записи; если сервер не поддерживает такой режим для этой
+    операции — обычный ALTER."""
+    cur = conn.cursor()
+    try:
+        try:
+            cur.execute(f"ALTER TABLE {table} {clause}, ALGORITHM=INPLACE, LOCK=NONE")
+        except mysql.connector.Error as e:
+            logger.warning(f"Online ALTER TABLE {table} {clause} not supported ({e}); using default algorithm.")
+            cur.execute(f"ALTER TABLE {table} {clause}")
+    finally:
+        cur.close()
+
+
+def _add_missing_indexes(conn, table: str, indexes: List[tuple]) -> None:
+    """indexes: [(name, "KEY name (cols)")]."""
+    existing = _existing_indexes(conn, table)
+    for name, ddl in indexes:
+        if name not in existing:
+            _alter_online(conn, table, f"ADD {ddl}")
+            logger.info(f"Added index {name} on {table}.")
+
+
+# ===== Шаги =====
+
+def _m001_base_tables(conn) -> None:
+    """Исходные таблицы (схема до версионирования). Новая user_entries сразу получает
+    итоговый набор индексов: idx_user / idx_spammer / idx_seen, которые m005 заменяет
+    на idx_user_flags, на пустой базе не создаются и не удаляются."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS `groups` (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            group_id BIGINT NOT NULL UNIQUE
+            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS group_settings (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            group_id BIGINT NOT NULL,
+            parameter VARCHAR(255) NOT NULL,
+            value TEXT,
+            UNIQUE KEY unique_group_parameter (group_id, parameter)
+            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_entries (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            group_id BIGINT NOT NULL,
+            join_date DATETIME NOT NULL,
+            seen_message BOOLEAN DEFAULT FALSE,
+            spammer BOOLEAN DEFAULT FALSE,
+            UNIQUE KEY uniq_user_group (user_id, group_id),
+            KEY idx_group (group_id),
+            KEY idx_user_flags (user_id, spammer, seen_message, group_id)
+            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+            """
+        )
+        conn.commit()
+    finally:
+        cur.close()
+
+
+def _m002_dedup_user_entries(conn) -> None:
+    """Таблицы, созданные старыми версиями без уникальных ключей: схлопываем дубликаты
+    (user_id, group_id) в строку с MAX(id) с OR флагов, затем добавляем uniq_user_group
+    и недостающие индексы. Полный проход по user_entries — только здесь, один раз."""
+    existing = _existing_indexes(conn, "user_entries")
+    if "uniq_user_group" not in existing:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "SELECT COUNT(*) FROM (SELECT user_id, group_id FROM user_entries GROUP BY user_id, group_id HAVING COUNT(*)>1) x"
+            )
+            row = cur.fetchone()
+            duplicate_pairs = int(row[0]) if row else 0
+            removed = 0
+            if duplicate_pairs:
+                cur.execute(
+                    "SELECT user_id, group_id, COUNT(*) c FROM user_entries GROUP BY user_id, group_id HAVING c>1 LIMIT 5"
+                )
+                sample = ", ".join(f"(user_id={u}, group_id={g}, cnt={c})" for u, g, c in cur.fetchall())
+                logger.warning(
+                    f"Found {duplicate_pairs} duplicate (user_id,group_id) pairs in user_entries. "
+                    f"Beginning deduplication. Sample: {sample}"
+                )
+                # Consolidate flags (OR logic) into latest (MAX id) row per pair
+                cur.execute(
+                    """
+                    UPDATE user_entries u
+                    JOIN (
+                      SELECT MAX(id) AS keep_id, user_id, group_id,
+                             MAX(join_date) AS max_join_date,
+                             MAX(seen_message) AS seen_any,
+                             MAX(spammer) AS spammer_any
+                      FROM user_entries
+                      GROUP BY user_id, group_id
+                      HAVING COUNT(*)>1
+                    ) agg ON u.id = agg.keep_id
+                    SET u.join_date = agg.max_join_date,
+                        u.seen_message = agg.seen_any,
+                        u.spammer = agg.spammer_any
+                    """
+                )
+                # Delete all non-canonical duplicates (keep MAX(id))
+                cur.execute(
+                    """
+                    DELETE ue FROM user_entries ue
+                    JOIN (
+                      SELECT MAX(id) AS keep_id, user_id, group_id
+                      FROM user_entries
+                      GROUP BY user_id, group_id
+                      HAVING COUNT(*)>1
+                    ) d ON ue.user_id=d.user_id AND ue.group_id=d.group_id AND ue.id<>d.keep_id
+                    """
+                )
+                removed = cur.rowcount
+                conn.commit()
+                logger.info(f"Removed {removed} duplicate rows from user_entries.")
+                cur.execute(
+                    "SELECT COUNT(*) FROM (SELECT user_id, group_id FROM user_entries GROUP BY user_id, group_id HAVING COUNT(*)>1) x"
+                )
+                row = cur.fetchone()
+                still = int(row[0]) if row else 0
+                if still:
+                    raise MigrationError(
+                        f"Deduplication attempted but {still} duplicate pairs remain; UNIQUE index not added. "
+                        "Manual intervention required."
+                    )
+        finally:
+            cur.close()
+        _alter_online(conn, "user_entries", "ADD UNIQUE KEY uniq_user_group (user_id, group_id)")
+        logger.info("Added missing unique index uniq_user_group on user_entries.")
+        try:
+            from .logging_setup import log_event
+            log_event('schema_harden_summary', duplicate_pairs=duplicate_pairs, removed_rows=removed)
+        except Exception:
+            pass
+    # idx_user / idx_spammer / idx_seen здесь не добавляются: их всё равно заменяет m005
+    _add_missing_indexes(conn, "user_entries", [
+        ("idx_group", "KEY idx_group (group_id)"),
+    ])
+    _add_missing_indexes(conn, "group_settings", [
+        ("unique_group_parameter", "UNIQUE KEY unique_group_parameter (group_id, parameter)"),
+    ])
+
+
+def _m003_user_entries_updated_at(conn) -> None:
+    """Водяная отметка изменений для инкрементальной сверки кэшей (cache_refresh)."""
+    if not _has_column(conn, "user_entries", "updated_at"):
+        _alter_online(
+            conn, "user_entries",
+            "ADD COLUMN updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)",
+        )
+        logger.info("Added updated_at change watermark column to user_entries.")
+    _add_missing_indexes(conn, "user_entries", [("idx_updated_at", "KEY idx_updated_at (updated_at)")])
+
+
+def _m004_cache_events(conn) -> None:
+    """Журнал событий шины инвалидации кэшей между воркерами (cache_bus.py)."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_events (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            origin VARCHAR(64) NOT NULL,
+            kind VARCHAR(32) NOT NULL,
+            user_id BIGINT NULL,
+            group_id BIGINT NULL,
+            value BIGINT NULL,
+            created_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+            KEY idx_created_at (created_at)
+            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+            """
+        )
+        conn.commit()
+    finally:
+        cur.close()
+
+
+def _m005_covering_user_flags_index(conn) -> None:
+    """Покрывающий индекс под горячие запросы по пользователю (user_has_*_anywhere,
+    groups_where_spammer, resolve_user_state, aggregate_user_flags, холодная загрузка)
+    вместо idx_user (префикс uniq_user_group) и низкоселективных idx_spammer / idx_seen,
+    которые только замедляли запись. Новый индекс создаётся до удаления старых."""
+    existing = _existing_indexes(conn, "user_entries")
+    if "idx_user_flags" not in existing:
+        _alter_online(conn, "user_entries", "ADD KEY idx_user_flags (user_id, spammer, seen_message, group_id)")
+        logger.info("Added covering index idx_user_flags on user_entries.")
+    obsolete = [name for name in ("idx_user", "idx_spammer", "idx_seen") if name in existing]
+    if obsolete:
+        _alter_online(conn, "user_entries", ", ".join(f"DROP KEY {name}" for name in obsolete))
+        logger.info(f"Dropped superseded indexes on user_entries: {', '.join(obsolete)}.")
+
+
+def _m006_group_migrations(conn) -> None:
+    """Задания переноса данных группы на новый chat_id и переадресация old -> new
+    (group_migration.py). Строка остаётся и после done: по ней переадресуется старый id."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS group_migrations (
+            old_group_id BIGINT PRIMARY KEY,
+            new_group_id BIGINT NOT NULL,
+            rows_moved BIGINT NOT NULL DEFAULT 0,
+            done BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            KEY idx_done (done)
+            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+            """
+        )
+        conn.commit()
+    finally:
+        cur.close()
+
+
+def _m007_group_settings_updated_at(conn) -> None:
+    """Версия настроек группы для горячей перезагрузки без рестарта (settings_reload)."""
+    if not _has_column(conn, "group_settings", "updated_at"):
+        _alter_online(
+            conn, "group_settings",
+            "ADD COLUMN updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)",
+        )
+        logger.info("Added updated_at version column to group_settings.")
+    _add_missing_indexes(conn, "group_settings", [("idx_updated_at", "KEY idx_updated_at (updated_at)")])
+
+
+def _m008_verdict_cache(conn) -> None:
+    """Кэш вердиктов классификации по хэшам текста и инструкций (antispam.py): переживает рестарт."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS verdict_cache (
+            text_hash BINARY(16) NOT NULL,
+            instructions_hash BINARY(16) NOT NULL,
+            is_spam BOOLEAN NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (text_hash, instructions_hash),
+            KEY idx_created_at (created_at)
+            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+            """
+        )
+        conn.commit()
+    finally:
+        cur.close()
+
+
+def _m009_classification_history(conn) -> None:
+    """История вердиктов OpenAI и исправлений /ban, /unban — обучающие данные local_classifier.py."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS classification_history (
+            id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            group_id BIGINT NOT NULL,
+            instructions_hash BINARY(16) NULL,
+            message_text TEXT NULL,
+            is_spam BOOLEAN NOT NULL,
+            source VARCHAR(8) NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_created_at (created_at)
+            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+            """
+        )
+        conn.commit()
+    finally:
+        cur.close()
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "base_tables", _m001_base_tables),
+    Migration(2, "dedup_user_entries", _m002_dedup_user_entries),
+    Migration(3, "user_entries_updated_at", _m003_user_entries_updated_at),
+    Migration(4, "cache_events", _m004_cache_events),
+    Migration(5, "covering_user_flags_index", _m005_covering_user_flags_index),
+    Migration(6, "group_migrations", _m006_group_migrations),
+    Migration(7, "group_settings_updated_at", _m007_group_settings_updated_at),
+    Migration(8, "verdict_cache", _m008_verdict_cache),
+    Migration(9, "classification_history", _m009_classification_history),
+]
+
+
+# ===== Исполнитель =====
+
+def _current_version(cur) -> int:
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    row = cur.fetchone()
+    return int(row[0]) if row else 0
+
+
+def run_migrations(conn, migrations: List[Migration] = MIGRATIONS,
+                   lock_timeout: float = SCHEMA_MIGRATION_LOCK_TIMEOUT_SECONDS) -> List[int]:
+    """Применяет недостающие шаги; возвращает номера применённых (пусто — схема актуальна).
+    Ошибки БД и MigrationError пробрасываются; версия упавшего шага не записывается."""
+    versions = [m.version for m in migrations]
+    if versions != sorted(set(versions)):
+        raise MigrationError(f"Migration versions must be unique and increasing: {versions}")
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            name VARCHAR(128) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            duration_ms INT NOT NULL DEFAULT 0
+            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+            """
+        )
+        version = _current_version(cur)
+        if not versions or version >= versions[-1]:
+            logger.debug(f"Database schema is up to date (version {version}).")
+            return []
+        cur.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, int(lock_timeout)))
+        row = cur.fetchone()
+        if not row or row[0] != 1:
+            raise MigrationError(f"Could not acquire schema migration lock within {lock_timeout}s")
+        try:
+            # Пока ждали блокировку, миграции мог применить другой воркер
+            version = _current_version(cur)
+            applied = []
+            for migration in migrations:
+                if migration.version <= version:
+                    continue
+                logger.info(f"Applying schema migration {migration.version:03d} {migration.name}.")
+                started = time.monotonic()
+                migration.apply(conn)
+                duration_ms = int((time.monotonic() - started) * 1000)
+                cur.execute(
+                    "INSERT INTO schema_version (version, name, duration_ms) VALUES (%s, %s, %s)",
+                    (migration.version, migration.name, duration_ms),
+                )
+                conn.commit()
+                applied.append(migration.version)
+                logger.info(f"Schema migration {migration.version:03d} {migration.name} applied in {duration_ms} ms.")
+            return applied
+        finally:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cur.fetchone()
+    finally:
+        cur.close()
@@ -0,0 +1,187 @@
+"""Поиск близких копий недавнего спама по SimHash-отпечаткам.
+
+Спамеры слегка меняют текст (эмодзи, пробелы, другая ссылка), и точное совпадение
+(кэш вердиктов) их не ловит. Для сообщений, которые process_spam признал спамом,
+храним 64-битный SimHash по символьным 4-граммам нормализованного текста; новое
+сообщение, отличающееся от известного шаблона не больше чем на max_distance бит
+(при тех же инструкциях группы), помечается спамом локально, без OpenAI.
+
+Поиск — LSH по полосам: 64 бита режутся на max_distance + 1 полос, и по принципу
+Дирихле у отпечатков на расстоянии <= max_distance хотя бы одна полоса совпадает
+целиком. Кандидаты берутся из словаря полос, расстояние проверяется popcount'ом.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from .config import NEAR_DUPLICATE_INDEX_SIZE, NEAR_DUPLICATE_MAX_DISTANCE, NEAR_DUPLICATE_TTL_SECONDS
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 4
+# Короче этого (после нормализации) отпечаток ненадёжен: «привет» не должен совпасть с «привет!»-спамом
+MIN_TEXT_LENGTH = 24
+
+_MASK = (1 << FINGERPRINT_BITS) - 1
+_URL = re.compile(r"(?:https?://|www\.|t\.me/)\S+|\b[\w-]+\.(?:com|ru|net|org|io|me|xyz|top|info|biz)\S*", re.IGNORECASE)
+_MENTION = re.compile(r"@\w+")
+_DIGITS = re.compile(r"\d+")
+_NOISE = re.compile(r"[^\w\s]+|_")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_for_fingerprint(text: str) -> str:
+    """Ссылки и упоминания — в общий токен, числа — в 0, эмодзи и пунктуация выбрасываются."""
+    text = _URL.sub(" url ", text.casefold())
+    text = _MENTION.sub(" mention ", text)
+    text = _DIGITS.sub("0", text)
+    text = _NOISE.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def simhash(text: str) -> Optional[int]:
+    """64-битный SimHash по символьным 4-граммам; None для слишком коротких текстов.
+
+    hash() строк солится на процесс — отпечатки сравнимы только внутри процесса,
+    что и нужно индексу в памяти. Суммирование бит — через zip строк '0'/'1' (в C).
+    """
+    norm = normalize_for_fingerprint(text)
+    if len(norm) < MIN_TEXT_LENGTH:
+        return None
+    shingles = {norm[i:i + SHINGLE_SIZE] for i in range(len(norm) - SHINGLE_SIZE + 1)}
+    rows = [format(hash(s) & _MASK, "064b") for s in shingles]
+    half = len(rows) / 2
+    fingerprint = 0
+    for column in zip(*rows):
+        fingerprint = (fingerprint << 1) | (column.count("1") > half)
+    return fingerprint
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _band_layout(max_distance: int) -> List[Tuple[int, int]]:
+    """(сдвиг, маска) для max_distance + 1 полос, покрывающих все 64 бита."""
+    bands = max(1, min(max_distance + 1, FINGERPRINT_BITS))
+    width, extra = divmod(FINGERPRINT_BITS, bands)
+    layout, shift = [], 0
+    for i in range(bands):
+        w = width + (1 if i < extra else 0)
+        layout.append((shift, (1 << w) - 1))
+        shift += w
+    return layout
+
+
+class NearDuplicateIndex:
+    """Ограниченный по размеру (LRU) и времени жизни (TTL) индекс отпечатков спама.
+
+    Ключ записи — (scope, fingerprint), где scope — хэш инструкций группы: вариация
+    шаблона считается спамом только при тех же правилах. max_size <= 0 отключает индекс.
+    """
+
+    def __init__(self, max_size: int, max_distance: int, ttl: float = 0.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_size = int(max_size)
+        self.max_distance = max(0, int(max_distance))
+        self.ttl = float(ttl)
+        self._clock = clock
+        self._bands = _band_layout(self.max_distance)
+        self._entries: "OrderedDict[Tuple[Hashable, int], Optional[float]]" = OrderedDict()
+        self._buckets: Dict[Tuple[Hashable, int, int], Set[int]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "added": 0, "evictions": 0, "expirations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _band_keys(self, scope: Hashable, fingerprint: int):
+        for i, (shift, mask) in enumerate(self._bands):
+            yield scope, i, (fingerprint >> shift) & mask
+
+    def _remove(self, key: Tuple[Hashable, int]) -> None:
+        del self._entries[key]
+        scope, fingerprint = key
+        for band in self._band_keys(scope, fingerprint):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(fingerprint)
+                if not bucket:
+                    del self._buckets[band]
+
+    def _expire(self, now: float) -> None:
+        # Порядок записей — по последнему добавлению, TTL одинаковый: просроченные в начале
+        while self._entries:
+            key, expires_at = next(iter(self._entries.items()))
+            if expires_at is None or expires_at > now:
+                break
+            self._remove(key)
+            self.stats["expirations"] += 1
+
+    def add(self, scope: Hashable, fingerprint: Optional[int]) -> bool:
+        if fingerprint is None or not self.enabled:
+            return False
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            key = (scope, fingerprint)
+            if key not in self._entries:
+                for band in self._band_keys(scope, fingerprint):
+                    self._buckets.setdefault(band, set()).add(fingerprint)
+            self._entries[key] = now + self.ttl if self.ttl > 0 else None
+            self._entries.move_to_end(key)
+            self.stats["added"] += 1
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+            return True
+
+    def find(self, scope: Hashable, fingerprint: Optional[int]) -> Optional[int]:
+        """Ближайший известный отпечаток в пределах max_distance или None."""
+        if fingerprint is None or not self.enabled:
+            return None
+        with self._lock:
+            self._expire(self._clock())
+            best, best_distance = None, self.max_distance + 1
+            for band in self._band_keys(scope, fingerprint):
+                for candidate in self._buckets.get(band, ()):
+                    distance = hamming_distance(fingerprint, candidate)
+                    if distance < best_distance:
+                        best, best_distance = candidate, distance
+            if best is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            # Совпавший шаблон ещё активен — освежаем его в LRU
+            self._entries.move_to_end((scope, best))
+            return best
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            data: Dict[str, Any] = dict(self.stats)
+            data["size"] = len(self._entries)
+            data["max_size"] = self.max_size
+            data["max_distance"] = self.max_distance
+            data["buckets"] = len(self._buckets)
+        lookups = data["hits"] + data["misses"]
+        data["hit_rate"] = round(data["hits"] / lookups, 4) if lookups else None
+        return data
+
+
+near_duplicate_index = NearDuplicateIndex(NEAR_DUPLICATE_INDEX_SIZE, NEAR_DUPLICATE_MAX_DISTANCE,
+                                          NEAR_DUPLICATE_TTL_SECONDS)
+
+
+def get_near_duplicate_stats() -> Dict[str, Any]:
+    return near_duplicate_index.snapshot_stats()
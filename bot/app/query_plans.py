@@ -0,0 +1,143 @@
+"""EXPLAIN-проверка горячих запросов к user_entries.
+
+Каждый запрос из HOT_QUERIES должен читаться только из индекса (Extra: "Using index")
+либо быть точечным чтением одной строки по уникальному ключу (type const / eq_ref).
+Запуск против локальной MySQL/MariaDB (параметры DB_* из окружения):
+
+    python -m app.query_plans                # схема мигрируется, планы проверяются
+    python -m app.query_plans --seed 50000   # пустая таблица сперва заполняется синтетикой
+
+На пустой или крошечной таблице оптимизатор выбирает планы, не похожие на боевые,
+поэтому для локальной БД используйте --seed. Код выхода 1 — есть не index-only планы.
+"""
+
+import argparse
+import random
+import sys
+from typing import Dict, List, Sequence, Tuple
+
+from . import database
+from .logging_setup import logger
+
+# (имя, SQL, параметры для EXPLAIN)
+HOT_QUERIES: List[Tuple[str, str, tuple]] = [
+    ("user_has_spammer_anywhere", database.SPAMMER_ANYWHERE_SQL, (1,)),
+    ("user_has_seen_anywhere", database.SEEN_ANYWHERE_SQL, (1,)),
+    ("groups_where_spammer", database.GROUPS_WHERE_SPAMMER_SQL, (1,)),
+    ("resolve_user_state", database.USER_STATE_SQL, (-100, -100, -100, 1)),
+    ("aggregate_user_flags", database.aggregate_user_flags_sql(3), (1, 2, 3)),
+    ("user_is_spammer_in_group", database.SPAMMER_IN_GROUP_SQL, (1, -100)),
+    ("get_user_entry", database.USER_ENTRY_SQL, (1, -100)),
+    ("cold_load_scan", database.COLD_LOAD_SQL, ()),
+]
+
+INDEX_ONLY_EXTRA = {"Using index", "Using index for group-by"}
+SINGLE_ROW_TYPES = {"system", "const", "eq_ref"}
+
+
+def plan_problems(rows: Sequence[dict], table: str = "user_entries") -> List[str]:
+    """Замечания к плану (строки EXPLAIN как dict); пустой список — план index-only."""
+    problems = []
+    for row in rows:
+        if row.get("table") != table:
+            continue
+        access = row.get("type")
+        key = row.get("key")
+        extra = {part.strip() for part in str(row.get("Extra") or "").split(";")}
+        if access in SINGLE_ROW_TYPES and key:
+            continue
+        if not key:
+            problems.append(f"no index used (type={access}, rows={row.get('rows')})")
+        elif not extra & INDEX_ONLY_EXTRA:
+            problems.append(f"index {key} does not cover the query (type={access}, Extra={row.get('Extra')})")
+    return problems
+
+
+def explain(conn, sql: str, params: tuple) -> List[dict]:
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute("EXPLAIN " + sql, params)
+        return list(cur.fetchall())
+    finally:
+        cur.close()
+
+
+def check_query_plans(conn) -> Dict[str, Tuple[List[dict], List[str]]]:
+    """{имя запроса: (строки EXPLAIN, замечания)}."""
+    results = {}
+    for name, sql, params in HOT_QUERIES:
+        rows = explain(conn, sql, params)
+        results[name] = (rows, plan_problems(rows))
+    return results
+
+
+def seed_user_entries(conn, rows: int, users: int = 0, groups: int = 50, seed: int = 1) -> int:
+    """Заполняет ПУСТУЮ user_entries синтетическими строками (для локальной проверки планов)."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT 1 FROM user_entries LIMIT 1")
+        if cur.fetchone() is not None:
+            logger.info("user_entries is not empty; skipping seeding.")
+            return 0
+        rng = random.Random(seed)
+        users = users or max(1, rows // 3)
+        rows = min(rows, users * groups)
+        seen_pairs = set()
+        batch = []
+        while len(seen_pairs) < rows:
+            pair = (rng.randrange(1, users + 1), -1000000000000 - rng.randrange(groups))
+            if pair in seen_pairs:
+                continue
+            seen_pairs.add(pair)
+            batch.append(pair + (rng.random() < 0.7, rng.random() < 0.02))
+            if len(batch) >= 5000:
+                _insert_seed_batch(cur, batch)
+                conn.commit()
+                batch = []
+        if batch:
+            _insert_seed_batch(cur, batch)
+            conn.commit()
+        cur.execute("ANALYZE TABLE user_entries")
+        cur.fetchall()
+        return rows
+    finally:
+        cur.close()
+
+
+def _insert_seed_batch(cur, batch: List[tuple]) -> None:
+    cur.executemany(
+        "INSERT INTO user_entries (user_id, group_id, join_date, seen_message, spammer) VALUES (%s, %s, NOW(), %s, %s)",
+        batch,
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.query_plans", description=__doc__.splitlines()[0])
+    parser.add_argument("--seed", type=int, default=0, help="seed an empty user_entries with N synthetic rows")
+    parser.add_argument("--no-migrate", action="store_true", help="do not bring the schema up to date first")
+    args = parser.parse_args(argv)
+
+    if not args.no_migrate:
+        database.check_and_create_tables()
+    conn = database.get_db_connection()
+    try:
+        if args.seed:
+            seed_user_entries(conn, args.seed)
+        results = check_query_plans(conn)
+    finally:
+        conn.close()
+    failed = 0
+    for name, (rows, problems) in results.items():
+        plan = "; ".join(
+            f"type={r.get('type')} key={r.get('key')} rows={r.get('rows')} extra={r.get('Extra')}"
+            for r in rows if r.get("table") == "user_entries"
+        )
+        print(f"{'OK ' if not problems else 'BAD'} {name:28s} {plan}")
+        for problem in problems:
+            print(f"    - {problem}")
+        failed += bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,42 +1,31 @@
 import logging
 from telegram.error import ChatMigrated
 from telegram import Bot
-from .database import configured_groups_cache
-import mysql.connector
-from .config import DB_CONFIG
+from .database import (
+    DB_ERRORS,
+    add_group_redirect,
+    resolve_group_id,
+    run_db,
+)
+from .group_migration import group_migrator, record_group_migration
 
 async def _persist_migrated_group(old_id: int, new_id: int) -> None:
-    """Update DB and in-memory caches when a group migrates to supergroup (new chat id).
+    """Register a group migration to supergroup (new chat id).
     Telegram migrates normal groups to supergroups and changes chat_id (adds -100 prefix).
-    We need to keep data continuity by updating the stored group_id.
+    The old -> new redirect takes effect immediately (in memory and in group_migrations);
+    stored rows are moved in bounded chunks by the background group_migrator.
     """
-    # Update in-memory cache entries
     # Local import to avoid side effects if logging config fails in isolated test context
     from .logging_setup import logger  # type: ignore
-    for entry in configured_groups_cache:
-        if entry.get("group_id") == old_id:
-            entry["group_id"] = new_id
-    # Update DB rows
-    conn = None
-    cur = None
+    add_group_redirect(old_id, new_id)
+    # Single-row write in the DB executor, not on the event loop
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        # groups table
-        cur.execute("UPDATE `groups` SET group_id=%s WHERE group_id=%s", (new_id, old_id))
-        # group_settings table
-        cur.execute("UPDATE group_settings SET group_id=%s WHERE group_id=%s", (new_id, old_id))
-        # user_entries table
-        cur.execute("UPDATE user_entries SET group_id=%s WHERE group_id=%s", (new_id, old_id))
-        conn.commit()
-        logger.info(f"Persisted migration old_group_id={old_id} -> new_group_id={new_id} in database.")
-    except mysql.connector.Error as e:
-        logger.exception(f"Failed to persist migrated group id {old_id}->{new_id}: {e}")
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+        await run_db(record_group_migration, old_id, new_id)
+        logger.info(f"Recorded migration old_group_id={old_id} -> new_group_id={new_id}; moving rows in background.")
+    except DB_ERRORS as e:
+        logger.exception(f"Failed to record migrated group id {old_id}->{new_id}: {e}")
+    # The job upserts its own group_migrations row, so it also covers a failed record above
+    group_migrator.submit(old_id, new_id)
 
 async def send_message_with_migration(bot: Bot, chat_id: int, *args, **kwargs):
     """Wrapper around Bot.send_message handling ChatMigrated.
@@ -44,6 +33,8 @@ async def send_message_with_migration(bot: Bot, chat_id: int, *args, **kwargs):
     Returns the Message or None if it ultimately fails.
     """
     from .logging_setup import logger  # type: ignore
+    # Already known migration: go straight to the new chat id
+    chat_id = resolve_group_id(chat_id)
     try:
         return await bot.send_message(chat_id=chat_id, *args, **kwargs)
     except ChatMigrated as cm:  # type: ignore[attr-defined]
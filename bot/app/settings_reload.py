@@ -0,0 +1,132 @@
+"""Горячая перезагрузка настроек групп без рестарта бота.
+
+Фоновый поток раз в GROUP_SETTINGS_POLL_SECONDS читает версии настроек
+(MAX(group_settings.updated_at) по группе) начиная с водяной отметки минус
+CACHE_REFRESH_LOOKBACK_SECONDS и перечитывает только группы, чья версия изменилась.
+Запись группы в реестре подменяется целиком (GroupRegistry.upsert), производные данные
+(GroupInfo: инструкции и т.п.) пересчитываются вместе с ней.
+
+Админ-команда /reload_group <group_id> перечитывает группу сразу (refresh_group) и через
+шину кэшей просит о том же остальные воркеры.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import mysql.connector
+
+from . import database
+from .config import CACHE_REFRESH_LOOKBACK_SECONDS, GROUP_SETTINGS_POLL_SECONDS
+from .logging_setup import logger
+
+
+class GroupSettingsWatcher:
+    """Версии настроек по группам + цикл опроса. run_once() можно вызывать синхронно."""
+
+    def __init__(self, interval: float, lookback: float):
+        self.interval = interval
+        self.lookback = timedelta(seconds=max(0.0, lookback))
+        self.watermark: Optional[datetime] = None
+        self.versions: Dict[int, datetime] = {}
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"cycles": 0, "reloaded": 0, "forced": 0, "errors": 0}
+
+    def prime(self) -> None:
+        """Запоминает текущие версии и перечитывает все группы одним запросом: изменения
+        между стартовой загрузкой и этим моментом не теряются."""
+        with self._run_lock:
+            versions = database.fetch_group_settings_versions()
+            database.reload_configured_groups()
+            self.versions = versions
+            self.watermark = max(versions.values(), default=None)
+
+    def run_once(self) -> int:
+        """Перечитывает группы с новой версией настроек; возвращает их число.
+        Ошибки БД пробрасываются (версии необработанных групп не сдвигаются)."""
+        with self._run_lock:
+            since = self.watermark - self.lookback if self.watermark is not None else None
+            changed = {
+                gid: version for gid, version in database.fetch_group_settings_versions(since).items()
+                if self.versions.get(gid) != version
+            }
+            for gid, version in changed.items():
+                present = database.reload_group_settings(gid)
+                self.versions[gid] = version
+                if self.watermark is None or version > self.watermark:
+                    self.watermark = version
+                logger.info(f"Group {gid} settings reloaded (version {version}{'' if present else ', group removed'}).")
+            self.stats["cycles"] += 1
+            self.stats["reloaded"] += len(changed)
+            return len(changed)
+
+    def refresh_group(self, group_id: int) -> bool:
+        """Принудительно перечитывает одну группу (админ-команда). Ошибки БД пробрасываются."""
+        with self._run_lock:
+            present = database.reload_group_settings(group_id)
+            self.stats["forced"] += 1
+        # Остальные воркеры перечитают конфигурацию групп по событию шины
+        database.publish_cache_event("group", group_id=group_id)
+        return present
+
+    # ----- фоновый поток -----
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="group-settings-reload", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join()
+
+    def _run(self) -> None:
+        primed = False
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                if not primed:
+                    self.prime()
+                    primed = True
+                else:
+                    self.run_once()
+            except mysql.connector.Error as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Group settings reload failed: {e}")
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def snapshot_stats(self) -> dict:
+        data = dict(self.stats)
+        data["active"] = self.active
+        data["watermark"] = str(self.watermark) if self.watermark is not None else None
+        return data
+
+
+settings_watcher = GroupSettingsWatcher(GROUP_SETTINGS_POLL_SECONDS, CACHE_REFRESH_LOOKBACK_SECONDS)
+
+
+def start_settings_watcher() -> bool:
+    if GROUP_SETTINGS_POLL_SECONDS <= 0 or not database.get_storage().tracks_changes:
+        return False
+    settings_watcher.start()
+    return True
+
+
+def stop_settings_watcher() -> None:
+    settings_watcher.stop()
+
+
+def refresh_group_settings(group_id: int) -> bool:
+    return settings_watcher.refresh_group(group_id)
@@ -0,0 +1,308 @@
+"""Бинарный снимок пользовательских кэшей для быстрого рестарта.
+
+Формат файла (little-endian):
+  заголовок HEADER (80 байт): magic, version, header_size, created_at (unix time),
+    high_water_mark (MAX(updated_at) user_entries в микросекундах, до которой снимок полон), n_spammers, n_seen,
+    n_suspicious, n_spam_pairs, groups_len, crc32 полезной нагрузки, reserved;
+  полезная нагрузка: int64[n_spammers], int64[n_seen], int64[n_suspicious] — отсортированные
+    user_id, int64[2 * n_spam_pairs] — отсортированные пары (user_id, group_id) индекса
+    групп спамеров, затем groups_len байт JSON со списком настроенных групп.
+Файл открывается через mmap, массивы читаются как memoryview без копирования.
+При старте снимок загружается, затем изменения после high_water_mark догружаются
+инкрементальной сверкой (cache_refresh). Устаревший или повреждённый снимок —
+полная загрузка из БД.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from typing import Iterable, List, Optional, Tuple
+
+import mysql.connector
+
+from . import database
+from .cache_refresh import cache_refresher
+from .caches import sort_int64_array, sort_int64_pairs
+from .config import CACHE_SNAPSHOT_INTERVAL_SECONDS, CACHE_SNAPSHOT_MAX_AGE_SECONDS, CACHE_SNAPSHOT_PATH
+from .logging_setup import logger
+
+MAGIC = b"BZBSNAP\x00"
+VERSION = 3  # 2: high_water_mark — updated_at вместо MAX(id); 3: пары индекса групп спамеров
+HEADER = struct.Struct("<8sIIdqQQQQQII")
+_NATIVE_LE = sys.byteorder == "little"
+
+
+class SnapshotError(Exception):
+    """Файл снимка повреждён или несовместим."""
+
+
+def _int64_array(ids: Iterable[int]) -> array:
+    arr = sort_int64_array(array("q", ids))
+    if not _NATIVE_LE:
+        arr.byteswap()
+    return arr
+
+
+def _pairs_array(pairs: Iterable[Tuple[int, int]]) -> array:
+    arr = array("q")
+    for user_id, group_id in pairs:
+        arr.append(user_id)
+        arr.append(group_id)
+    sort_int64_pairs(arr)
+    if not _NATIVE_LE:
+        arr.byteswap()
+    return arr
+
+
+def write_snapshot(path: str, high_water_mark: int, spammers: Iterable[int], seen: Iterable[int],
+                   suspicious: Iterable[int], groups: List[dict], created_at: Optional[float] = None,
+                   spam_groups: Iterable[Tuple[int, int]] = ()) -> int:
+    """Атомарно (tmp + rename) записывает снимок. Возвращает размер файла в байтах."""
+    arrays = [_int64_array(spammers), _int64_array(seen), _int64_array(suspicious), _pairs_array(spam_groups)]
+    groups_blob = json.dumps(groups, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    crc = 0
+    for arr in arrays:
+        crc = zlib.crc32(arr, crc)
+    crc = zlib.crc32(groups_blob, crc)
+    header = HEADER.pack(
+        MAGIC, VERSION, HEADER.size, time.time() if created_at is None else created_at, int(high_water_mark),
+        len(arrays[0]), len(arrays[1]), len(arrays[2]), len(arrays[3]) // 2, len(groups_blob), crc, 0,
+    )
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(header)
+        for arr in arrays:
+            arr.tofile(fh)
+        fh.write(groups_blob)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+    return HEADER.size + sum(len(a) * 8 for a in arrays) + len(groups_blob)
+
+
+class Snapshot:
+    """Открытый (mmap) снимок. spammers / seen / suspicious — последовательности int64,
+    spam_pairs — плоские пары user_id, group_id; действительны до close()."""
+
+    def __init__(self, path: str):
+        self._fh = open(path, "rb")
+        self._mm = None
+        self._views: List[memoryview] = []
+        try:
+            size = os.fstat(self._fh.fileno()).st_size
+            if size < HEADER.size:
+                raise SnapshotError(f"snapshot too small ({size} bytes)")
+            self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+            (magic, version, header_size, self.created_at, self.high_water_mark,
+             n_spam, n_seen, n_susp, n_pairs, groups_len, crc, _reserved) = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC or version != VERSION or header_size != HEADER.size:
+                raise SnapshotError(f"unsupported snapshot header (magic={magic!r}, version={version})")
+            expected = HEADER.size + (n_spam + n_seen + n_susp + 2 * n_pairs) * 8 + groups_len
+            if size != expected:
+                raise SnapshotError(f"snapshot size mismatch: {size} != {expected}")
+            whole = memoryview(self._mm)
+            self._views.append(whole)
+            payload = whole[HEADER.size:]
+            self._views.append(payload)
+            if zlib.crc32(payload) != crc:
+                raise SnapshotError("snapshot checksum mismatch")
+            offset = HEADER.size
+            self.spammers = self._ids(whole, offset, n_spam)
+            offset += n_spam * 8
+            self.seen = self._ids(whole, offset, n_seen)
+            offset += n_seen * 8
+            self.suspicious = self._ids(whole, offset, n_susp)
+            offset += n_susp * 8
+            self.spam_pairs = self._ids(whole, offset, 2 * n_pairs)
+            offset += 2 * n_pairs * 8
+            try:
+                self.groups = json.loads(bytes(whole[offset:offset + groups_len]).decode("utf-8"))
+            except ValueError as e:
+                raise SnapshotError(f"bad groups section: {e}")
+        except BaseException:
+            self.close()
+            raise
+
+    def _ids(self, whole: memoryview, offset: int, count: int):
+        raw = whole[offset:offset + count * 8]
+        self._views.append(raw)
+        if _NATIVE_LE:
+            view = raw.cast("q")
+            self._views.append(view)
+            return view
+        arr = array("q")
+        arr.frombytes(raw)
+        arr.byteswap()
+        return arr
+
+    def spam_groups(self) -> Iterable[Tuple[int, int]]:
+        pairs = self.spam_pairs
+        return zip(pairs[0::2], pairs[1::2])
+
+    def age(self) -> float:
+        return time.time() - self.created_at
+
+    def close(self) -> None:
+        # Экспортированные memoryview нужно освободить до закрытия mmap
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+# ===== Связка с кэшами database.py =====
+
+def save_cache_snapshot(path: Optional[str] = None) -> Optional[int]:
+    """Снимок текущих кэшей. Отметка читается ДО копирования кэшей: строки, появившиеся
+    между ними, будут повторно (идемпотентно) применены при догрузке."""
+    path = path or CACHE_SNAPSHOT_PATH
+    if not path:
+        return None
+    started = time.monotonic()
+    try:
+        database.flush_pending_writes()
+        mark = database.watermark_to_int(database.get_user_entries_high_water_mark())
+        groups = [
+            {"group_id": g["group_id"], "settings": dict(g.get("settings") or {})}
+            for g in list(database.configured_groups_cache)
+        ]
+        size = write_snapshot(
+            path, mark, database.spammers_cache, database.seen_users_cache,
+            database.suspicious_users_cache, groups, spam_groups=database.spam_groups_index.pairs(),
+        )
+    except database.DB_ERRORS + (OSError,) as e:
+        logger.exception(f"Failed to write cache snapshot to {path}: {e}")
+        return None
+    logger.debug(f"Cache snapshot written to {path}: {size} bytes, mark={mark}, {time.monotonic() - started:.3f}s.")
+    return size
+
+
+def restore_cache_snapshot(path: Optional[str] = None, max_age: Optional[float] = None) -> bool:
+    """Загрузка кэшей из снимка + догрузка изменений после его отметки.
+    False — снимка нет, он устарел или повреждён (нужна полная загрузка)."""
+    path = path or CACHE_SNAPSHOT_PATH
+    max_age = CACHE_SNAPSHOT_MAX_AGE_SECONDS if max_age is None else max_age
+    if not path or not os.path.exists(path):
+        return False
+    started = time.monotonic()
+    try:
+        with Snapshot(path) as snap:
+            if snap.age() > max_age:
+                logger.info(f"Cache snapshot {path} is stale ({snap.age():.0f}s old); doing a full load.")
+                return False
+            current_mark = database.watermark_to_int(database.get_user_entries_high_water_mark())
+            if current_mark < snap.high_water_mark:
+                logger.warning(
+                    f"Cache snapshot mark {snap.high_water_mark} is ahead of the database ({current_mark}); doing a full load."
+                )
+                return False
+            database._reset_lazy_caches()
+            for cache, ids in (
+                (database.spammers_cache, snap.spammers),
+                (database.seen_users_cache, snap.seen),
+                (database.suspicious_users_cache, snap.suspicious),
+            ):
+                cache.clear()
+                cache.update(ids)
+            database.spam_groups_index.replace(snap.spam_groups())
+            database.configured_groups_cache[:] = snap.groups
+            mark = snap.high_water_mark
+        loaded_in = time.monotonic() - started
+        cache_refresher.set_watermark(database.watermark_from_int(mark) if mark else None)
+        caught_up = cache_refresher.run_once()
+        # Таблица групп мала: перечитываем целиком (правки настроек вне бота)
+        database.load_configured_groups()
+    except SnapshotError as e:
+        logger.warning(f"Cache snapshot {path} is corrupt ({e}); doing a full load.")
+        return False
+    except (mysql.connector.Error, OSError) as e:
+        logger.warning(f"Cache snapshot {path} could not be restored ({e}); doing a full load.")
+        return False
+    logger.info(
+        f"User caches restored from snapshot in {loaded_in:.3f}s (+{caught_up} rows caught up, "
+        f"{time.monotonic() - started:.3f}s total). Seen: {len(database.seen_users_cache)}, "
+        f"Suspicious: {len(database.suspicious_users_cache)}, Spammers: {len(database.spammers_cache)}"
+    )
+    return True
+
+
+def load_caches(path: Optional[str] = None) -> str:
+    """Стартовая загрузка групп и кэшей: снимок, если возможно, иначе полная загрузка.
+    Возвращает "snapshot" или "full". Снимок опирается на updated_at, поэтому только
+    для backend'а, который его ведёт (MySQL)."""
+    tracks_changes = database.get_storage().tracks_changes
+    if tracks_changes and restore_cache_snapshot(path):
+        return "snapshot"
+    database.load_configured_groups()
+    if tracks_changes:
+        # Отметка ДО сканирования: строки, изменённые во время загрузки, подхватит сверка
+        cache_refresher.set_watermark(database.get_user_entries_high_water_mark())
+    database.load_user_caches()
+    if tracks_changes:
+        # Следующий рестарт уже пойдёт через снимок
+        save_cache_snapshot(path)
+    return "full"
+
+
+class SnapshotWriter:
+    """Фоновый поток, периодически пишущий снимок; stop() пишет финальный."""
+
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-snapshot", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            save_cache_snapshot(self.path)
+
+    def stop(self, final: bool = True) -> None:
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join()
+        if final:
+            save_cache_snapshot(self.path)
+
+
+snapshot_writer = SnapshotWriter(CACHE_SNAPSHOT_PATH, CACHE_SNAPSHOT_INTERVAL_SECONDS)
+
+
+def start_snapshot_writer() -> bool:
+    if not CACHE_SNAPSHOT_PATH or CACHE_SNAPSHOT_INTERVAL_SECONDS <= 0 or not database.get_storage().tracks_changes:
+        return False
+    snapshot_writer.start()
+    return True
+
+
+def stop_snapshot_writer() -> None:
+    snapshot_writer.stop()
@@ -0,0 +1,1083 @@
+"""Хранилище записей пользователей и групп за UserStateRepository и функциями групп.
+
+database.py держит кэши, очередь отложенной записи и события шины; сами чтения и записи
+строк идут через backend (get_storage()), выбранный STORAGE_BACKEND:
+
+  mysql  — основной боевой вариант (MySQLStorage): пул соединений, миграции, updated_at,
+           фоновая сверка кэшей, снимки, перенос групп порциями;
+  sqlite — один файл в режиме WAL (SQLiteStorage): для одиночного инстанса без сервера БД;
+  memory — словари в памяти процесса (MemoryStorage): тесты, бенчмарки, локальный запуск.
+
+Только MySQL ведёт updated_at (tracks_changes): сверка кэшей, снимки и опрос версий
+настроек для других backend'ов не запускаются — кроме этого процесса писать в их данные
+некому; их методы отслеживания изменений бросают ChangeTrackingUnsupported. Сравнение задержек и пропускной способности: python -m app.bench storage.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import mysql.connector
+
+from .config import SQLITE_PATH, STORAGE_BACKEND
+
+# Ошибки любого backend'а: вызывающий код ловит их так же, как раньше mysql.connector.Error
+DB_ERRORS = (mysql.connector.Error, sqlite3.Error)
+
+# (user_id, group_id, seen | None, spammer): seen=None — не менять seen_message,
+# spammer=False — не менять spammer (сбрасывает флаг только clear_spammer)
+EntryRow = Tuple[int, int, Optional[bool], bool]
+# (хэш нормализованного текста, хэш инструкций группы, вердикт) — кэш вердиктов antispam.py
+VerdictRow = Tuple[bytes, bytes, bool]
+# История классификаций для обучения локального классификатора (local_classifier.py):
+# (user_id, group_id, хэш инструкций | None, текст | None, вердикт, источник).
+# Источник 'llm' — вердикт OpenAI по тексту; 'ban'/'unban' — исправление админом (без текста)
+ClassificationRow = Tuple[int, int, Optional[bytes], Optional[str], bool, str]
+
+# Горячие запросы к user_entries. Текст держим в константах: query_plans.py проверяет
+# их планы (EXPLAIN) — каждый должен читаться только из индекса (idx_user_flags, миграция 005).
+# SQLite выполняет те же запросы с плейсхолдерами "?".
+SPAMMER_ANYWHERE_SQL = "SELECT 1 FROM user_entries WHERE user_id=%s AND spammer=TRUE LIMIT 1"
+SEEN_ANYWHERE_SQL = "SELECT 1 FROM user_entries WHERE user_id=%s AND seen_message=TRUE LIMIT 1"
+GROUPS_WHERE_SPAMMER_SQL = "SELECT group_id FROM user_entries WHERE user_id=%s AND spammer=TRUE"
+SPAMMER_IN_GROUP_SQL = "SELECT 1 FROM user_entries WHERE user_id=%s AND group_id=%s AND spammer=TRUE LIMIT 1"
+USER_ENTRY_SQL = "SELECT seen_message, spammer FROM user_entries WHERE user_id=%s AND group_id=%s LIMIT 1"
+USER_STATE_SQL = """
+            SELECT MAX(spammer), MAX(seen_message), MAX(group_id = %s),
+                   MAX(CASE WHEN group_id = %s THEN seen_message END),
+                   MAX(CASE WHEN group_id = %s THEN spammer END)
+            FROM user_entries WHERE user_id = %s
+            """
+COLD_LOAD_SQL = "SELECT user_id, seen_message, spammer, group_id FROM user_entries"
+CLEAR_SPAMMER_SQL = "UPDATE user_entries SET spammer=FALSE WHERE user_id=%s AND group_id=%s"
+# Глобальный разбан: все spammer-строки пользователя -> не спамер и seen (доверие восстановлено)
+CLEAR_SPAMMER_EVERYWHERE_SQL = "UPDATE user_entries SET spammer=FALSE, seen_message=TRUE WHERE user_id=%s AND spammer=TRUE"
+
+
+def aggregate_user_flags_sql(count: int) -> str:
+    placeholders = ",".join(["%s"] * count)
+    return f"""
+            SELECT user_id, MAX(spammer), MAX(seen_message), MAX(seen_message = FALSE AND spammer = FALSE)
+            FROM user_entries WHERE user_id IN ({placeholders})
+            GROUP BY user_id
+            """
+
+
+class ChangeTrackingUnsupported(NotImplementedError):
+    """Операция требует updated_at (tracks_changes), а backend его не ведёт."""
+
+
+class StorageBackend:
+    """Операции над user_entries / groups / group_settings. Ошибки backend'а (DB_ERRORS)
+    пробрасываются: что делать при сбое, решает database.py."""
+
+    kind = "abstract"
+    tracks_changes = False  # ведёт ли updated_at (сверка кэшей, снимки, версии настроек)
+
+    def setup(self) -> List[int]:
+        """Создаёт или обновляет схему; возвращает номера применённых миграций (MySQL)."""
+        return []
+
+    def close(self) -> None:
+        pass
+
+    def ping(self) -> None:
+        """Проверка доступности (/diag): лёгкий запрос, ошибка пробрасывается."""
+        self.spammer_anywhere(0)
+
+    # ----- user_entries: чтение -----
+
+    def spammer_anywhere(self, user_id: int) -> bool:
+        raise NotImplementedError
+
+    def seen_anywhere(self, user_id: int) -> bool:
+        raise NotImplementedError
+
+    def groups_where_spammer(self, user_id: int) -> List[int]:
+        raise NotImplementedError
+
+    def spammer_in_group(self, user_id: int, group_id: int) -> bool:
+        raise NotImplementedError
+
+    def get_entry(self, user_id: int, group_id: int) -> Optional[Tuple[bool, bool]]:
+        """(seen_message, spammer) или None, если записи нет."""
+        raise NotImplementedError
+
+    def user_state(self, user_id: int, group_id: int) -> Tuple[bool, bool, Optional[Tuple[bool, bool]]]:
+        """(spammer где-либо, seen где-либо, запись этой группы или None) — одним обращением."""
+        raise NotImplementedError
+
+    def scan_user_flags(self, chunk_size: int, where: str = "", params: tuple = ()) -> Iterator[list]:
+        """Порции строк (user_id, seen_message, spammer, group_id) для холодной загрузки кэшей."""
+        raise NotImplementedError
+
+    def aggregate_user_flags(self, user_ids: Sequence[int]) -> Dict[int, Tuple[bool, bool, bool]]:
+        """user_id -> (spammer где-либо, seen где-либо, есть строка без seen и spammer);
+        пользователей без строк в ответе нет."""
+        raise NotImplementedError
+
+    # ----- отслеживание изменений (только tracks_changes) -----
+    # Сверка кэшей, снимки и опрос версий настроек вызывают их лишь при tracks_changes;
+    # backend без updated_at отвечает ChangeTrackingUnsupported, а не пустым результатом.
+
+    def _no_change_tracking(self, operation: str):
+        raise ChangeTrackingUnsupported(f"{self.kind} storage does not track updated_at ({operation})")
+
+    def group_settings_versions(self, after: Optional[datetime] = None) -> Dict[int, datetime]:
+        """{group_id: MAX(updated_at)} настроек, изменённых после after (None — всех групп)."""
+        raise NotImplementedError
+
+    def user_entries_high_water_mark(self) -> Optional[datetime]:
+        """MAX(updated_at) в user_entries (None для пустой таблицы)."""
+        raise NotImplementedError
+
+    def user_entry_changes(self, after: Tuple[datetime, int], limit: int) -> list:
+        """Строки (id, user_id, group_id, seen_message, spammer, updated_at), изменённые
+        после (updated_at, id), в порядке (updated_at, id)."""
+        raise NotImplementedError
+
+    # ----- user_entries: запись -----
+
+    def upsert_entry(self, user_id: int, group_id: int, seen: Optional[bool] = None, spammer: bool = False) -> None:
+        self.upsert_entries([(user_id, group_id, seen, spammer)])
+
+    def upsert_entries(self, rows: Sequence[EntryRow]) -> None:
+        """Вставка отсутствующих строк и обновление флагов существующих, одной транзакцией."""
+        raise NotImplementedError
+
+    def clear_spammer(self, user_id: int, group_id: int) -> None:
+        raise NotImplementedError
+
+    def clear_spammer_everywhere(self, user_id: int) -> List[int]:
+        """Снимает spammer и ставит seen во всех группах пользователя одной транзакцией;
+        возвращает группы, где флаг был."""
+        raise NotImplementedError
+
+    # ----- группы -----
+
+    def load_groups(self) -> Dict[int, Dict[str, str]]:
+        """{group_id: {parameter: value}} всех настроенных групп."""
+        raise NotImplementedError
+
+    def load_group(self, group_id: int) -> Optional[Dict[str, str]]:
+        """Настройки одной группы или None, если группы нет."""
+        raise NotImplementedError
+
+    def load_group_redirects(self) -> Dict[int, int]:
+        raise NotImplementedError
+
+    def add_group(self, group_id: int, settings: Optional[Dict[str, str]] = None) -> None:
+        """Регистрирует группу; settings (если заданы) перезаписывают одноимённые параметры."""
+        raise NotImplementedError
+
+    def remove_group(self, group_id: int) -> None:
+        raise NotImplementedError
+
+    def record_group_redirect(self, old_id: int, new_id: int) -> None:
+        raise NotImplementedError
+
+    def move_group(self, old_id: int, new_id: int) -> int:
+        """Сохраняет переадресацию old -> new и переносит строки группы на новый id одной
+        транзакцией (флаги сливаются по OR); возвращает число перенесённых строк user_entries.
+        Переадресация без переноса не остаётся даже после падения. MySQL переносит порциями
+        в фоне (group_migration.py) и этот метод не использует."""
+        raise NotImplementedError
+
+    # ----- кэш вердиктов классификации -----
+
+    def load_verdicts(self, max_age: float, limit: int) -> List[VerdictRow]:
+        """Вердикты моложе max_age секунд, новые первыми, не больше limit."""
+        raise NotImplementedError
+
+    def save_verdicts(self, rows: Sequence[VerdictRow]) -> None:
+        """Вставка или обновление (вердикт и время записи) одной транзакцией."""
+        raise NotImplementedError
+
+    def prune_verdicts(self, max_age: float) -> None:
+        raise NotImplementedError
+
+    # ----- история классификаций -----
+
+    def record_classifications(self, rows: Sequence[ClassificationRow]) -> None:
+        raise NotImplementedError
+
+    def scan_classifications(self, chunk_size: int) -> Iterator[list]:
+        """Порции строк ClassificationRow + (created_at в секундах epoch,) в порядке записи."""
+        raise NotImplementedError
+
+    def prune_classifications(self, max_age: float) -> None:
+        raise NotImplementedError
+
+
+def _connect():
+    # Поздний импорт: database импортирует этот модуль; тесты подменяют get_db_connection
+    from . import database
+    return database.get_db_connection()
+
+
+class MySQLStorage(StorageBackend):
+    """Пул соединений database.get_db_connection(); каждая операция — своё соединение."""
+
+    kind = "mysql"
+    tracks_changes = True
+
+    def _fetchone(self, sql: str, params: tuple):
+        conn = None
+        cur = None
+        try:
+            conn = _connect()
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            return cur.fetchone()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+
+    def _fetchall(self, sql: str, params: tuple = ()) -> list:
+        conn = None
+        cur = None
+        try:
+            conn = _connect()
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            return list(cur.fetchall())
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+
+    def _write(self, statements: Sequence[Tuple[str, tuple]]) -> None:
+        conn = None
+        cur = None
+        try:
+            conn = _connect()
+            cur = conn.cursor()
+            for sql, params in statements:
+                cur.execute(sql, params)
+            conn.commit()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+
+    def setup(self) -> List[int]:
+        from .migrations import run_migrations
+        conn = _connect()
+        try:
+            return run_migrations(conn)
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def ping(self) -> None:
+        self._fetchall("SELECT 1")
+
+    def spammer_anywhere(self, user_id: int) -> bool:
+        return self._fetchone(SPAMMER_ANYWHERE_SQL, (user_id,)) is not None
+
+    def seen_anywhere(self, user_id: int) -> bool:
+        return self._fetchone(SEEN_ANYWHERE_SQL, (user_id,)) is not None
+
+    def groups_where_spammer(self, user_id: int) -> List[int]:
+        return [int(row[0]) for row in self._fetchall(GROUPS_WHERE_SPAMMER_SQL, (user_id,)) if row and row[0] is not None]
+
+    def spammer_in_group(self, user_id: int, group_id: int) -> bool:
+        return self._fetchone(SPAMMER_IN_GROUP_SQL, (user_id, group_id)) is not None
+
+    def get_entry(self, user_id: int, group_id: int) -> Optional[Tuple[bool, bool]]:
+        row = self._fetchone(USER_ENTRY_SQL, (user_id, group_id))
+        return (bool(row[0]), bool(row[1])) if row is not None else None
+
+    def user_state(self, user_id: int, group_id: int):
+        row = self._fetchone(USER_STATE_SQL, (group_id, group_id, group_id, user_id))
+        spam_any, seen_any, has_entry, entry_seen, entry_spammer = row if row else (None, None, None, None, None)
+        entry = (bool(entry_seen), bool(entry_spammer)) if has_entry else None
+        return bool(spam_any), bool(seen_any), entry
+
+    def aggregate_user_flags(self, user_ids: Sequence[int]) -> Dict[int, Tuple[bool, bool, bool]]:
+        if not user_ids:
+            return {}
+        rows = self._fetchall(aggregate_user_flags_sql(len(user_ids)), tuple(user_ids))
+        return {int(uid): (bool(sp), bool(seen), bool(susp)) for uid, sp, seen, susp in rows}
+
+    def group_settings_versions(self, after: Optional[datetime] = None) -> Dict[int, datetime]:
+        if after is None:
+            rows = self._fetchall("SELECT group_id, MAX(updated_at) FROM group_settings GROUP BY group_id")
+        else:
+            rows = self._fetchall(
+                "SELECT group_id, MAX(updated_at) FROM group_settings WHERE updated_at > %s GROUP BY group_id",
+                (after,),
+            )
+        return {int(row[0]): row[1] for row in rows}
+
+    def user_entries_high_water_mark(self) -> Optional[datetime]:
+        row = self._fetchone("SELECT MAX(updated_at) FROM user_entries", ())
+        return row[0] if row else None
+
+    def user_entry_changes(self, after: Tuple[datetime, int], limit: int) -> list:
+        ts, last_id = after
+        return self._fetchall(
+            """
+            SELECT id, user_id, group_id, seen_message, spammer, updated_at
+            FROM user_entries
+            WHERE updated_at > %s OR (updated_at = %s AND id > %s)
+            ORDER BY updated_at, id
+            LIMIT %s
+            """,
+            (ts, ts, last_id, limit),
+        )
+
+    def scan_user_flags(self, chunk_size: int, where: str = "", params: tuple = ()) -> Iterator[list]:
+        # Небуферизованный курсор: строки читаются с сервера порциями, а не целиком в память
+        conn = None
+        cur = None
+        try:
+            conn = _connect()
+            cur = conn.cursor(buffered=False)
+            cur.execute(f"{COLD_LOAD_SQL} {where}".rstrip(), params)  # type: ignore[arg-type]
+            while True:
+                chunk = cur.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+
+    def upsert_entry(self, user_id: int, group_id: int, seen: Optional[bool] = None, spammer: bool = False) -> None:
+        if spammer and seen is None:
+            sql = """
+                INSERT INTO user_entries (user_id, group_id, join_date, spammer)
+                VALUES (%s, %s, NOW(), TRUE)
+                ON DUPLICATE KEY UPDATE spammer=TRUE
+                """
+        elif seen is not None and not spammer:
+            flag = "TRUE" if seen else "FALSE"
+            sql = f"""
+                INSERT INTO user_entries (user_id, group_id, join_date, seen_message)
+                VALUES (%s, %s, NOW(), {flag})
+                ON DUPLICATE KEY UPDATE seen_message={flag}
+                """
+        elif seen is None:
+            sql = """
+                INSERT INTO user_entries (user_id, group_id, join_date)
+                VALUES (%s, %s, NOW())
+                ON DUPLICATE KEY UPDATE join_date=join_date
+                """
+        else:
+            self.upsert_entries([(user_id, group_id, seen, spammer)])
+            return
+        self._write([(sql, (user_id, group_id))])
+
+    def upsert_entries(self, rows: Sequence[EntryRow]) -> None:
+        """Multi-row upsert: по одному INSERT ... ON DUPLICATE KEY UPDATE на «форму»
+        строки (меняется seen, spammer или оба), всё в одной транзакции."""
+        shapes: Dict[Tuple[bool, bool], list] = {}
+        for user_id, group_id, seen, spammer in rows:
+            shapes.setdefault((seen is not None, bool(spammer)), []).append((user_id, group_id, seen))
+        statements = []
+        for (has_seen, has_spammer), shape_rows in shapes.items():
+            columns = ["user_id", "group_id", "join_date"]
+            placeholders = ["%s", "%s", "NOW()"]
+            updates = []
+            if has_seen:
+                columns.append("seen_message")
+                placeholders.append("%s")
+                updates.append("seen_message=VALUES(seen_message)")
+            if has_spammer:
+                columns.append("spammer")
+                placeholders.append("TRUE")
+                updates.append("spammer=TRUE")
+            if not updates:
+                updates.append("join_date=join_date")
+            row_sql = "(" + ", ".join(placeholders) + ")"
+            params: list = []
+            for user_id, group_id, seen in shape_rows:
+                params.extend((user_id, group_id))
+                if has_seen:
+                    params.append(bool(seen))
+            statements.append((
+                f"INSERT INTO user_entries ({', '.join(columns)}) VALUES "
+                + ", ".join([row_sql] * len(shape_rows))
+                + " ON DUPLICATE KEY UPDATE " + ", ".join(updates),
+                tuple(params),
+            ))
+        self._write(statements)
+
+    def clear_spammer(self, user_id: int, group_id: int) -> None:
+        self._write([(CLEAR_SPAMMER_SQL, (user_id, group_id))])
+
+    def clear_spammer_everywhere(self, user_id: int) -> List[int]:
+        conn = None
+        cur = None
+        try:
+            conn = _connect()
+            cur = conn.cursor()
+            # FOR UPDATE: список групп и UPDATE видят одни и те же строки
+            cur.execute(f"{GROUPS_WHERE_SPAMMER_SQL} FOR UPDATE", (user_id,))
+            groups = [int(row[0]) for row in cur.fetchall() if row and row[0] is not None]
+            if groups:
+                cur.execute(CLEAR_SPAMMER_EVERYWHERE_SQL, (user_id,))
+            conn.commit()
+            return groups
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+
+    def load_groups(self) -> Dict[int, Dict[str, str]]:
+        conn = None
+        cur = None
+        try:
+            conn = _connect()
+            cur = conn.cursor(dictionary=True)
+            cur.execute(
+                """
+                SELECT g.group_id, s.parameter, s.value
+                FROM `groups` g
+                LEFT JOIN group_settings s ON g.group_id = s.group_id
+                """
+            )
+            groups: Dict[int, Dict[str, str]] = {}
+            for row in cur.fetchall():
+                group_id = row.get("group_id") if isinstance(row, dict) else row[0]
+                parameter = row.get("parameter") if isinstance(row, dict) else None
+                value = row.get("value") if isinstance(row, dict) else None
+                settings = groups.setdefault(group_id, {})
+                if parameter and value:
+                    settings[parameter] = value
+            return groups
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+
+    def load_group(self, group_id: int) -> Optional[Dict[str, str]]:
+        rows = self._fetchall(
+            "SELECT g.group_id, s.parameter, s.value FROM `groups` g "
+            "LEFT JOIN group_settings s ON g.group_id = s.group_id WHERE g.group_id = %s",
+            (group_id,),
+        )
+        if not rows:
+            return None
+        return {parameter: value for _gid, parameter, value in rows if parameter and value}
+
+    def load_group_redirects(self) -> Dict[int, int]:
+        return {int(old_id): int(new_id) for old_id, new_id in
+                self._fetchall("SELECT old_group_id, new_group_id FROM group_migrations")}
+
+    def add_group(self, group_id: int, settings: Optional[Dict[str, str]] = None) -> None:
+        statements = [(
+            "INSERT INTO `groups` (group_id) VALUES (%s) ON DUPLICATE KEY UPDATE group_id=group_id",
+            (group_id,),
+        )]
+        for parameter, value in (settings or {}).items():
+            statements.append((
+                "INSERT INTO `group_settings` (group_id, parameter, value) VALUES (%s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE value=%s",
+                (group_id, parameter, value, value),
+            ))
+        self._write(statements)
+
+    def remove_group(self, group_id: int) -> None:
+        self._write([
+            ("DELETE FROM `groups` WHERE group_id = %s", (group_id,)),
+            ("DELETE FROM `group_settings` WHERE group_id = %s", (group_id,)),
+        ])
+
+    def load_verdicts(self, max_age: float, limit: int) -> List[VerdictRow]:
+        rows = self._fetchall(
+            "SELECT text_hash, instructions_hash, is_spam FROM verdict_cache "
+            "WHERE created_at >= NOW() - INTERVAL %s SECOND ORDER BY created_at DESC LIMIT %s",
+            (int(max_age), int(limit)),
+        )
+        return [(bytes(text_hash), bytes(instructions_hash), bool(is_spam))
+                for text_hash, instructions_hash, is_spam in rows]
+
+    def save_verdicts(self, rows: Sequence[VerdictRow]) -> None:
+        self._write([(
+            "INSERT INTO verdict_cache (text_hash, instructions_hash, is_spam) VALUES (%s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE is_spam = VALUES(is_spam), created_at = CURRENT_TIMESTAMP",
+            (text_hash, instructions_hash, bool(is_spam)),
+        ) for text_hash, instructions_hash, is_spam in rows])
+
+    def prune_verdicts(self, max_age: float) -> None:
+        self._write([("DELETE FROM verdict_cache WHERE created_at < NOW() - INTERVAL %s SECOND", (int(max_age),))])
+
+    def record_classifications(self, rows: Sequence[ClassificationRow]) -> None:
+        self._write([(
+            "INSERT INTO classification_history "
+            "(user_id, group_id, instructions_hash, message_text, is_spam, source) VALUES (%s, %s, %s, %s, %s, %s)",
+            (user_id, group_id, instructions_hash, text, bool(is_spam), source),
+        ) for user_id, group_id, instructions_hash, text, is_spam, source in rows])
+
+    def scan_classifications(self, chunk_size: int) -> Iterator[list]:
+        conn = None
+        cur = None
+        try:
+            conn = _connect()
+            cur = conn.cursor(buffered=False)
+            cur.execute(
+                "SELECT user_id, group_id, instructions_hash, message_text, is_spam, source, "
+                "UNIX_TIMESTAMP(created_at) FROM classification_history ORDER BY id"
+            )
+            while True:
+                chunk = cur.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                yield [(user_id, group_id, bytes(ih) if ih is not None else None, text, bool(is_spam), source,
+                        float(created_at)) for user_id, group_id, ih, text, is_spam, source, created_at in chunk]
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+
+    def prune_classifications(self, max_age: float) -> None:
+        self._write([(
+            "DELETE FROM classification_history WHERE created_at < NOW() - INTERVAL %s SECOND", (int(max_age),),
+        )])
+
+
+_SQLITE_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS `groups` (group_id INTEGER PRIMARY KEY)",
+    """CREATE TABLE IF NOT EXISTS group_settings (
+        group_id INTEGER NOT NULL,
+        parameter TEXT NOT NULL,
+        value TEXT,
+        PRIMARY KEY (group_id, parameter)
+    )""",
+    """CREATE TABLE IF NOT EXISTS user_entries (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        group_id INTEGER NOT NULL,
+        join_date TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        seen_message INTEGER NOT NULL DEFAULT 0,
+        spammer INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (user_id, group_id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_user_flags ON user_entries (user_id, spammer, seen_message, group_id)",
+    "CREATE INDEX IF NOT EXISTS idx_group ON user_entries (group_id)",
+    """CREATE TABLE IF NOT EXISTS group_redirects (
+        old_group_id INTEGER PRIMARY KEY,
+        new_group_id INTEGER NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS verdict_cache (
+        text_hash BLOB NOT NULL,
+        instructions_hash BLOB NOT NULL,
+        is_spam INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (text_hash, instructions_hash)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_verdict_created_at ON verdict_cache (created_at)",
+    """CREATE TABLE IF NOT EXISTS classification_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        group_id INTEGER NOT NULL,
+        instructions_hash BLOB,
+        message_text TEXT,
+        is_spam INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_classification_created_at ON classification_history (created_at)",
+)
+
+
+def _q(sql: str) -> str:
+    return sql.replace("%s", "?")
+
+
+class SQLiteStorage(StorageBackend):
+    """Файл SQLite в режиме WAL: читатели не блокируют писателя. Соединение своё у каждого
+    потока (executor run_db, очередь отложенной записи); запись — короткие транзакции
+    BEGIN IMMEDIATE, конкурирующие писатели ждут busy_timeout."""
+
+    kind = "sqlite"
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        if path == ":memory:":
+            raise ValueError("SQLiteStorage needs a file path (use MemoryStorage for an in-memory store)")
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: транзакции открываем явно, чтения идут без BEGIN
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def _write(self, statements: Sequence[Tuple[str, Sequence]], many: bool = False) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in statements:
+                if many:
+                    conn.executemany(sql, params)
+                else:
+                    conn.execute(sql, params)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def setup(self) -> List[int]:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        for statement in _SQLITE_SCHEMA:
+            conn.execute(statement)
+        return []
+
+    def close(self) -> None:
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    def _fetchone(self, sql: str, params: tuple):
+        return self._conn().execute(_q(sql), params).fetchone()
+
+    def spammer_anywhere(self, user_id: int) -> bool:
+        return self._fetchone(SPAMMER_ANYWHERE_SQL, (user_id,)) is not None
+
+    def seen_anywhere(self, user_id: int) -> bool:
+        return self._fetchone(SEEN_ANYWHERE_SQL, (user_id,)) is not None
+
+    def groups_where_spammer(self, user_id: int) -> List[int]:
+        return [row[0] for row in self._conn().execute(_q(GROUPS_WHERE_SPAMMER_SQL), (user_id,))]
+
+    def spammer_in_group(self, user_id: int, group_id: int) -> bool:
+        return self._fetchone(SPAMMER_IN_GROUP_SQL, (user_id, group_id)) is not None
+
+    def get_entry(self, user_id: int, group_id: int) -> Optional[Tuple[bool, bool]]:
+        row = self._fetchone(USER_ENTRY_SQL, (user_id, group_id))
+        return (bool(row[0]), bool(row[1])) if row is not None else None
+
+    def user_state(self, user_id: int, group_id: int):
+        spam_any, seen_any, has_entry, entry_seen, entry_spammer = self._fetchone(
+            USER_STATE_SQL, (group_id, group_id, group_id, user_id))
+        entry = (bool(entry_seen), bool(entry_spammer)) if has_entry else None
+        return bool(spam_any), bool(seen_any), entry
+
+    def aggregate_user_flags(self, user_ids: Sequence[int]) -> Dict[int, Tuple[bool, bool, bool]]:
+        if not user_ids:
+            return {}
+        rows = self._conn().execute(_q(aggregate_user_flags_sql(len(user_ids))), tuple(user_ids)).fetchall()
+        return {int(uid): (bool(sp), bool(seen), bool(susp)) for uid, sp, seen, susp in rows}
+
+    def group_settings_versions(self, after: Optional[datetime] = None) -> Dict[int, datetime]:
+        self._no_change_tracking("group_settings_versions")
+
+    def user_entries_high_water_mark(self) -> Optional[datetime]:
+        self._no_change_tracking("user_entries_high_water_mark")
+
+    def user_entry_changes(self, after: Tuple[datetime, int], limit: int) -> list:
+        self._no_change_tracking("user_entry_changes")
+
+    def scan_user_flags(self, chunk_size: int, where: str = "", params: tuple = ()) -> Iterator[list]:
+        cur = self._conn().execute(_q(f"{COLD_LOAD_SQL} {where}".rstrip()), params)
+        try:
+            while True:
+                chunk = cur.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            cur.close()
+
+    def upsert_entries(self, rows: Sequence[EntryRow]) -> None:
+        # Одна форма запроса на сочетание (seen задан, spammer) — executemany на каждую
+        shapes: Dict[Tuple[bool, bool], list] = {}
+        for user_id, group_id, seen, spammer in rows:
+            shapes.setdefault((seen is not None, bool(spammer)), []).append(
+                (user_id, group_id, bool(seen), bool(spammer)))
+        statements = []
+        for (has_seen, has_spammer), params in shapes.items():
+            updates = []
+            if has_seen:
+                updates.append("seen_message=excluded.seen_message")
+            if has_spammer:
+                updates.append("spammer=1")
+            action = "DO UPDATE SET " + ", ".join(updates) if updates else "DO NOTHING"
+            statements.append((
+                "INSERT INTO user_entries (user_id, group_id, seen_message, spammer) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (user_id, group_id) " + action,
+                params,
+            ))
+        self._write(statements, many=True)
+
+    def clear_spammer(self, user_id: int, group_id: int) -> None:
+        self._write([(_q(CLEAR_SPAMMER_SQL), (user_id, group_id))])
+
+    def clear_spammer_everywhere(self, user_id: int) -> List[int]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            groups = [row[0] for row in conn.execute(_q(GROUPS_WHERE_SPAMMER_SQL), (user_id,))]
+            if groups:
+                conn.execute(_q(CLEAR_SPAMMER_EVERYWHERE_SQL), (user_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return groups
+
+    def load_groups(self) -> Dict[int, Dict[str, str]]:
+        groups: Dict[int, Dict[str, str]] = {}
+        for group_id, parameter, value in self._conn().execute(
+            "SELECT g.group_id, s.parameter, s.value FROM `groups` g "
+            "LEFT JOIN group_settings s ON g.group_id = s.group_id"
+        ):
+            settings = groups.setdefault(group_id, {})
+            if parameter and value:
+                settings[parameter] = value
+        return groups
+
+    def load_group(self, group_id: int) -> Optional[Dict[str, str]]:
+        rows = self._conn().execute(
+            "SELECT g.group_id, s.parameter, s.value FROM `groups` g "
+            "LEFT JOIN group_settings s ON g.group_id = s.group_id WHERE g.group_id = ?",
+            (group_id,),
+        ).fetchall()
+        if not rows:
+            return None
+        return {parameter: value for _gid, parameter, value in rows if parameter and value}
+
+    def load_group_redirects(self) -> Dict[int, int]:
+        return dict(self._conn().execute("SELECT old_group_id, new_group_id FROM group_redirects").fetchall())
+
+    def add_group(self, group_id: int, settings: Optional[Dict[str, str]] = None) -> None:
+        statements = [("INSERT OR IGNORE INTO `groups` (group_id) VALUES (?)", (group_id,))]
+        for parameter, value in (settings or {}).items():
+            statements.append((
+                "INSERT INTO group_settings (group_id, parameter, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (group_id, parameter) DO UPDATE SET value=excluded.value",
+                (group_id, parameter, value),
+            ))
+        self._write(statements)
+
+    def remove_group(self, group_id: int) -> None:
+        self._write([
+            ("DELETE FROM `groups` WHERE group_id = ?", (group_id,)),
+            ("DELETE FROM group_settings WHERE group_id = ?", (group_id,)),
+        ])
+
+    def record_group_redirect(self, old_id: int, new_id: int) -> None:
+        self._write([(
+            "INSERT INTO group_redirects (old_group_id, new_group_id) VALUES (?, ?) "
+            "ON CONFLICT (old_group_id) DO UPDATE SET new_group_id=excluded.new_group_id",
+            (old_id, new_id),
+        )])
+
+    def move_group(self, old_id: int, new_id: int) -> int:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO group_redirects (old_group_id, new_group_id) VALUES (?, ?) "
+                "ON CONFLICT (old_group_id) DO UPDATE SET new_group_id=excluded.new_group_id",
+                (old_id, new_id),
+            )
+            conn.execute("UPDATE OR IGNORE `groups` SET group_id = ? WHERE group_id = ?", (new_id, old_id))
+            conn.execute("DELETE FROM `groups` WHERE group_id = ?", (old_id,))
+            conn.execute("UPDATE OR IGNORE group_settings SET group_id = ? WHERE group_id = ?", (new_id, old_id))
+            conn.execute("DELETE FROM group_settings WHERE group_id = ?", (old_id,))
+            # WHERE у SELECT обязателен: иначе ON CONFLICT разбирается как часть JOIN
+            moved = conn.execute(
+                "INSERT INTO user_entries (user_id, group_id, join_date, seen_message, spammer) "
+                "SELECT user_id, ?, join_date, seen_message, spammer FROM user_entries WHERE group_id = ? "
+                "ON CONFLICT (user_id, group_id) DO UPDATE SET "
+                "seen_message = MAX(seen_message, excluded.seen_message), spammer = MAX(spammer, excluded.spammer)",
+                (new_id, old_id),
+            ).rowcount
+            conn.execute("DELETE FROM user_entries WHERE group_id = ?", (old_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return moved
+
+    def load_verdicts(self, max_age: float, limit: int) -> List[VerdictRow]:
+        rows = self._conn().execute(
+            "SELECT text_hash, instructions_hash, is_spam FROM verdict_cache "
+            "WHERE created_at >= ? ORDER BY created_at DESC LIMIT ?",
+            (time.time() - max_age, int(limit)),
+        ).fetchall()
+        return [(bytes(text_hash), bytes(instructions_hash), bool(is_spam))
+                for text_hash, instructions_hash, is_spam in rows]
+
+    def save_verdicts(self, rows: Sequence[VerdictRow]) -> None:
+        now = time.time()
+        self._write([(
+            "INSERT INTO verdict_cache (text_hash, instructions_hash, is_spam, created_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (text_hash, instructions_hash) DO UPDATE SET "
+            "is_spam = excluded.is_spam, created_at = excluded.created_at",
+            [(text_hash, instructions_hash, int(bool(is_spam)), now) for text_hash, instructions_hash, is_spam in rows],
+        )], many=True)
+
+    def prune_verdicts(self, max_age: float) -> None:
+        self._write([("DELETE FROM verdict_cache WHERE created_at < ?", (time.time() - max_age,))])
+
+    def record_classifications(self, rows: Sequence[ClassificationRow]) -> None:
+        now = time.time()
+        self._write([(
+            "INSERT INTO classification_history "
+            "(user_id, group_id, instructions_hash, message_text, is_spam, source, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(user_id, group_id, instructions_hash, text, int(bool(is_spam)), source, now)
+             for user_id, group_id, instructions_hash, text, is_spam, source in rows],
+        )], many=True)
+
+    def scan_classifications(self, chunk_size: int) -> Iterator[list]:
+        cur = self._conn().execute(
+            "SELECT user_id, group_id, instructions_hash, message_text, is_spam, source, created_at "
+            "FROM classification_history ORDER BY id"
+        )
+        try:
+            while True:
+                chunk = cur.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                yield [(user_id, group_id, bytes(ih) if ih is not None else None, text, bool(is_spam), source, created_at)
+                       for user_id, group_id, ih, text, is_spam, source, created_at in chunk]
+        finally:
+            cur.close()
+
+    def prune_classifications(self, max_age: float) -> None:
+        self._write([("DELETE FROM classification_history WHERE created_at < ?", (time.time() - max_age,))])
+
+
+class MemoryStorage(StorageBackend):
+    """Данные только в памяти процесса (теряются при рестарте). Один RLock на всё;
+    индекс user_id -> {group_id: [seen, spammer]} даёт запросы по пользователю без сканов."""
+
+    kind = "memory"
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries: Dict[int, Dict[int, list]] = {}
+        self._groups: Dict[int, Dict[str, str]] = {}
+        self._redirects: Dict[int, int] = {}
+        self._verdicts: Dict[Tuple[bytes, bytes], Tuple[bool, float]] = {}
+        self._classifications: List[tuple] = []
+
+    def spammer_anywhere(self, user_id: int) -> bool:
+        with self._lock:
+            return any(flags[1] for flags in self._entries.get(user_id, {}).values())
+
+    def seen_anywhere(self, user_id: int) -> bool:
+        with self._lock:
+            return any(flags[0] for flags in self._entries.get(user_id, {}).values())
+
+    def groups_where_spammer(self, user_id: int) -> List[int]:
+        with self._lock:
+            return [gid for gid, flags in self._entries.get(user_id, {}).items() if flags[1]]
+
+    def spammer_in_group(self, user_id: int, group_id: int) -> bool:
+        entry = self.get_entry(user_id, group_id)
+        return bool(entry and entry[1])
+
+    def get_entry(self, user_id: int, group_id: int) -> Optional[Tuple[bool, bool]]:
+        with self._lock:
+            flags = self._entries.get(user_id, {}).get(group_id)
+            return (flags[0], flags[1]) if flags is not None else None
+
+    def user_state(self, user_id: int, group_id: int):
+        with self._lock:
+            groups = self._entries.get(user_id, {})
+            flags = groups.get(group_id)
+            return (
+                any(f[1] for f in groups.values()),
+                any(f[0] for f in groups.values()),
+                (flags[0], flags[1]) if flags is not None else None,
+            )
+
+    def aggregate_user_flags(self, user_ids: Sequence[int]) -> Dict[int, Tuple[bool, bool, bool]]:
+        result = {}
+        with self._lock:
+            for uid in user_ids:
+                groups = self._entries.get(uid)
+                if groups:
+                    flags = list(groups.values())
+                    result[uid] = (any(f[1] for f in flags), any(f[0] for f in flags),
+                                   any(not f[0] and not f[1] for f in flags))
+        return result
+
+    def group_settings_versions(self, after: Optional[datetime] = None) -> Dict[int, datetime]:
+        self._no_change_tracking("group_settings_versions")
+
+    def user_entries_high_water_mark(self) -> Optional[datetime]:
+        self._no_change_tracking("user_entries_high_water_mark")
+
+    def user_entry_changes(self, after: Tuple[datetime, int], limit: int) -> list:
+        self._no_change_tracking("user_entry_changes")
+
+    def scan_user_flags(self, chunk_size: int, where: str = "", params: tuple = ()) -> Iterator[list]:
+        if where:
+            raise ValueError("MemoryStorage.scan_user_flags does not support SQL filters")
+        with self._lock:
+            rows = [(uid, flags[0], flags[1], gid) for uid, groups in self._entries.items()
+                    for gid, flags in groups.items()]
+        for start in range(0, len(rows), max(1, chunk_size)):
+            yield rows[start:start + chunk_size]
+
+    def upsert_entries(self, rows: Sequence[EntryRow]) -> None:
+        with self._lock:
+            for user_id, group_id, seen, spammer in rows:
+                flags = self._entries.setdefault(user_id, {}).setdefault(group_id, [False, False])
+                if seen is not None:
+                    flags[0] = bool(seen)
+                if spammer:
+                    flags[1] = True
+
+    def clear_spammer(self, user_id: int, group_id: int) -> None:
+        with self._lock:
+            flags = self._entries.get(user_id, {}).get(group_id)
+            if flags is not None:
+                flags[1] = False
+
+    def clear_spammer_everywhere(self, user_id: int) -> List[int]:
+        groups = []
+        with self._lock:
+            for gid, flags in self._entries.get(user_id, {}).items():
+                if flags[1]:
+                    flags[0], flags[1] = True, False
+                    groups.append(gid)
+        return groups
+
+    def load_groups(self) -> Dict[int, Dict[str, str]]:
+        with self._lock:
+            return {gid: dict(settings) for gid, settings in self._groups.items()}
+
+    def load_group(self, group_id: int) -> Optional[Dict[str, str]]:
+        with self._lock:
+            settings = self._groups.get(group_id)
+            return dict(settings) if settings is not None else None
+
+    def load_group_redirects(self) -> Dict[int, int]:
+        with self._lock:
+            return dict(self._redirects)
+
+    def add_group(self, group_id: int, settings: Optional[Dict[str, str]] = None) -> None:
+        with self._lock:
+            self._groups.setdefault(group_id, {}).update(settings or {})
+
+    def remove_group(self, group_id: int) -> None:
+        with self._lock:
+            self._groups.pop(group_id, None)
+
+    def record_group_redirect(self, old_id: int, new_id: int) -> None:
+        with self._lock:
+            self._redirects[old_id] = new_id
+
+    def move_group(self, old_id: int, new_id: int) -> int:
+        moved = 0
+        with self._lock:
+            self._redirects[old_id] = new_id
+            if old_id in self._groups:
+                settings = self._groups.pop(old_id)
+                self._groups.setdefault(new_id, settings)
+            for groups in self._entries.values():
+                flags = groups.pop(old_id, None)
+                if flags is None:
+                    continue
+                target = groups.setdefault(new_id, [False, False])
+                target[0] = target[0] or flags[0]
+                target[1] = target[1] or flags[1]
+                moved += 1
+        return moved
+
+    def load_verdicts(self, max_age: float, limit: int) -> List[VerdictRow]:
+        cutoff = time.time() - max_age
+        with self._lock:
+            items = sorted(self._verdicts.items(), key=lambda item: item[1][1], reverse=True)
+        fresh = [(key[0], key[1], verdict) for key, (verdict, created_at) in items if created_at >= cutoff]
+        return fresh[:int(limit)]
+
+    def save_verdicts(self, rows: Sequence[VerdictRow]) -> None:
+        now = time.time()
+        with self._lock:
+            for text_hash, instructions_hash, is_spam in rows:
+                self._verdicts[(text_hash, instructions_hash)] = (bool(is_spam), now)
+
+    def prune_verdicts(self, max_age: float) -> None:
+        cutoff = time.time() - max_age
+        with self._lock:
+            for key in [k for k, (_verdict, created_at) in self._verdicts.items() if created_at < cutoff]:
+                del self._verdicts[key]
+
+    def record_classifications(self, rows: Sequence[ClassificationRow]) -> None:
+        now = time.time()
+        with self._lock:
+            self._classifications.extend((*row[:4], bool(row[4]), row[5], now) for row in rows)
+
+    def scan_classifications(self, chunk_size: int) -> Iterator[list]:
+        with self._lock:
+            rows = list(self._classifications)
+        for start in range(0, len(rows), max(1, chunk_size)):
+            yield rows[start:start + chunk_size]
+
+    def prune_classifications(self, max_age: float) -> None:
+        cutoff = time.time() - max_age
+        with self._lock:
+            self._classifications = [row for row in self._classifications if row[6] >= cutoff]
+
+
+def create_storage(kind: str = STORAGE_BACKEND, sqlite_path: str = SQLITE_PATH) -> StorageBackend:
+    kind = (kind or "mysql").strip().lower()
+    if kind == "mysql":
+        return MySQLStorage()
+    if kind == "sqlite":
+        return SQLiteStorage(sqlite_path)
+    if kind == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND {kind!r} (expected mysql, sqlite or memory)")
+
+
+_storage: Optional[StorageBackend] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    """Singleton backend'а по STORAGE_BACKEND (создаётся лениво)."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage()
+    return _storage
+
+
+def set_storage(backend: Optional[StorageBackend]) -> Optional[StorageBackend]:
+    """Подменяет backend (тесты, бенчмарк); None — вернуться к STORAGE_BACKEND при следующем
+    обращении. Возвращает прежний."""
+    global _storage
+    with _storage_lock:
+        previous, _storage = _storage, backend
+    return previous
@@ -8,12 +8,26 @@ from telegram.ext import (
 )
 from .formatting import display_chat, display_user
 from .database import (
+    DB_ERRORS,
     is_group_configured,
     add_configured_group,
-    get_user_state_repo,
-    groups_where_spammer,
+    get_async_user_state_repo,
+    get_db_pool_stats,
+    get_write_behind_stats,
+    get_user_entry_cache_stats,
+    get_negative_cache_stats,
+    get_spam_groups_index_stats,
+    get_write_suppression_stats,
+    resolve_group_id,
+    run_db,
 )
-import mysql.connector
+from .antispam import get_openai_stats, get_verdict_cache_stats
+from .local_classifier import get_local_classifier_stats, record_correction
+from .near_duplicates import get_near_duplicate_stats
+from .cache_refresh import get_cache_refresh_stats
+from .cache_bus import get_cache_bus_stats
+from .group_migration import get_group_migration_stats
+from .settings_reload import refresh_group_settings
 from .config import *
 
 try:
@@ -100,10 +114,9 @@ async def start_command(update: Update, context: CallbackContext) -> None:
 
     if getattr(chat, 'type', None) == "private":
         # Если пользователь глобально помечен спамером – показать персональный отчёт
-        from .database import groups_where_spammer
         from .logging_setup import log_event
-        repo = get_user_state_repo()
-        spam_groups = groups_where_spammer(user.id)
+        repo = get_async_user_state_repo()
+        spam_groups = await repo.groups_with_spam_flag(user.id)
         if spam_groups:
             # Дудос-защита: детальную информацию (админы + инвайт) показываем только для первой группы.
             # Остальные группы перечисляем текстово без запросов get_chat_administrators / create_chat_invite_link.
@@ -306,17 +319,18 @@ async def user_command(update: Update, context: CallbackContext) -> None:
         except Exception:
             pass
         return
-    repo = get_user_state_repo()
-    is_spammer = repo.is_spammer(target_id)
-    is_seen_any = repo.is_seen(target_id)
-    is_suspicious = repo.is_suspicious(target_id)
-    spam_groups = groups_where_spammer(target_id)
+    repo = get_async_user_state_repo()
+    is_spammer = await repo.is_spammer(target_id)
+    is_seen_any = await repo.is_seen(target_id)
+    is_suspicious = await repo.is_suspicious(target_id)
+    spam_groups = await repo.groups_with_spam_flag(target_id)
     status_lines = [
         f"User: {target_id}",
         f"Spammer: {'YES' if is_spammer else 'NO'}", 
         f"Seen anywhere: {'YES' if is_seen_any else 'NO'}",
         f"Suspicious: {'YES' if is_suspicious else 'NO'}",
-        f"Spam groups: {', '.join(map(str, spam_groups)) if spam_groups else 'None'}"
+        f"Spam groups: {', '.join(map(str, spam_groups)) if spam_groups else 'None'}",
+        f"Spam group count: {len(spam_groups)}",
     ]
     try:
         await message.reply_text("\n".join(status_lines))
@@ -324,6 +338,55 @@ async def user_command(update: Update, context: CallbackContext) -> None:
         pass
     logger.debug(f"Admin inspected user {target_id} via /user command")
 
+@with_update_id
+async def reload_group_command(update: Update, context: CallbackContext) -> None:
+    """Команда /reload_group <group_id>: только в личке с админом; перечитывает настройки группы из БД."""
+    user = getattr(update, 'effective_user', None)
+    chat = getattr(update, 'effective_chat', None)
+    message = getattr(update, 'message', None)
+    if user is None or chat is None or message is None:
+        return
+    if getattr(chat, 'type', None) != 'private':
+        logger.debug("/reload_group invoked outside private chat")
+        return
+    if not ADMIN_TELEGRAM_ID or str(getattr(user, 'id', '')) != str(ADMIN_TELEGRAM_ID):
+        try:
+            await message.reply_text("Только администратор может использовать эту команду.")
+        except Exception:
+            pass
+        logger.debug("/reload_group invoked by non-admin in private chat")
+        return
+    args = (getattr(message, 'text', '') or '').strip().split()
+    try:
+        group_id = resolve_group_id(int(args[1]))
+    except (IndexError, ValueError):
+        try:
+            await message.reply_text("Использование: /reload_group <group_id>")
+        except Exception:
+            pass
+        return
+    try:
+        present = await run_db(refresh_group_settings, group_id)
+    except DB_ERRORS as e:
+        logger.exception(f"Failed to reload settings of group {group_id}: {e}")
+        try:
+            await message.reply_text(f"Ошибка БД при перечитывании настроек группы {group_id}.")
+        except Exception:
+            pass
+        return
+    from .database import configured_groups_cache
+    if present:
+        settings = configured_groups_cache.settings(group_id)
+        reply = f"Настройки группы {group_id} перечитаны: {', '.join(sorted(settings)) or 'нет параметров'}."
+    else:
+        reply = f"Группа {group_id} не найдена в БД и убрана из списка настроенных."
+    try:
+        await message.reply_text(reply)
+    except Exception:
+        pass
+    from .logging_setup import log_event
+    log_event('admin_reload_group', group_id=group_id, present=present)
+
 @with_update_id
 async def unban_command(update: Update, context: CallbackContext) -> None:
     """Команда /unban <id>: глобальная очистка spam-флага (админ в личке)."""
@@ -361,40 +424,32 @@ async def unban_command(update: Update, context: CallbackContext) -> None:
         except Exception:
             pass
         return
-    repo = get_user_state_repo()
-    spam_groups = groups_where_spammer(target_id)
-    if not spam_groups:
+    repo = get_async_user_state_repo()
+    # Одна транзакция: spammer снимается во всех группах, seen восстанавливается
+    try:
+        cleared = await repo.clear_spammer_everywhere(target_id)
+    except DB_ERRORS as e:
+        logger.exception(f"Failed to clear spammer flags for user {target_id}: {e}")
         try:
-            await message.reply_text("Пользователь не помечен как спамер.")
+            await message.reply_text("Ошибка БД при снятии флагов спама.")
         except Exception:
             pass
-        logger.debug(f"/unban on non-spammer {target_id}")
         return
-    cleared = []
-    for gid in list(spam_groups):
+    if not cleared:
         try:
-            repo.clear_spammer(target_id, gid)
-            # Mark user as seen in each group we cleared spam flag for (восстановление доверия)
-            try:
-                repo.mark_seen(target_id, gid)
-            except Exception:
-                pass
-            cleared.append(gid)
+            await message.reply_text("Пользователь не помечен как спамер.")
         except Exception:
-            logger.exception(f"Failed to clear spammer flag for user {target_id} in group {gid}")
-    # After clearing, re-evaluate global spam cache
-    remaining = groups_where_spammer(target_id)
-    if not remaining:
-        from .database import spammers_cache, not_spammers_cache
-        if target_id in spammers_cache:
-            spammers_cache.discard(target_id)
-        not_spammers_cache.add(target_id)
+            pass
+        logger.debug(f"/unban on non-spammer {target_id}")
+        return
     try:
-        await message.reply_text(f"Очищены флаги спама в группах: {', '.join(map(str, cleared)) if cleared else 'None'}")
+        await message.reply_text(f"Очищены флаги спама в группах: {', '.join(map(str, cleared))}")
     except Exception:
         pass
     from .logging_setup import log_event
     log_event('admin_global_unban', target_user_id=target_id, cleared_groups=cleared)
+    # Исправление для обучения локального классификатора: сообщения пользователя — не спам
+    record_correction(target_id, 0, is_spam=False)
     logger.debug(f"/unban cleared spam flags for {target_id} in {cleared}")
 
 @with_update_id
@@ -438,7 +493,8 @@ async def ban_command(update: Update, context: CallbackContext) -> None:
     user_part, group_part = token.split('@', 1)
     try:
         target_user_id = int(user_part)
-        target_group_id = int(group_part)
+        # Старый id мигрировавшей группы -> актуальный
+        target_group_id = resolve_group_id(int(group_part))
     except ValueError:
         try:
             await message.reply_text("user_id и group_id должны быть числами.")
@@ -455,11 +511,12 @@ async def ban_command(update: Update, context: CallbackContext) -> None:
             logger.exception(f"Failed to send group not configured message in /ban: {e}")
         logger.debug(f"/ban refused for group {target_group_id}: group not configured")
         return
-    from .database import get_user_state_repo
-    repo = get_user_state_repo()
+    repo = get_async_user_state_repo()
     # Пометить как спамера и unseen->spam с доверительным обновлением кэша
     try:
-        db_success = bool(repo.mark_spammer(target_user_id, target_group_id))
+        db_success = bool(await repo.mark_spammer(target_user_id, target_group_id))
+        if db_success:
+            record_correction(target_user_id, target_group_id, is_spam=True)
         # Сразу удалим из suspicious если был
         from .database import suspicious_users_cache
         suspicious_users_cache.discard(target_user_id)
@@ -517,6 +574,20 @@ async def diag_command(update: Update, context: CallbackContext) -> None:
       GROUPS_SPAM: [...]
       GLOBAL_CACHE_SPAM / SEEN_ANY / SUSPICIOUS: YES/NO
       DRY_SELECT: OK/FAIL:err
+      STORAGE: backend хранилища (mysql / sqlite / memory)
+      DB_POOL: статистика пула соединений
+      WRITE_BEHIND: состояние очереди отложенной записи
+      WRITE_SUPPRESSION: пропущенные/выполненные избыточные записи по видам и общая доля пропусков
+      ENTRY_CACHE: hit/miss и заполненность кэша записей (user, group)
+      CACHE_REFRESH: инкрементальная сверка кэшей с БД (отметка, циклы, ошибки)
+      NEG_CACHE: negative caches (записи, фильтр Блума, доля ложных срабатываний, запросы в БД)
+      SPAM_INDEX: индекс групп спамеров (готовность, пользователи, пары, спамеры в нескольких группах)
+      CACHE_BUS: шина инвалидации между воркерами (бэкенд, отправлено/получено, очередь)
+      GROUP_MIGRATION: фоновый перенос групп на новый chat_id (очередь, строки, переадресации)
+      OPENAI: запросы к OpenAI (лимит параллельности, в полёте, таймауты, ошибки, батчи)
+      VERDICT_CACHE: кэш вердиктов (заполненность, hit rate, схлопнутые запросы, сохранение в БД)
+      NEAR_DUPLICATES: индекс SimHash близких копий спама (размер, порог, hit rate, вытеснения)
+      LOCAL_CLASSIFIER: локальный классификатор (модель, вердикты spam/ham/эскалации, запись и очистка истории)
     Также пишет structured лог admin_diag.
     """
     user = getattr(update, 'effective_user', None)
@@ -539,30 +610,26 @@ async def diag_command(update: Update, context: CallbackContext) -> None:
     except ValueError:
         await message.reply_text("Неверный формат.")
         return
-    repo = get_user_state_repo()
+    repo = get_async_user_state_repo()
     from .database import spammers_cache, seen_users_cache, suspicious_users_cache
     db_ok = False
     entry = None
     try:
-        entry = repo.entry(target_user_id, target_group_id)
+        entry = await repo.entry(target_user_id, target_group_id)
         db_ok = True
     except Exception as e:
         entry = f"ERROR:{e}"
     try:
-        is_spammer_in_group = repo.is_spammer_in_group(target_user_id, target_group_id)
+        is_spammer_in_group = await repo.is_spammer_in_group(target_user_id, target_group_id)
     except Exception:
         is_spammer_in_group = False
     try:
-        spam_groups = repo.groups_with_spam_flag(target_user_id)
+        spam_groups = await repo.groups_with_spam_flag(target_user_id)
     except Exception:
         spam_groups = []
     # Dry connectivity check
     try:
-        from .database import get_db_connection
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT 1")
-        cur.close(); conn.close()
+        await run_db(_dry_select)
         dry = 'OK'
     except Exception as e:
         dry = f"FAIL:{e}"
@@ -575,6 +642,20 @@ async def diag_command(update: Update, context: CallbackContext) -> None:
         f"SEEN_ANY: {'YES' if target_user_id in seen_users_cache else 'NO'}",
         f"SUSPICIOUS: {'YES' if target_user_id in suspicious_users_cache else 'NO'}",
         f"DRY_SELECT: {dry}",
+        f"STORAGE: {STORAGE_BACKEND}",
+        f"DB_POOL: {_format_pool_stats()}",
+        f"WRITE_BEHIND: {_format_write_behind_stats()}",
+        f"WRITE_SUPPRESSION: {_format_write_suppression_stats()}",
+        f"ENTRY_CACHE: {_format_entry_cache_stats()}",
+        f"CACHE_REFRESH: {_format_cache_refresh_stats()}",
+        f"NEG_CACHE: {_format_negative_cache_stats()}",
+        f"SPAM_INDEX: {_format_spam_index_stats()}",
+        f"CACHE_BUS: {_format_cache_bus_stats()}",
+        f"GROUP_MIGRATION: {_format_group_migration_stats()}",
+        f"OPENAI: {_format_openai_stats()}",
+        f"VERDICT_CACHE: {_format_verdict_cache_stats()}",
+        f"NEAR_DUPLICATES: {_format_near_duplicate_stats()}",
+        f"LOCAL_CLASSIFIER: {_format_local_classifier_stats()}",
     ]
     try:
         await message.reply_text("\n".join(lines))
@@ -583,4 +664,95 @@ async def diag_command(update: Update, context: CallbackContext) -> None:
     from .logging_setup import log_event
     log_event('admin_diag', target_user_id=target_user_id, target_group_id=target_group_id,
               db_connect=db_ok, entry=entry, spam_groups=spam_groups,
-              is_spammer_in_group=is_spammer_in_group, dry=dry)
+              is_spammer_in_group=is_spammer_in_group, dry=dry, db_pool=get_db_pool_stats(),
+              entry_cache=get_user_entry_cache_stats())
+
+
+def _dry_select():
+    from .database import get_storage
+    get_storage().ping()
+
+
+def _format_pool_stats() -> str:
+    stats = get_db_pool_stats()
+    keys = ("size", "open", "in_use", "idle", "created", "reused", "recycled", "broken", "waits", "timeouts")
+    return " ".join(f"{k}={stats[k]}" for k in keys if k in stats)
+
+
+def _format_write_behind_stats() -> str:
+    stats = get_write_behind_stats()
+    keys = ("active", "pending", "enqueued", "coalesced", "flushed_rows", "flush_batches", "flush_errors")
+    return " ".join(f"{k}={stats[k]}" for k in keys if k in stats)
+
+
+def _format_entry_cache_stats() -> str:
+    stats = get_user_entry_cache_stats()
+    keys = ("size", "max_size", "hits", "misses", "hit_rate", "evictions", "expirations", "invalidations", "stale_fills")
+    return " ".join(f"{k}={stats[k]}" for k in keys if k in stats)
+
+
+def _format_openai_stats() -> str:
+    stats = get_openai_stats()
+    keys = ("max_concurrency", "in_flight", "calls", "timeouts", "queue_timeouts", "errors", "batches",
+            "batched_messages", "max_batch", "missing_verdicts")
+    return " ".join(f"{k}={stats[k]}" for k in keys)
+
+
+def _format_verdict_cache_stats() -> str:
+    stats = get_verdict_cache_stats()
+    keys = ("size", "max_size", "hits", "misses", "hit_rate", "coalesced", "inflight", "loaded", "persisted",
+            "persist_errors")
+    return " ".join(f"{k}={stats[k]}" for k in keys if k in stats)
+
+
+def _format_near_duplicate_stats() -> str:
+    stats = get_near_duplicate_stats()
+    keys = ("size", "max_size", "max_distance", "hits", "misses", "hit_rate", "added", "evictions", "expirations")
+    return " ".join(f"{k}={stats[k]}" for k in keys)
+
+
+def _format_local_classifier_stats() -> str:
+    stats = get_local_classifier_stats()
+    keys = ("loaded", "samples", "scopes", "spam", "ham", "escalated", "out_of_scope", "recorded", "record_errors",
+            "prunes")
+    return " ".join(f"{k}={stats[k]}" for k in keys if k in stats)
+
+
+def _format_write_suppression_stats() -> str:
+    stats = get_write_suppression_stats()
+    # kind=suppressed/executed
+    parts = [f"{kind}={c['suppressed']}/{c['executed']}" for kind, c in stats.items() if kind != "total"]
+    return " ".join(parts + [f"suppressed_rate={stats['total']['suppressed_rate']}"])
+
+
+def _format_spam_index_stats() -> str:
+    stats = get_spam_groups_index_stats()
+    return " ".join(f"{k}={stats[k]}" for k in ("ready", "users", "pairs", "multi_group_users"))
+
+
+def _format_cache_refresh_stats() -> str:
+    stats = get_cache_refresh_stats()
+    keys = ("active", "watermark", "cycles", "rows", "users", "errors", "last_cycle_seconds")
+    return " ".join(f"{k}={stats[k]}" for k in keys if k in stats)
+
+
+def _format_cache_bus_stats() -> str:
+    stats = get_cache_bus_stats()
+    keys = ("backend", "active", "origin", "published", "sent", "received", "applied", "late", "outbox", "dropped",
+            "errors")
+    return " ".join(f"{k}={stats[k]}" for k in keys if k in stats)
+
+
+def _format_group_migration_stats() -> str:
+    stats = get_group_migration_stats()
+    keys = ("active", "pending", "completed", "rows", "errors", "redirects")
+    return " ".join(f"{k}={stats[k]}" for k in keys if k in stats)
+
+
+def _format_negative_cache_stats() -> str:
+    stats = get_negative_cache_stats()
+    keys = ("size", "hits", "misses", "bloom_negatives", "bloom_items", "bloom_fp_rate", "db_fallbacks")
+    return " | ".join(
+        f"{name}: " + " ".join(f"{k}={stats[name][k]}" for k in keys if k in stats[name])
+        for name in ("spammer", "seen")
+    )
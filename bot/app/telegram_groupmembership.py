@@ -15,13 +15,16 @@ from telegram.ext import (
 )
 from .formatting import display_chat, display_user
 from .database import (
+    DB_ERRORS,
     configured_groups_cache,
     spammers_cache,
     suspicious_users_cache,
-    get_user_state_repo,
+    get_async_user_state_repo,
+    register_channel_group,
+    remove_configured_group,
+    run_db,
 )
 from .send_safe import send_message_with_migration
-import mysql.connector
 from .config import *
 
 
@@ -47,20 +50,16 @@ async def handle_my_chat_members(update: Update, context: CallbackContext) -> No
     if getattr(member, 'user', None) and member.user.id == context.bot.id:
         # Сценарии изменения статуса бота
         if isinstance(member, ChatMemberAdministrator):
+            configured_groups_cache.set_bot_rights(
+                chat_id, "administrator",
+                can_delete_messages=bool(getattr(member, 'can_delete_messages', False)),
+                can_restrict_members=bool(getattr(member, 'can_restrict_members', False)),
+            )
             if chat_obj.type == "channel":
                 try:
-                    conn = mysql.connector.connect(**DB_CONFIG)
-                    cursor = conn.cursor()
-                    cursor.execute(
-                        "INSERT INTO `groups` (group_id) VALUES (%s) ON DUPLICATE KEY UPDATE group_id = %s",
-                        (chat_id, chat_id),
-                    )
-                    conn.commit()
-                    cursor.close()
-                    conn.close()
-                    configured_groups_cache.append({"group_id": chat_id, "settings": {}})
+                    await run_db(register_channel_group, chat_id)
                     log_event("channel_configured", chat=chat_obj, user=from_user)
-                except mysql.connector.Error as err:
+                except DB_ERRORS as err:
                     log_event("channel_config_error", chat=chat_obj, user=from_user, error=str(err))
                     raise SystemExit("Bot added to channel and database update failed.")
             else:
@@ -73,23 +72,16 @@ async def handle_my_chat_members(update: Update, context: CallbackContext) -> No
                     else:
                             raise
         elif isinstance(member, ChatMemberMember):
+            configured_groups_cache.set_bot_rights(chat_id, "member")
             log_event("bot_no_admin_rights", chat=chat_obj, user=from_user)
             await send_message_with_migration(context.bot, chat_id, text="I need administrator rights, I cannot protect your group from spam without them. Please promote me to an administrator.")
         elif isinstance(member, (ChatMemberLeft, ChatMemberBanned)):
             log_event("bot_removed", chat=chat_obj, user=from_user)
-            group = next((g for g in configured_groups_cache if g["group_id"] == chat_id), None)
-            if group:
+            if chat_id in configured_groups_cache:
                 try:
-                    conn = mysql.connector.connect(**DB_CONFIG)
-                    cursor = conn.cursor()
-                    cursor.execute("DELETE FROM `groups` WHERE group_id = %s", (chat_id,))
-                    cursor.execute("DELETE FROM `group_settings` WHERE group_id = %s", (chat_id,))
-                    conn.commit()
-                    cursor.close()
-                    conn.close()
-                    configured_groups_cache.remove(group)
+                    await run_db(remove_configured_group, chat_id)
                     log_event("group_removed_db", chat=chat_obj, user=from_user)
-                except mysql.connector.Error as err:
+                except DB_ERRORS as err:
                     log_event("group_remove_error", chat=chat_obj, user=from_user, error=str(err))
                     raise SystemExit("Bot removed from group and database update failed.")
                 log_event("bot_removed_confirm", chat=chat_obj, user=from_user)
@@ -127,7 +119,7 @@ async def handle_other_chat_members(update: Update, context: CallbackContext) ->
         return
 
     # 1. Админ мог разбанить локального спамера (из BANNED -> MEMBER)
-    repo = get_user_state_repo()
+    repo = get_async_user_state_repo()
     prev_status = ''
     new_status = ''
     if old_member is not None:
@@ -139,14 +131,14 @@ async def handle_other_chat_members(update: Update, context: CallbackContext) ->
             uid = member.user.id
             # Robust determination BEFORE any clearing attempts.
             local_spam = False
-            entry = repo.entry(uid, chat.id)
+            entry = await repo.entry(uid, chat.id)
             if entry:
                 _, spam_flag = entry
                 local_spam = bool(spam_flag)
             else:
                 # Fallback: direct DB per-group check (may create implicit entry) or cache heuristic
                 try:
-                    local_spam = repo.is_spammer_in_group(uid, chat.id)
+                    local_spam = await repo.is_spammer_in_group(uid, chat.id)
                 except Exception:
                     local_spam = uid in spammers_cache
             global_spam_cache = uid in spammers_cache
@@ -157,12 +149,12 @@ async def handle_other_chat_members(update: Update, context: CallbackContext) ->
                 other_groups = []
                 if entry:
                     try:
-                        repo.clear_spammer(member.user.id, chat.id)
+                        await repo.clear_spammer(member.user.id, chat.id)
                     except Exception:
                         pass
                 # Пытаемся получить список других групп, где он ещё спамер
                 try:
-                    other_groups = [g for g in repo.groups_with_spam_flag(member.user.id) if g != chat.id]
+                    other_groups = [g for g in (await repo.groups_with_spam_flag(member.user.id)) if g != chat.id]
                 except Exception:
                     # Если не удалось (например, нет БД), используем кэш как эвристику
                     other_groups = []
@@ -195,7 +187,7 @@ async def handle_other_chat_members(update: Update, context: CallbackContext) ->
                     pass
                 # Mark user as seen after unban (восстановлен репутационный доверенный статус)
                 try:
-                    repo.mark_seen(member.user.id, chat.id)
+                    await repo.mark_seen(member.user.id, chat.id)
                 except Exception:
                     pass
                 log_event("unban_clear_spammer", user_id=member.user.id, chat_id=chat.id, user=member.user, chat=chat, other_groups=other_groups)
@@ -206,7 +198,7 @@ async def handle_other_chat_members(update: Update, context: CallbackContext) ->
         uid = member.user.id
 
         # a) Глобально известный спамер -> локальный флаг + бан
-        if repo.is_spammer(uid):
+        if await repo.is_spammer(uid):
             # Already globally flagged; no need to re-mark in DB here (avoids redundant write during tests)
             try:
                 await context.bot.ban_chat_member(chat.id, uid)
@@ -216,12 +208,12 @@ async def handle_other_chat_members(update: Update, context: CallbackContext) ->
             return
 
         # b) Пользователь уже когда-то писал (seen в любой группе) -> создаём unseen запись (seen_message=FALSE), не добавляем в suspicious
-        if repo.is_seen(uid):
-            repo.mark_unseen(uid, chat.id)
+        if await repo.is_seen(uid):
+            await repo.mark_unseen(uid, chat.id)
             log_event("join_seen_elsewhere", user=member.user, chat=chat)
         else:
             # c) Совершенно новый глобально -> unseen + suspicious
-            repo.mark_unseen(uid, chat.id)
+            await repo.mark_unseen(uid, chat.id)
             suspicious_users_cache.add(uid)
             log_event("join_new_suspicious", user=member.user, chat=chat)
 
@@ -232,7 +224,7 @@ async def handle_other_chat_members(update: Update, context: CallbackContext) ->
             log_event("cas_check_error", user=member.user, chat=chat, error=str(e))
             is_cas_banned = False
         if is_cas_banned:
-            repo.mark_spammer(uid, chat.id)
+            await repo.mark_spammer(uid, chat.id)
             try:
                 await context.bot.ban_chat_member(chat.id, uid)
             except Exception:
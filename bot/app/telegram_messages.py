@@ -1,5 +1,7 @@
 from .logging_setup import logger, current_update_id, log_event, with_update_id
-from .antispam import check_openai_spam
+from .antispam import classify_with_openai, instructions_digest
+from .local_classifier import classify_locally, record_classification
+from .near_duplicates import near_duplicate_index, simhash
 
 from telegram import (
     Update,
@@ -12,8 +14,7 @@ from .formatting import display_chat, display_user
 from .database import (
     is_group_configured,
     configured_groups_cache,
-    get_user_entry,
-    get_user_state_repo,
+    get_async_user_state_repo,
 )
 import mysql.connector
 from .config import *
@@ -43,13 +44,31 @@ async def process_spam(update: Update, context: CallbackContext, user, chat) ->
     # Проверка через OpenAI
     if not is_spam:
         try:
-            group_settings = next(
-                (group["settings"] for group in configured_groups_cache if group["group_id"] == chat.id),
-                {})
-            instructions = group_settings.get("instructions", INSTRUCTIONS_DEFAULT_TEXT)
-            logger.debug(f"Sending prompt to OpenAI for user {display_user(user)}.")
+            instructions = configured_groups_cache.instructions(chat.id)
             if msg:
-                is_spam = await check_openai_spam(msg.text or msg.caption, instructions)
+                text = msg.text or msg.caption
+                # Близкая копия недавнего спама (при тех же инструкциях) — без запроса к OpenAI
+                scope = instructions_digest(instructions)
+                fingerprint = simhash(text) if text else None
+                if near_duplicate_index.find(scope, fingerprint) is not None:
+                    log_event('near_duplicate_spam', user_id=user.id, chat_id=chat.id, user=user, chat=chat)
+                    return True
+                # Уверенный вердикт локального классификатора; неуверенные — в OpenAI
+                local_verdict = classify_locally(text, scope)
+                if local_verdict is not None:
+                    log_event('local_classifier_verdict', user_id=user.id, chat_id=chat.id, user=user, chat=chat,
+                              is_spam=local_verdict)
+                    if local_verdict:
+                        near_duplicate_index.add(scope, fingerprint)
+                    return local_verdict
+                logger.debug(f"Sending prompt to OpenAI for user {display_user(user)}.")
+                verdict = await classify_with_openai(text, instructions)
+                # Нет вердикта (таймаут, нечитаемый ответ) — не спам, но и не обучающий пример
+                is_spam = bool(verdict)
+                if is_spam:
+                    near_duplicate_index.add(scope, fingerprint)
+                if text and verdict is not None:
+                    record_classification(user.id, chat.id, scope, text, verdict)
         except Exception as e:
             logger.exception(f"Error querying OpenAI: {e}")
     return is_spam
@@ -84,11 +103,11 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
     # Служебный анонимайзер Telegram для групп: @GroupAnonymousBot (id=1087968824)
     # Такие сообщения считаем доверенными и не гоняем через классификацию.
     if user.id == 1087968824 or (getattr(user, 'username', None) == 'GroupAnonymousBot'):
-        repo = get_user_state_repo()
-        entry = get_user_entry(user.id, chat.id)
+        repo = get_async_user_state_repo()
+        entry = await repo.entry(user.id, chat.id)
         if entry is None or entry[0] is False:
             try:
-                repo.mark_seen(user.id, chat.id)
+                await repo.mark_seen(user.id, chat.id)
             except Exception:
                 from .database import seen_users_cache
                 seen_users_cache.add(user.id)
@@ -108,12 +127,12 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
     except Exception:
         auto_forward = False
     if auto_forward:
-        repo = get_user_state_repo()
+        repo = get_async_user_state_repo()
         # Помечаем как seen в этой группе (если записи нет) и логируем событие
-        entry = get_user_entry(user.id, chat.id)
+        entry = await repo.entry(user.id, chat.id)
         if entry is None or entry[0] is False:
             try:
-                repo.mark_seen(user.id, chat.id)
+                await repo.mark_seen(user.id, chat.id)
             except Exception:
                 # Фолбэк: прямое добавление в кэш для тестовой среды без БД
                 from .database import seen_users_cache
@@ -128,10 +147,12 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
         log_event('skip_channel_autoforward', user_id=user.id, chat_id=chat.id, user=user, chat=chat)
         return
 
-    repo = get_user_state_repo()
+    repo = get_async_user_state_repo()
+    # Глобальные флаги + запись по группе: один запрос к БД (или ни одного при попадании в кэш)
+    state = await repo.resolve_user_state(user.id, chat.id)
 
     # 1. Сообщение от спамера глобально / локально
-    if repo.is_spammer(user.id):
+    if state.spammer:
         try:
             await context.bot.ban_chat_member(chat.id, user.id)
             try:
@@ -144,15 +165,15 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
         return
 
     # 2. Состояние в текущей группе
-    entry = get_user_entry(user.id, chat.id)  # (seen, spammer) or None
+    entry = state.entry  # (seen, spammer) or None
     current_seen = entry[0] if entry else None
     current_spammer = entry[1] if entry else None
 
     # 3. Если пользователь в общем suspicious списке -> проверить
-    if repo.is_suspicious(user.id):
+    if await repo.is_suspicious(user.id):
         is_spam = await process_spam(update, context, user, chat)
         if is_spam:
-            repo.mark_spammer(user.id, chat.id)
+            await repo.mark_spammer(user.id, chat.id)
             try:
                 await context.bot.ban_chat_member(chat.id, user.id)
                 try:
@@ -163,7 +184,7 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
                 pass
             log_event("first_message_spam", user_id=user.id, chat_id=chat.id)
         else:
-            repo.mark_seen(user.id, chat.id)
+            await repo.mark_seen(user.id, chat.id)
             log_event("first_message_ham", user_id=user.id, chat_id=chat.id)
         return
 
@@ -175,15 +196,15 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
     # 5. Нет записи по группе
     if entry is None:
         # 5a. Есть опыт (seen) где-либо -> переносим доверие
-        if repo.is_seen(user.id):
-            repo.mark_seen(user.id, chat.id)
+        if state.seen:
+            await repo.mark_seen(user.id, chat.id)
             log_event("inherit_trust", user_id=user.id, chat_id=chat.id)
             return
         # 5b. Совершенно новый -> создаём unseen (в репозитории он добавит в suspicious)
-        repo.mark_unseen(user.id, chat.id)
+        await repo.mark_unseen(user.id, chat.id)
         is_spam = await process_spam(update, context, user, chat)
         if is_spam:
-            repo.mark_spammer(user.id, chat.id)
+            await repo.mark_spammer(user.id, chat.id)
             try:
                 await context.bot.ban_chat_member(chat.id, user.id)
                 try:
@@ -197,21 +218,21 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
             from .logging_setup import logger as _lg
             _lg.info(f"Classified user={user.id} as SPAM in chat={chat.id} (redundant summary)")
         else:
-            repo.mark_seen(user.id, chat.id)
+            await repo.mark_seen(user.id, chat.id)
             log_event("new_user_ham", user_id=user.id, chat_id=chat.id)
         return
 
     # 6. Есть запись, но seen_message=False (редкий случай если потеря кэша)
     if entry and current_seen is False:
-        if repo.is_seen(user.id):
-            repo.mark_seen(user.id, chat.id)
+        if state.seen:
+            await repo.mark_seen(user.id, chat.id)
             log_event("late_seen_upgrade", user_id=user.id, chat_id=chat.id)
             return
         # fallback: считаем подозрительным повторно (обновляем unseen метку для консистентности)
-        repo.mark_unseen(user.id, chat.id)
+        await repo.mark_unseen(user.id, chat.id)
         is_spam = await process_spam(update, context, user, chat)
         if is_spam:
-            repo.mark_spammer(user.id, chat.id)
+            await repo.mark_spammer(user.id, chat.id)
             try:
                 await context.bot.ban_chat_member(chat.id, user.id)
                 try:
@@ -224,7 +245,7 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
             from .logging_setup import logger as _lg
             _lg.info(f"Classified user={user.id} as SPAM in chat={chat.id} (redundant summary)")
         else:
-            repo.mark_seen(user.id, chat.id)
+            await repo.mark_seen(user.id, chat.id)
             log_event("late_suspicious_ham", user_id=user.id, chat_id=chat.id)
         return
 